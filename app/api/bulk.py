@@ -0,0 +1,234 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+
+from app import config
+from app.api.chatwoot import ChatwootHandler, chatwoot_registry
+from app.api.conversation_actions import execute_conversation_actions, summarize_report
+from app.api.webhooks import get_chatwoot, reject_when_draining
+from app.models.non_database import BulkConversationActions, ConversationActions
+from app.redis_client import async_redis_client
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _job_key(job_id: str, suffix: str = "") -> str:
+    return f"chatdify:bulk:{job_id}{suffix}"
+
+
+class RateLimitGate:
+    """Pauses every worker of a bulk job while Chatwoot is rate limiting us"""
+
+    def __init__(self):
+        self._resume_at = 0.0
+
+    def pause(self, seconds: float) -> None:
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    async def wait(self) -> None:
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _rate_limit_delay(report: Dict[str, Dict[str, Any]]) -> Optional[float]:
+    """Seconds to back off if any action was rejected with 429, else None"""
+    for entry in report.values():
+        if entry.get("status_code") == 429:
+            try:
+                return float(entry.get("retry_after", config.BULK_RATE_LIMIT_BACKOFF_SECONDS))
+            except ValueError:
+                return config.BULK_RATE_LIMIT_BACKOFF_SECONDS
+    return None
+
+
+def _line(event: Dict[str, Any]) -> str:
+    return json.dumps(event, default=str) + "\n"
+
+
+async def _create_job(chatwoot: ChatwootHandler, conversation_ids: List[int], actions: ConversationActions) -> str:
+    job_id = uuid.uuid4().hex
+    ttl = config.BULK_JOB_TTL_SECONDS
+    async with async_redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(
+            _job_key(job_id),
+            mapping={
+                "account_id": chatwoot.account_id,
+                "actions": actions.model_dump_json(),
+                "total": len(conversation_ids),
+                "created_at": time.time(),
+            },
+        )
+        pipe.sadd(_job_key(job_id, ":pending"), *conversation_ids)
+        pipe.expire(_job_key(job_id), ttl)
+        pipe.expire(_job_key(job_id, ":pending"), ttl)
+        await pipe.execute()
+    return job_id
+
+
+async def _load_job(job_id: str) -> Dict[str, Any]:
+    job = await async_redis_client.hgetall(_job_key(job_id))
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Bulk job {job_id} not found or expired")
+    pending = await async_redis_client.smembers(_job_key(job_id, ":pending"))
+    results = await async_redis_client.hgetall(_job_key(job_id, ":results"))
+    return {
+        "job_id": job_id,
+        "account_id": job.get("account_id"),  # unset for jobs of the first account started before accounts
+        "actions": ConversationActions.model_validate_json(job["actions"]),
+        "total": int(job["total"]),
+        "pending": sorted(int(conversation_id) for conversation_id in pending),
+        "results": results,
+    }
+
+
+async def _record_result(job_id: str, conversation_id: int, status: str) -> None:
+    async with async_redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(_job_key(job_id, ":results"), str(conversation_id), status)
+        pipe.expire(_job_key(job_id, ":results"), config.BULK_JOB_TTL_SECONDS)
+        # Only failures stay pending, so a resumed run retries them
+        if status != "error":
+            pipe.srem(_job_key(job_id, ":pending"), conversation_id)
+        pipe.expire(_job_key(job_id, ":lock"), config.BULK_JOB_LOCK_SECONDS)
+        await pipe.execute()
+
+
+async def _acquire_job_lock(job_id: str) -> None:
+    """Make sure only one run of a job is active at a time"""
+    acquired = await async_redis_client.set(_job_key(job_id, ":lock"), "1", nx=True, ex=config.BULK_JOB_LOCK_SECONDS)
+    if not acquired:
+        raise HTTPException(status_code=409, detail=f"Bulk job {job_id} is already running")
+
+
+async def _run_job(
+    job_id: str, chatwoot: ChatwootHandler, conversation_ids: List[int], actions: ConversationActions
+) -> AsyncIterator[str]:
+    """Apply actions to every conversation and stream one NDJSON line per conversation.
+
+    Conversations are processed BULK_CONCURRENCY at a time. A 429 from Chatwoot pauses
+    all workers for Retry-After (or BULK_RATE_LIMIT_BACKOFF_SECONDS) and retries the
+    conversation up to BULK_MAX_ATTEMPTS times. If the client disconnects the remaining
+    work is cancelled and stays pending for /resume.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(config.BULK_CONCURRENCY)
+    gate = RateLimitGate()
+
+    async def apply(conversation_id: int) -> Dict[str, Dict[str, Any]]:
+        for attempt in range(1, config.BULK_MAX_ATTEMPTS + 1):
+            await gate.wait()
+            report = await execute_conversation_actions(
+                chatwoot, conversation_id, actions, resolve_team=chatwoot.get_team_id
+            )
+            delay = _rate_limit_delay(report)
+            if delay is None:
+                break
+            logger.warning(
+                f"Bulk job {job_id}: rate limited on conversation {conversation_id} "
+                f"(attempt {attempt}/{config.BULK_MAX_ATTEMPTS}), backing off {delay}s"
+            )
+            gate.pause(delay)
+        return report
+
+    async def process(conversation_id: int) -> None:
+        # Always emit an event, the stream waits for one per conversation
+        event: Dict[str, Any] = {"event": "result", "conversation_id": conversation_id}
+        async with semaphore:
+            try:
+                report = await apply(conversation_id)
+                event.update(status=summarize_report(report), actions=report)
+                await _record_result(job_id, conversation_id, event["status"])
+            except Exception as e:
+                logger.error(f"Bulk job {job_id}: failed to process conversation {conversation_id}: {e}")
+                event.update(status="error", error=str(e))
+        await queue.put(event)
+
+    yield _line({"event": "started", "job_id": job_id, "conversations": len(conversation_ids)})
+    workers = [asyncio.create_task(process(conversation_id)) for conversation_id in conversation_ids]
+    counts = {"success": 0, "partial": 0, "error": 0}
+    try:
+        for _ in workers:
+            event = await queue.get()
+            counts[event["status"]] += 1
+            yield _line(event)
+        await asyncio.gather(*workers)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await async_redis_client.delete(_job_key(job_id, ":lock"))
+
+    remaining = await async_redis_client.scard(_job_key(job_id, ":pending"))
+    yield _line({"event": "finished", "job_id": job_id, **counts, "remaining": remaining})
+
+
+@router.post("/conversations/bulk", dependencies=[Depends(reject_when_draining)])
+async def bulk_conversation_actions(
+    request: BulkConversationActions, chatwoot: ChatwootHandler = Depends(get_chatwoot)
+):
+    """
+    Apply the same actions to many conversations, streaming progress as NDJSON
+
+    The first line carries the job_id; each following line reports one conversation;
+    the last line summarizes the run. Conversations that failed (or were not reached
+    because the connection dropped) can be retried with /conversations/bulk/{job_id}/resume.
+
+    Example request body:
+        {
+            "conversation_ids": [101, 102, 103],
+            "actions": {"status": "open", "team": "Support", "labels": ["campaign-ended"]}
+        }
+    """
+    if not request.conversation_ids:
+        raise HTTPException(status_code=422, detail="conversation_ids must not be empty")
+    if len(request.conversation_ids) > config.BULK_MAX_CONVERSATIONS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {config.BULK_MAX_CONVERSATIONS} conversations per bulk job",
+        )
+
+    conversation_ids = list(dict.fromkeys(request.conversation_ids))
+    job_id = await _create_job(chatwoot, conversation_ids, request.actions)
+    await _acquire_job_lock(job_id)
+    logger.info(f"Started bulk job {job_id} for {len(conversation_ids)} conversations of account {chatwoot.account_id}")
+    return StreamingResponse(
+        _run_job(job_id, chatwoot, conversation_ids, request.actions), media_type=NDJSON_MEDIA_TYPE
+    )
+
+
+@router.post("/conversations/bulk/{job_id}/resume", dependencies=[Depends(reject_when_draining)])
+async def resume_bulk_conversation_actions(job_id: str):
+    """Re-run a bulk job for its conversations that are still pending (failed or never reached)"""
+    job = await _load_job(job_id)
+    # The job runs against the account it was started for, whatever the route
+    chatwoot = chatwoot_registry.get(job["account_id"])
+    if chatwoot is None:
+        raise HTTPException(status_code=404, detail=f"Chatwoot account {job['account_id']} is not served here")
+    await _acquire_job_lock(job_id)
+    logger.info(f"Resuming bulk job {job_id} with {len(job['pending'])} pending conversations")
+    return StreamingResponse(_run_job(job_id, chatwoot, job["pending"], job["actions"]), media_type=NDJSON_MEDIA_TYPE)
+
+
+@router.get("/conversations/bulk/{job_id}")
+async def get_bulk_job(job_id: str):
+    """Report progress of a bulk job"""
+    job = await _load_job(job_id)
+    running = bool(await async_redis_client.exists(_job_key(job_id, ":lock")))
+    return {
+        "job_id": job_id,
+        "account_id": job["account_id"],
+        "running": running,
+        "total": job["total"],
+        "done": job["total"] - len(job["pending"]),
+        "pending": job["pending"],
+        "results": job["results"],
+    }
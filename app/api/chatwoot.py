@@ -1,12 +1,99 @@
+import asyncio
 import logging
-from typing import Any, Dict, List, Optional
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 import httpx
 
 from app import config
+from app.utils import metrics
+from app.utils.accounts import ACCOUNTS, DEFAULT_ACCOUNT_ID, conversation_key, get_account, split_key
+from app.utils.bot_messages import arecord_sent_message, record_sent_message
+from app.utils.outbox import enqueue_message_sync
 
 logger = logging.getLogger(__name__)
 
+# Pooled client for frequent synchronous calls from Celery workers, created lazily so each
+# (forked) worker process gets its own. httpx.Client is thread-safe.
+_sync_client: Optional[httpx.Client] = None
+
+
+def _shared_sync_client() -> httpx.Client:
+    global _sync_client
+    if _sync_client is None or _sync_client.is_closed:
+        _sync_client = httpx.Client(
+            timeout=10.0,
+            limits=httpx.Limits(
+                max_connections=config.CHATWOOT_MAX_CONNECTIONS,
+                max_keepalive_connections=config.CHATWOOT_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+        )
+    return _sync_client
+
+
+class ConversationStateCache:
+    """Last known Chatwoot state per conversation, fed by webhook payloads and API responses.
+
+    Entries expire after ttl_seconds and the oldest ones are evicted past max_entries.
+    Only fields actually seen are stored, so a missing field never counts as a match.
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, Tuple[float, Dict[str, Any]]] = OrderedDict()
+
+    def get(self, conversation_id: int) -> Dict[str, Any]:
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return {}
+        stored_at, state = entry
+        if time.monotonic() - stored_at > self.ttl_seconds:
+            del self._entries[conversation_id]
+            return {}
+        return state
+
+    def update(self, conversation_id: int, **fields: Any) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        state = {**self.get(conversation_id), **fields}
+        self._entries[conversation_id] = (time.monotonic(), state)
+        self._entries.move_to_end(conversation_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def forget(self, conversation_id: int) -> None:
+        self._entries.pop(conversation_id, None)
+
+    def observe(self, conversation: Dict[str, Any]) -> None:
+        """Record the state carried by a Chatwoot conversation object"""
+        conversation_id = conversation.get("id")
+        if not conversation_id:
+            return
+        fields: Dict[str, Any] = {}
+        for key in ("status", "priority", "labels", "custom_attributes"):
+            if key in conversation:
+                fields[key] = conversation[key]
+        meta = conversation.get("meta")
+        if isinstance(meta, dict):
+            if "assignee" in meta:
+                fields["assignee_id"] = (meta["assignee"] or {}).get("id")
+            if "team" in meta:
+                fields["team_id"] = (meta["team"] or {}).get("id")
+        if fields:
+            self.update(int(conversation_id), **fields)
+
+    def holds(self, conversation_id: int, key: str, value: Any) -> bool:
+        """True if the known state already has key == value"""
+        state = self.get(conversation_id)
+        if key not in state:
+            return False
+        if key == "labels":
+            return set(state[key] or []) == set(value)
+        return state[key] == value
+
 
 class ChatwootHandler:
     def __init__(
@@ -16,10 +103,14 @@ class ChatwootHandler:
         account_id: str | None = None,
         admin_api_key: str | None = None,
     ):
-        self.api_url = api_url or config.CHATWOOT_API_URL
-        self.account_id = account_id or config.CHATWOOT_ACCOUNT_ID
-        self.api_key = api_key or config.CHATWOOT_API_KEY
-        self.admin_api_key = admin_api_key or config.CHATWOOT_ADMIN_API_KEY
+        # Credentials of a configured account (CHATWOOT_ACCOUNTS) unless given explicitly
+        account = get_account(account_id)
+        self.account_id = str(account_id or DEFAULT_ACCOUNT_ID)
+        self.api_url = api_url or (account and account.api_url) or config.CHATWOOT_API_URL
+        self.api_key = api_key or (account.api_key if account else config.CHATWOOT_API_KEY)
+        self.admin_api_key = admin_api_key or (
+            (account.admin_api_key or account.api_key) if account else config.CHATWOOT_ADMIN_API_KEY
+        )
         self.headers = {
             "api_access_token": self.api_key,
             "Content-Type": "application/json",
@@ -31,11 +122,87 @@ class ChatwootHandler:
         # Base URLs
         self.account_url = f"{self.api_url}/accounts/{self.account_id}"
         self.conversations_url = f"{self.account_url}/conversations"
+        # Pooled client shared by async calls between open() and aclose()
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._owns_client = False
+        # Known conversation state, used to skip writes that would not change anything
+        self.state = ConversationStateCache(config.CHATWOOT_STATE_TTL_SECONDS, config.CHATWOOT_STATE_MAX_ENTRIES)
+        # Team name (lowercase) to ID, with ENABLE_TEAM_CACHE
+        self.team_cache: Dict[str, int] = {}
+        self._team_cache_updated_at = 0.0
+        self._team_cache_lock = asyncio.Lock()
+
+    def conversation_key(self, conversation_id: int | str) -> str:
+        """Key of one of this account's conversations, see app/utils/accounts.py"""
+        return conversation_key(self.account_id, conversation_id)
+
+    def _suppressed(self, operation: str, conversation_id: int, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Count and log a write skipped because the known state already matches"""
+        logger.info(f"Skipping {operation} for conversation {conversation_id}: already in desired state")
+        metrics.incr(f"chatwoot.suppressed_writes.{operation}")
+        return {**result, "suppressed": True}
+
+    async def _asuppressed(self, operation: str, conversation_id: int, result: Dict[str, Any]) -> Dict[str, Any]:
+        """_suppressed for the async methods, without blocking the event loop on the metric"""
+        logger.info(f"Skipping {operation} for conversation {conversation_id}: already in desired state")
+        await metrics.aincr(f"chatwoot.suppressed_writes.{operation}")
+        return {**result, "suppressed": True}
+
+    @staticmethod
+    def _status_payload(conversation_id: int, status: str) -> Dict[str, Any]:
+        """Shape of a toggle_status response, returned when the call is suppressed"""
+        return {"payload": {"success": True, "conversation_id": conversation_id, "current_status": status}}
+
+    async def open(self, client: Optional[httpx.AsyncClient] = None) -> None:
+        """Open a pooled client so concurrent calls reuse keep-alive connections.
+
+        With a client, use that one instead (e.g. shared by the handlers of several accounts);
+        whoever created it closes it.
+        """
+        if client is not None:
+            await self.aclose()
+            self._async_client, self._owns_client = client, False
+        elif self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=config.CHATWOOT_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.CHATWOOT_MAX_KEEPALIVE_CONNECTIONS,
+                )
+            )
+            self._owns_client = True
+
+    async def aclose(self) -> None:
+        """Close the pooled client, if any (a shared one is only let go)"""
+        if self._async_client is not None and self._owns_client:
+            await self._async_client.aclose()
+        self._async_client = None
+
+    async def __aenter__(self) -> "ChatwootHandler":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    @asynccontextmanager
+    async def _client(self) -> AsyncIterator[httpx.AsyncClient]:
+        """Yield the pooled client when open, otherwise a short-lived one"""
+        if self._async_client is not None and not self._async_client.is_closed:
+            yield self._async_client
+        else:
+            async with httpx.AsyncClient() as client:
+                yield client
+
+    def toggle_typing_sync(self, conversation_id: int, typing: bool) -> None:
+        """Switch the typing indicator the customer sees on or off (synchronous, pooled client)"""
+        url = f"{self.conversations_url}/{conversation_id}/toggle_typing_status"
+        response = _shared_sync_client().post(
+            url, json={"typing_status": "on" if typing else "off"}, headers=self.headers
+        )
+        response.raise_for_status()
 
     def send_message_sync(self, conversation_id: int, message: str, private: bool = False):
         """Synchronous version of send_message for use in Celery tasks"""
-        import httpx
-
         url = f"{self.conversations_url}/{conversation_id}/messages"
 
         data = {
@@ -44,10 +211,33 @@ class ChatwootHandler:
             "private": private,
         }
 
-        with httpx.Client() as client:
-            response = client.post(url, json=data, headers=self.headers, timeout=30.0)
+        response = _shared_sync_client().post(url, json=data, headers=self.headers, timeout=30.0)
+        response.raise_for_status()
+        result = response.json()
+        record_sent_message(self.conversation_key(conversation_id), result, private=private)
+        return result
+
+    def queue_message_sync(
+        self, conversation_id: int, message: str, private: bool = False, idempotency_key: Optional[str] = None
+    ) -> None:
+        """Hand a message to the outbox dispatcher (OUTBOX_ENABLED), otherwise send it right away"""
+        if config.OUTBOX_ENABLED:
+            enqueue_message_sync(
+                conversation_id,
+                message,
+                private=private,
+                idempotency_key=idempotency_key,
+                account_id=self.account_id,
+            )
+        else:
+            self.send_message_sync(conversation_id=conversation_id, message=message, private=private)
+
+    async def toggle_typing(self, conversation_id: int, typing: bool) -> None:
+        """Switch the typing indicator the customer sees on or off"""
+        url = f"{self.conversations_url}/{conversation_id}/toggle_typing_status"
+        async with self._client() as client:
+            response = await client.post(url, json={"typing_status": "on" if typing else "off"}, headers=self.headers)
             response.raise_for_status()
-            return response.json()
 
     async def send_message(
         self,
@@ -70,23 +260,29 @@ class ChatwootHandler:
             data["attachments"] = [{"url": url} for url in attachments]
 
         try:
-            async with httpx.AsyncClient() as client:
+            async with self._client() as client:
                 response = await client.post(url, json=data, headers=self.headers)
                 response.raise_for_status()
-                return response.json()
+                result = response.json()
+            await arecord_sent_message(self.conversation_key(conversation_id), result, private=private)
+            return result
         except Exception as e:
             logger.error(f"Failed to send message to conversation {conversation_id}: {e}")
             raise
 
-    async def add_labels(self, conversation_id: int, labels: List[str]) -> Dict[str, Any]:
-        """Add labels to a conversation"""
+    async def add_labels(self, conversation_id: int, labels: List[str], force: bool = False) -> Dict[str, Any]:
+        """Add labels to a conversation (skipped if the known labels already match, unless force)"""
         url = f"{self.conversations_url}/{conversation_id}/labels"
+        if not force and self.state.holds(conversation_id, "labels", labels):
+            return await self._asuppressed("add_labels", conversation_id, {"payload": labels})
 
         try:
-            async with httpx.AsyncClient() as client:
+            async with self._client() as client:
                 response = await client.post(url, json={"labels": labels}, headers=self.headers)
                 response.raise_for_status()
-                return response.json()
+                result = response.json()
+                self.state.update(conversation_id, labels=result.get("payload", labels))
+                return result
         except Exception as e:
             logger.error(f"Failed to add labels to conversation {conversation_id}: {e}")
             raise
@@ -96,10 +292,12 @@ class ChatwootHandler:
         url = f"{self.conversations_url}/{conversation_id}"
 
         try:
-            async with httpx.AsyncClient() as client:
+            async with self._client() as client:
                 response = await client.get(url, headers=self.admin_headers)
                 response.raise_for_status()
-                return response.json()
+                result = response.json()
+                self.state.observe(result)
+                return result
         except httpx.HTTPStatusError as e:
             logger.error(
                 f"Get conversation failed for {conversation_id}:\n"
@@ -109,31 +307,43 @@ class ChatwootHandler:
             )
             raise
 
-    async def assign_conversation(self, conversation_id: int, assignee_id: int) -> Dict[str, Any]:
-        """Assign a conversation to an agent."""
+    async def assign_conversation(self, conversation_id: int, assignee_id: int, force: bool = False) -> Dict[str, Any]:
+        """Assign a conversation to an agent (skipped if already assigned to them, unless force)."""
         url = f"{self.conversations_url}/{conversation_id}/assignments"
         data = {"assignee_id": assignee_id}
+        if not force and self.state.holds(conversation_id, "assignee_id", assignee_id):
+            return await self._asuppressed("assign_conversation", conversation_id, {"id": assignee_id})
 
         try:
-            async with httpx.AsyncClient() as client:
+            async with self._client() as client:
                 response = await client.post(url, json=data, headers=self.headers)
                 response.raise_for_status()
+                self.state.update(conversation_id, assignee_id=assignee_id)
                 return response.json()
         except Exception as e:
             logger.error(f"Failed to assign conversation {conversation_id} to agent {assignee_id}: {e}")
             raise
 
-    async def update_custom_attributes(self, conversation_id: int, custom_attributes: Dict[str, Any]) -> Dict[str, Any]:
-        """Update custom attributes for a conversation using the provided account_id and conversation_id."""
+    async def update_custom_attributes(
+        self, conversation_id: int, custom_attributes: Dict[str, Any], force: bool = False
+    ) -> Dict[str, Any]:
+        """Update custom attributes for a conversation using the provided account_id and conversation_id.
+        Skipped if the known attributes already match, unless force.
+        """
         custom_attrs_url = f"{self.conversations_url}/{conversation_id}/custom_attributes"
+        if not force and self.state.holds(conversation_id, "custom_attributes", custom_attributes):
+            return await self._asuppressed(
+                "update_custom_attributes", conversation_id, {"custom_attributes": custom_attributes}
+            )
 
         try:
-            async with httpx.AsyncClient() as client:
+            async with self._client() as client:
                 payload = {"custom_attributes": custom_attributes}
 
                 # Use POST to update attributes
                 response = await client.post(custom_attrs_url, json=payload, headers=self.headers)
                 response.raise_for_status()
+                self.state.update(conversation_id, custom_attributes=custom_attributes)
                 if response.content and len(response.content.strip()) > 0:
                     try:
                         return response.json()
@@ -145,17 +355,21 @@ class ChatwootHandler:
             logger.error(f"Failed to update custom attributes for conversation {conversation_id}: {e}")
             raise
 
-    async def toggle_priority(self, conversation_id: int, priority: str) -> Dict[str, Any]:
+    async def toggle_priority(self, conversation_id: int, priority: str, force: bool = False) -> Dict[str, Any]:
         """Toggle the priority of a conversation
         Valid priorities: 'urgent', 'high', 'medium', 'low', None
+        Skipped if the known priority already matches, unless force.
         """
         url = f"{self.conversations_url}/{conversation_id}/toggle_priority"
         data = {"priority": priority}
+        if not force and self.state.holds(conversation_id, "priority", priority):
+            return await self._asuppressed("toggle_priority", conversation_id, {})
 
         try:
-            async with httpx.AsyncClient() as client:
+            async with self._client() as client:
                 response = await client.post(url, json=data, headers=self.headers)
                 response.raise_for_status()
+                self.state.update(conversation_id, priority=priority)
                 if response.content and len(response.content.strip()) > 0:
                     try:
                         return response.json()
@@ -173,7 +387,7 @@ class ChatwootHandler:
             raise
 
     async def assign_team(
-        self, conversation_id: int, team_id: int = 0, team_name: Optional[str] = None
+        self, conversation_id: int, team_id: int = 0, team_name: Optional[str] = None, force: bool = False
     ) -> Dict[str, Any]:
         """Assign a conversation to a team.
 
@@ -181,6 +395,7 @@ class ChatwootHandler:
             conversation_id: The ID of the conversation to assign
             team_id: The ID of the team to assign to
             team_name: The name of the team to assign to (will be looked up if provided)
+            force: Send the request even if the conversation is known to be in that team already
         """
         url = f"{self.conversations_url}/{conversation_id}/assignments"
 
@@ -191,11 +406,14 @@ class ChatwootHandler:
             team_id = team_map.get(team_name.lower(), 0)
 
         data = {"team_id": team_id}
+        if not force and self.state.holds(conversation_id, "team_id", team_id):
+            return await self._asuppressed("assign_team", conversation_id, {"team_id": team_id})
 
         try:
-            async with httpx.AsyncClient() as client:
+            async with self._client() as client:
                 response = await client.post(url, json=data, headers=self.headers)
                 response.raise_for_status()
+                self.state.update(conversation_id, team_id=team_id)
                 return response.json()
         except Exception as e:
             logger.error(f"Failed to assign conversation {conversation_id} to team {team_id or team_name}: {e}")
@@ -229,7 +447,7 @@ class ChatwootHandler:
         }
 
         try:
-            async with httpx.AsyncClient() as client:
+            async with self._client() as client:
                 response = await client.post(url, json=data, headers=self.headers)
                 response.raise_for_status()
                 return response.json()
@@ -243,17 +461,24 @@ class ChatwootHandler:
         status: str,
         previous_status: Optional[str] = None,
         is_error_transition: bool = False,
+        force: bool = False,
     ) -> Dict[str, Any]:
         """Toggle conversation status
         Valid statuses: 'open', 'resolved', 'pending', 'snoozed'
+        Skipped if the known status already matches, unless force.
         """
         url = f"{self.conversations_url}/{conversation_id}/toggle_status"
         data = {"status": status}
+        if not force and self.state.holds(conversation_id, "status", status):
+            return await self._asuppressed(
+                "toggle_status", conversation_id, self._status_payload(conversation_id, status)
+            )
 
         try:
-            async with httpx.AsyncClient() as client:
+            async with self._client() as client:
                 response = await client.post(url, json=data, headers=self.headers)
                 response.raise_for_status()
+                self.state.update(conversation_id, status=status)
 
                 # Send internal notification if status changed from pending to open
                 # due to an error
@@ -291,38 +516,42 @@ class ChatwootHandler:
         status: str,
         previous_status: Optional[str] = None,
         is_error_transition: bool = False,
+        force: bool = False,
     ) -> Dict[str, Any]:
         """Toggle conversation status synchronously
         Valid statuses: 'open', 'resolved', 'pending', 'snoozed'
+        Skipped if the known status already matches, unless force.
         """
         url = f"{self.conversations_url}/{conversation_id}/toggle_status"
         data = {"status": status}
+        if not force and self.state.holds(conversation_id, "status", status):
+            return self._suppressed("toggle_status", conversation_id, self._status_payload(conversation_id, status))
 
         try:
-            with httpx.Client() as client:
-                response = client.post(url, json=data, headers=self.headers)
-                response.raise_for_status()
-
-                # Send internal notification if status changed from pending to open
-                # due to an error
-                if status == "open" and previous_status == "pending" and is_error_transition:
-                    try:
-                        logger.info(
-                            f"Conversation {conversation_id} (sync) changed from pending to open due to error,"
-                            "sending internal notification."
-                        )
-                        self.send_message_sync(
-                            conversation_id=conversation_id,
-                            message=config.BOT_ERROR_MESSAGE_INTERNAL,
-                            private=True,
-                        )
-                    except Exception as e_notify:
-                        logger.error(
-                            "Failed to send 'pending to open internal error' notification (sync)"
-                            f" for convo {conversation_id}: {e_notify}"
-                        )
+            response = _shared_sync_client().post(url, json=data, headers=self.headers)
+            response.raise_for_status()
+            self.state.update(conversation_id, status=status)
+
+            # Send internal notification if status changed from pending to open
+            # due to an error
+            if status == "open" and previous_status == "pending" and is_error_transition:
+                try:
+                    logger.info(
+                        f"Conversation {conversation_id} (sync) changed from pending to open due to error,"
+                        "sending internal notification."
+                    )
+                    self.queue_message_sync(
+                        conversation_id=conversation_id,
+                        message=config.BOT_ERROR_MESSAGE_INTERNAL,
+                        private=True,
+                    )
+                except Exception as e_notify:
+                    logger.error(
+                        "Failed to send 'pending to open internal error' notification (sync)"
+                        f" for convo {conversation_id}: {e_notify}"
+                    )
 
-                return response.json()
+            return response.json()
         except httpx.HTTPStatusError as e:
             logger.error(
                 f"Status update failed for conversation {conversation_id}:\n"
@@ -341,7 +570,7 @@ class ChatwootHandler:
         url = f"{self.account_url}/teams"
 
         try:
-            async with httpx.AsyncClient() as client:
+            async with self._client() as client:
                 response = await client.get(url, headers=self.admin_headers)
                 response.raise_for_status()
                 return response.json()
@@ -390,6 +619,45 @@ class ChatwootHandler:
                 },
             ]
 
+    async def refresh_team_cache(self) -> Dict[str, int]:
+        """Reload the team name to ID mapping of the account (ENABLE_TEAM_CACHE)"""
+        if not config.ENABLE_TEAM_CACHE:
+            logger.warning("Team caching is disabled. Skipping cache update.")
+            return {}
+
+        async with self._team_cache_lock:
+            try:
+                teams = await self.get_teams()
+                # Case-insensitive mapping from name to ID
+                self.team_cache = {team["name"].lower(): team["id"] for team in teams}
+                self._team_cache_updated_at = time.time()
+                logger.info(f"Updated team cache of account {self.account_id} with {len(self.team_cache)} teams")
+                return self.team_cache
+            except Exception as e:
+                logger.error(f"Failed to update team cache of account {self.account_id}: {e}", exc_info=True)
+                raise
+
+    async def get_team_id(self, team_name: str) -> Optional[int]:
+        """Team ID from its name, from the cache (reloaded after TEAM_CACHE_TTL_HOURS) or straight from Chatwoot"""
+        if not config.ENABLE_TEAM_CACHE:
+            try:
+                teams = await self.get_teams()
+                return {team["name"].lower(): team["id"] for team in teams}.get(team_name.lower())
+            except Exception as e:
+                logger.error(f"Failed to get team ID for '{team_name}' (no cache): {e}")
+                return None
+
+        cache_age_hours = (time.time() - self._team_cache_updated_at) / 3600
+        if not self.team_cache or cache_age_hours > config.TEAM_CACHE_TTL_HOURS:
+            await self.refresh_team_cache()
+        return self.team_cache.get(team_name.lower())
+
+    async def team_names(self) -> List[str]:
+        """Lowercase names of the account's teams, e.g. for error messages"""
+        if config.ENABLE_TEAM_CACHE:
+            return list(self.team_cache)
+        return [team["name"].lower() for team in await self.get_teams()]
+
     async def get_conversation_list(self, status: str = "all", assignee_type: str = "all") -> List[Dict[str, Any]]:
         """Get a list of conversations based on filters.
 
@@ -403,7 +671,7 @@ class ChatwootHandler:
         url = f"{self.conversations_url}?status={status}&assignee_type={assignee_type}"
 
         try:
-            async with httpx.AsyncClient() as client:
+            async with self._client() as client:
                 response = await client.get(url, headers=self.headers)
                 response.raise_for_status()
                 data = response.json()
@@ -411,3 +679,65 @@ class ChatwootHandler:
         except Exception as e:
             logger.error(f"Failed to get conversation list: {e}")
             raise
+
+
+class ChatwootRegistry:
+    """One long-lived handler per account of CHATWOOT_ACCOUNTS (API side).
+
+    The handlers share one pooled client between open() and aclose(); their conversation state
+    and team caches stay per account.
+    """
+
+    def __init__(self):
+        self.handlers = {account_id: ChatwootHandler(account_id=account_id) for account_id in ACCOUNTS}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def get(self, account_id: Optional[int | str] = None) -> Optional[ChatwootHandler]:
+        """Handler of an account, the first one for no ID; None if the account isn't served here"""
+        account = get_account(account_id)
+        return self.handlers[account.account_id] if account else None
+
+    def for_key(self, key: int | str) -> Tuple[Optional[ChatwootHandler], int]:
+        """Handler of a conversation key's account and the conversation's Chatwoot ID"""
+        account_id, conversation_id = split_key(key)
+        return self.get(account_id), conversation_id
+
+    async def open(self) -> None:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=config.CHATWOOT_MAX_CONNECTIONS,
+                    max_keepalive_connections=config.CHATWOOT_MAX_KEEPALIVE_CONNECTIONS,
+                )
+            )
+        for handler in self.handlers.values():
+            await handler.open(self._client)
+
+    async def aclose(self) -> None:
+        for handler in self.handlers.values():
+            await handler.aclose()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self) -> "ChatwootRegistry":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+
+chatwoot_registry = ChatwootRegistry()
+
+
+def chatwoot_for(key: int | str) -> Tuple[ChatwootHandler, int]:
+    """A new handler for the account of a conversation key, and the conversation's Chatwoot ID (worker side).
+
+    Workers see no webhooks that would keep a long-lived conversation state current, so each
+    call starts from an empty one; the connections are pooled all the same.
+    """
+    account_id, conversation_id = split_key(key)
+    if get_account(account_id) is None:
+        raise ValueError(f"Chatwoot account {account_id} is not configured")
+    return ChatwootHandler(account_id=account_id), conversation_id
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def merge_labels(pending: List[str], new: List[str]) -> List[str]:
+    """Union two label lists, keeping first-seen order"""
+    return list(dict.fromkeys([*pending, *new]))
+
+
+def merge_custom_attributes(pending: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Merge two attribute dicts, later values win"""
+    return {**pending, **new}
+
+
+class WriteCoalescer:
+    """Merge writes for the same conversation that arrive within a short window.
+
+    The first write for a conversation opens the window; writes arriving before it
+    closes are merged into it. When the window closes a single write is issued and
+    every waiting caller receives its result (or its exception).
+    A window of 0 disables coalescing and writes go straight through.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float,
+        merge: Callable[[Any, Any], Any],
+        write: Callable[[int | str, Any], Awaitable[Any]],
+    ):
+        self.name = name
+        self.window_seconds = window_seconds
+        self._merge = merge
+        self._write = write
+        self._pending: Dict[int | str, Tuple[Any, asyncio.Future]] = {}
+        self._flush_tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, conversation_id: int | str, value: Any) -> Any:
+        """Queue a write and wait for the (possibly merged) result"""
+        if self.window_seconds <= 0:
+            return await self._write(conversation_id, value)
+
+        if conversation_id in self._pending:
+            merged, future = self._pending[conversation_id]
+            self._pending[conversation_id] = (self._merge(merged, value), future)
+            logger.debug(f"Coalesced {self.name} write for conversation {conversation_id}")
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[conversation_id] = (value, future)
+            task = asyncio.create_task(self._flush_after_window(conversation_id))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+        # Shield so one cancelled caller does not cancel the write for everyone else
+        return await asyncio.shield(future)
+
+    async def _flush_after_window(self, conversation_id: int | str) -> None:
+        await asyncio.sleep(self.window_seconds)
+        await self._flush(conversation_id)
+
+    async def _flush(self, conversation_id: int | str) -> None:
+        entry = self._pending.pop(conversation_id, None)
+        if entry is None:
+            return
+        value, future = entry
+        try:
+            result = await self._write(conversation_id, value)
+        except Exception as e:
+            logger.error(f"Coalesced {self.name} write failed for conversation {conversation_id}: {e}")
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    async def flush_all(self) -> None:
+        """Write out every pending batch immediately (e.g. on shutdown)"""
+        await asyncio.gather(*(self._flush(conversation_id) for conversation_id in list(self._pending)))
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import re
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from app import config
+from app.api.chatwoot import ChatwootHandler
+from app.models.non_database import ConversationActions
+
+logger = logging.getLogger(__name__)
+
+TeamResolver = Callable[[str], Awaitable[Optional[int]]]
+
+# Dify can embed actions in its answer as <chatdify_actions>{...json...}</chatdify_actions>
+EMBEDDED_ACTIONS_PATTERN = re.compile(
+    rf"<{re.escape(config.DIFY_ACTIONS_TAG)}>(.*?)</{re.escape(config.DIFY_ACTIONS_TAG)}>",
+    re.DOTALL,
+)
+
+
+def _is_none_value(value: Optional[str]) -> bool:
+    """Mirror the single-action endpoints, which treat empty values and 'none' as no-ops"""
+    return not value or value.lower() == "none"
+
+
+async def execute_conversation_actions(
+    chatwoot: ChatwootHandler,
+    conversation_id: int,
+    actions: ConversationActions,
+    resolve_team: Optional[TeamResolver] = None,
+    max_concurrency: Optional[int] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Apply a batch of conversation updates and return a per-action report.
+
+    Priority, labels, custom attributes and team assignment are independent and run
+    concurrently (bounded by max_concurrency). The status change runs last because
+    an assignment can change the conversation status on the Chatwoot side.
+
+    Args:
+        chatwoot: Handler used for the Chatwoot calls (open it first to share connections)
+        conversation_id: The ID of the conversation to update
+        actions: The updates to apply; unset fields are skipped
+        resolve_team: Coroutine mapping a team name to its ID (defaults to a Chatwoot lookup)
+        max_concurrency: Max parallel Chatwoot calls (defaults to CONVERSATION_ACTIONS_CONCURRENCY)
+
+    Returns:
+        Mapping of action name to {"status": "success"|"skipped"|"error", ...}
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or config.CONVERSATION_ACTIONS_CONCURRENCY)
+    report: Dict[str, Dict[str, Any]] = {}
+
+    async def run(name: str, call: Callable[[], Awaitable[Any]]) -> None:
+        async with semaphore:
+            try:
+                report[name] = {"status": "success", "result": await call()}
+            except httpx.HTTPStatusError as e:
+                logger.error(f"Action '{name}' failed for conversation {conversation_id}: {e}")
+                report[name] = {"status": "error", "error": str(e), "status_code": e.response.status_code}
+                if "Retry-After" in e.response.headers:
+                    report[name]["retry_after"] = e.response.headers["Retry-After"]
+            except Exception as e:
+                logger.error(f"Action '{name}' failed for conversation {conversation_id}: {e}")
+                report[name] = {"status": "error", "error": str(e)}
+
+    async def lookup_team(team_name: str) -> Optional[int]:
+        teams = await chatwoot.get_teams()
+        return {team["name"].lower(): team["id"] for team in teams}.get(team_name.lower())
+
+    async def assign_team(team_name: str) -> Dict[str, Any]:
+        team_id = await (resolve_team or lookup_team)(team_name)
+        if team_id is None:
+            raise ValueError(f"Team '{team_name}' not found")
+        result = await chatwoot.assign_team(conversation_id=conversation_id, team_id=team_id, force=force)
+        return {"team_id": team_id, "response": result}
+
+    force = actions.force
+    independent = []
+    if actions.priority is not None:
+        priority = actions.priority.value
+        if _is_none_value(priority):
+            report["priority"] = {"status": "skipped", "reason": "no priority provided"}
+        else:
+            independent.append(
+                run(
+                    "priority",
+                    lambda: chatwoot.toggle_priority(conversation_id=conversation_id, priority=priority, force=force),
+                )
+            )
+    if actions.labels is not None:
+        labels = actions.labels
+        independent.append(
+            run("labels", lambda: chatwoot.add_labels(conversation_id=conversation_id, labels=labels, force=force))
+        )
+    if actions.custom_attributes is not None:
+        custom_attributes = actions.custom_attributes
+        if not custom_attributes:
+            report["custom_attributes"] = {"status": "skipped", "reason": "no custom attributes provided"}
+        else:
+            independent.append(
+                run(
+                    "custom_attributes",
+                    lambda: chatwoot.update_custom_attributes(
+                        conversation_id=conversation_id, custom_attributes=custom_attributes, force=force
+                    ),
+                )
+            )
+    if actions.team is not None:
+        team = actions.team
+        if _is_none_value(team):
+            report["team"] = {"status": "skipped", "reason": "no team provided"}
+        else:
+            independent.append(run("team", lambda: assign_team(team)))
+
+    await asyncio.gather(*independent)
+
+    # Status goes after the assignment so it is the final state the conversation ends up in
+    if actions.status is not None:
+        status = actions.status.value
+        await run("status", lambda: chatwoot.toggle_status(conversation_id=conversation_id, status=status, force=force))
+
+    return report
+
+
+def summarize_report(report: Dict[str, Dict[str, Any]]) -> str:
+    """Collapse a per-action report into 'success', 'partial' or 'error'"""
+    failed = sum(1 for entry in report.values() if entry["status"] == "error")
+    if not failed:
+        return "success"
+    return "error" if failed == len(report) else "partial"
+
+
+def extract_embedded_actions(
+    answer: str, metadata: Optional[Dict[str, Any]] = None
+) -> Tuple[str, Optional[ConversationActions]]:
+    """Pull a structured action block out of a Dify answer.
+
+    The block is looked up in the answer text first, then under DIFY_ACTIONS_TAG in the
+    response metadata. Every block is stripped from the answer, even an invalid one, so it
+    never reaches the customer.
+
+    Returns:
+        The customer-visible answer and the parsed actions (None if there were none)
+    """
+    raw_blocks = EMBEDDED_ACTIONS_PATTERN.findall(answer)
+    clean_answer = EMBEDDED_ACTIONS_PATTERN.sub("", answer).strip() if raw_blocks else answer
+
+    raw: Any = raw_blocks[0] if raw_blocks else (metadata or {}).get(config.DIFY_ACTIONS_TAG)
+    if not raw:
+        return clean_answer, None
+    if len(raw_blocks) > 1:
+        logger.warning(f"Dify answer has {len(raw_blocks)} action blocks, only the first one is applied")
+    try:
+        data = json.loads(raw) if isinstance(raw, str) else raw
+        return clean_answer, ConversationActions.model_validate(data)
+    except Exception as e:
+        logger.error(f"Ignoring invalid action block in Dify response: {e}. Block: {raw}")
+        return clean_answer, None
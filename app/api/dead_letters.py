@@ -0,0 +1,142 @@
+import logging
+import time
+from datetime import UTC, datetime
+from typing import Any, Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app import config
+from app.api.webhooks import enqueue_dify_message
+from app.database import get_db
+from app.models.database import DeadLetter, Dialogue
+from app.models.non_database import DeadLetterReplay
+from app.utils import metrics
+from app.utils.accounts import conversation_key
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Dify tasks that failed after all retries (recorded by tasks.handle_dify_error). Replays are queued
+# with increasing countdowns so a bulk replay after an incident starts at a controlled rate instead
+# of hitting Dify all at once. They don't take a conversation lane ticket: a delayed ticket would
+# hold back the live messages of the conversation until its countdown ran out.
+
+REPLAYABLE_TASKS = {"app.tasks.process_message_with_dify"}
+
+
+def _filtered(
+    query,
+    error_type: Optional[str],
+    conversation_id: Optional[int],
+    account_id: Optional[str],
+    since: Optional[datetime],
+    until: Optional[datetime],
+    replayed: Optional[bool],
+):
+    if error_type:
+        query = query.where(DeadLetter.error_type == error_type)
+    if conversation_id is not None:
+        query = query.where(DeadLetter.chatwoot_conversation_id == conversation_key(account_id, conversation_id))
+    if since:
+        query = query.where(DeadLetter.failed_at >= since)
+    if until:
+        query = query.where(DeadLetter.failed_at < until)
+    if replayed is True:
+        query = query.where(DeadLetter.replays > 0)
+    elif replayed is False:
+        query = query.where(DeadLetter.replays == 0)
+    return query
+
+
+def _entry(dead_letter: DeadLetter) -> Dict[str, Any]:
+    args = dead_letter.payload.get("args", [])
+    return {
+        **dead_letter.model_dump(exclude={"payload"}),
+        "message": args[0] if args else None,
+        "message_type": args[4] if len(args) > 4 else None,
+    }
+
+
+@router.get("/dead-letters")
+async def list_dead_letters(
+    error_type: Optional[str] = None,
+    conversation_id: Optional[int] = None,
+    account_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    replayed: Optional[bool] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    List failed Dify tasks, newest first
+
+    Filters: error_type (exception class, e.g. HTTPStatusError), conversation_id (of the Chatwoot
+    account account_id, the first configured one by default), since/until (failure time window,
+    ISO 8601) and replayed (true/false).
+    """
+    query = _filtered(select(DeadLetter), error_type, conversation_id, account_id, since, until, replayed)
+    result = await db.execute(query.order_by(DeadLetter.failed_at.desc()).offset(offset).limit(limit))
+    entries = [_entry(dead_letter) for dead_letter in result.scalars().all()]
+    return {"count": len(entries), "entries": entries}
+
+
+@router.post("/dead-letters/replay")
+async def replay_dead_letters(request: DeadLetterReplay, db: AsyncSession = Depends(get_db)):
+    """
+    Queue the selected failed tasks again, oldest first, at `rate` tasks per second
+
+    The messages are sent to Dify as if they had just arrived; answers are posted to the
+    conversations whatever their status is now, so select what should be answered.
+
+    Example request body:
+        {"error_type": "ConnectTimeout", "since": "2026-10-19T08:00:00Z", "until": "2026-10-19T09:00:00Z"}
+    """
+    limit = min(request.limit or config.DEAD_LETTER_REPLAY_MAX, config.DEAD_LETTER_REPLAY_MAX)
+    rate = request.rate or config.DEAD_LETTER_REPLAY_RATE
+    if rate <= 0:
+        raise HTTPException(status_code=422, detail="rate must be positive")
+
+    query = _filtered(
+        select(DeadLetter),
+        request.error_type,
+        request.conversation_id,
+        request.account_id,
+        request.since,
+        request.until,
+        None if request.include_replayed else False,
+    ).where(DeadLetter.task_name.in_(REPLAYABLE_TASKS))
+    if request.ids:
+        query = query.where(DeadLetter.id.in_(request.ids))
+    result = await db.execute(query.order_by(DeadLetter.failed_at).limit(limit))
+    dead_letters = result.scalars().all()
+
+    queued, skipped = [], []
+    for dead_letter in dead_letters:
+        args = dead_letter.payload.get("args", [])
+        dialogue = None
+        if dead_letter.chatwoot_conversation_id:
+            dialogue_result = await db.execute(
+                select(Dialogue).where(Dialogue.chatwoot_conversation_id == dead_letter.chatwoot_conversation_id)
+            )
+            dialogue = dialogue_result.scalars().first()
+        if dialogue is None or len(args) < 5:
+            skipped.append({"id": dead_letter.id, "reason": "conversation no longer exists"})
+            continue
+
+        countdown = len(queued) / rate
+        task_id = await enqueue_dify_message(
+            dialogue, args[0], args[4], received_at=time.time() + countdown, countdown=countdown, use_lane=False
+        )
+        dead_letter.replays += 1
+        dead_letter.replayed_at = datetime.now(UTC)
+        dead_letter.replay_task_id = task_id
+        queued.append({"id": dead_letter.id, "task_id": task_id, "starts_in_seconds": round(countdown, 2)})
+
+    await metrics.aincr("dead_letters.replayed", len(queued))
+    logger.info(f"Replaying {len(queued)} dead letters at {rate}/s, {len(skipped)} skipped")
+    return {"queued": len(queued), "skipped": len(skipped), "entries": queued, "skipped_entries": skipped}
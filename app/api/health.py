@@ -1,22 +1,24 @@
 import logging
 import time
+from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy import text
 from sqlmodel import Session
 
-from app.api.chatwoot import ChatwootHandler
+from app.api.chatwoot import chatwoot_registry
 from app.database import async_engine, get_db
+from app.utils import backlog, drain, metrics
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-chatwoot = ChatwootHandler()
-
 
 @router.get("", status_code=status.HTTP_200_OK)
 async def health_check():
-    """Health check endpoint for the API."""
+    """Health check endpoint for the API, failing (503) once the replica drains for a restart."""
+    if drain.is_draining():
+        raise HTTPException(status_code=503, detail=f"Draining for {drain.draining_seconds():.0f}s")
     try:
         # Proper way to execute SQL with async engine
         async with async_engine.connect() as conn:
@@ -30,12 +32,55 @@ async def health_check():
         raise HTTPException(status_code=500, detail=f"Failed to create test conversation: {str(e)}") from e
 
 
+@router.post("/drain")
+async def start_drain():
+    """
+    Start draining this replica ahead of its stop, e.g. from a preStop hook: webhooks are refused
+    with a retryable 503 and the health check fails from now on, so traffic moves to other replicas
+    before the stop. There is no way back, the replica is meant to be stopped.
+    """
+    drain.start("requested")
+    return {"status": "draining", "draining_seconds": round(drain.draining_seconds(), 3)}
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """Counters and timings recorded by the API and workers (e.g. chatwoot.suppressed_writes.*)."""
+    try:
+        return {"status": "success", "metrics": await metrics.asnapshot()}
+    except Exception as e:
+        logger.error(f"Failed to read metrics: {e}")
+        raise HTTPException(status_code=503, detail=f"Failed to read metrics: {str(e)}") from e
+
+
+@router.get("/autoscaling")
+async def get_autoscaling_signals():
+    """
+    Scaling signals for an external autoscaler: queue depths, oldest wait, in-flight Dify calls,
+    rates and mean service time over AUTOSCALE_WINDOW_SECONDS, and the desired number of Celery
+    workers (desired_workers, of CELERY_WORKER_CONCURRENCY slots each) and API replicas.
+    The desired counts are also kept as autoscale.* metrics.
+    """
+    try:
+        signals = await backlog.autoscaling_signals()
+    except Exception as e:
+        logger.error(f"Failed to compute autoscaling signals: {e}")
+        raise HTTPException(status_code=503, detail=f"Failed to compute autoscaling signals: {str(e)}") from e
+    for name in ("desired_workers", "desired_worker_slots", "desired_api_replicas", "oldest_wait_seconds"):
+        await metrics.agauge(f"autoscale.{name}", getattr(signals, name))
+    return {"status": "success", **signals.model_dump()}
+
+
 @router.post("/test-conversation")
-async def create_test_conversation(db: Session = Depends(get_db)):
+async def create_test_conversation(account_id: Optional[str] = None, db: Session = Depends(get_db)):
     """
     Creates a test conversation in Chatwoot for testing purposes.
     This endpoint is for development and testing only.
+    Uses the first configured Chatwoot account unless account_id is given.
     """
+    chatwoot = chatwoot_registry.get(account_id)
+    if chatwoot is None:
+        raise HTTPException(status_code=404, detail=f"Chatwoot account {account_id} is not served here")
     try:
         # Create a test conversation through Chatwoot API
         # This would be a real conversation that the system can interact with
@@ -1,9 +1,12 @@
 import asyncio
 import logging
+import time
 from contextlib import asynccontextmanager
 from datetime import UTC, datetime
 from typing import Any, Dict, List, Optional
 
+import httpx
+from celery.utils import uuid
 from fastapi import (
     APIRouter,
     BackgroundTasks,
@@ -17,26 +20,92 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from app import tasks
-from app.api.chatwoot import ChatwootHandler
+from app.api.chatwoot import ChatwootHandler, chatwoot_registry
+from app.api.coalescing import WriteCoalescer, merge_custom_attributes, merge_labels
+from app.api.conversation_actions import execute_conversation_actions, summarize_report
 from app.config import (
     BOT_CONVERSATION_OPENED_MESSAGE_EXTERNAL,
     BOT_ERROR_MESSAGE_INTERNAL,
+    BOT_SKIP_ASSIGNED_CONVERSATIONS,
+    CONVERSATION_LANES_ENABLED,
+    DIFY_ROTATE_ON_STATUSES,
+    DRAIN_RETRY_AFTER_SECONDS,
     ENABLE_TEAM_CACHE,
-    TEAM_CACHE_TTL_HOURS,
+    FAST_LANE_RULES_FILE,
+    MESSAGE_DIRECTION_MODES,
+    WRITE_COALESCE_WINDOW_MS,
+    valid_statuses,
 )
-from app.database import create_db_tables, get_db
+from app.database import async_engine, create_db_tables, get_db
 from app.models.database import ChatwootWebhook, Dialogue, DialogueCreate
-from app.models.non_database import ConversationPriority, ConversationStatus
+from app.models.non_database import ConversationActions, ConversationPriority, ConversationStatus
+from app.redis_client import async_broker_client, async_redis_client
+from app.utils import backlog, drain, metrics
+from app.utils.accounts import split_key
+from app.utils.bot_messages import is_bot_echo, is_bot_loop, reset_bot_turns
+from app.utils.conversation_context import buffer_message
+from app.utils.conversation_tasks import cancel_conversation_tasks, next_ticket, track_task
+from app.utils.dify_deletions import queue_deletions
+from app.utils.dify_endpoints import tag, untag
+from app.utils.dify_rotation import request_rotation
+from app.utils.rules import FastLaneRule, RuleEngine, load_rules
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
-chatwoot = ChatwootHandler()
+fast_lane = load_rules(FAST_LANE_RULES_FILE)
 
-# Team management - only initialize if caching is enabled
-team_cache: Dict[str, int] = {} if ENABLE_TEAM_CACHE else {}
-team_cache_lock = asyncio.Lock() if ENABLE_TEAM_CACHE else None
-last_update_time = 0
+
+def route_account_id(account_id: Optional[str] = None) -> Optional[str]:
+    """Chatwoot account named by the route (/accounts/{account_id}/...) or the account_id query parameter"""
+    return account_id
+
+
+def get_chatwoot(account_id: Optional[str] = Depends(route_account_id)) -> ChatwootHandler:
+    """Handler of the route's account, the first configured account for routes without one"""
+    chatwoot = chatwoot_registry.get(account_id)
+    if chatwoot is None:
+        raise HTTPException(status_code=404, detail=f"Chatwoot account {account_id} is not served here")
+    return chatwoot
+
+
+async def reject_when_draining() -> None:
+    """Refuse new work while the replica drains for a restart, the caller retries on another one"""
+    if drain.is_draining():
+        await metrics.aincr("drain.rejected_requests")
+        raise HTTPException(
+            status_code=503,
+            detail="Draining for a restart, retry shortly",
+            headers={"Retry-After": str(DRAIN_RETRY_AFTER_SECONDS)},
+        )
+
+
+async def write_labels(key: str, labels: List[str]) -> Dict[str, Any]:
+    chatwoot, conversation_id = chatwoot_registry.for_key(key)
+    return await chatwoot.add_labels(conversation_id=conversation_id, labels=labels)
+
+
+async def write_custom_attributes(key: str, attributes: Dict[str, Any]) -> Dict[str, Any]:
+    chatwoot, conversation_id = chatwoot_registry.for_key(key)
+    return await chatwoot.update_custom_attributes(conversation_id=conversation_id, custom_attributes=attributes)
+
+
+# Bursts of label/attribute updates for one conversation (by conversation key) become a single Chatwoot write
+label_writes = WriteCoalescer("labels", WRITE_COALESCE_WINDOW_MS / 1000, merge_labels, write_labels)
+custom_attribute_writes = WriteCoalescer(
+    "custom_attributes", WRITE_COALESCE_WINDOW_MS / 1000, merge_custom_attributes, write_custom_attributes
+)
+
+
+def webhook_account_id(payload: Dict[str, Any], conversation_payload: Any) -> Optional[str]:
+    """Account a webhook event names: message events carry an account object, conversations an account_id"""
+    account = payload.get("account")
+    if isinstance(account, dict) and account.get("id"):
+        return str(account["id"])
+    for source in (payload, conversation_payload):
+        if isinstance(source, dict) and source.get("account_id"):
+            return str(source["account_id"])
+    return None
 
 
 async def get_or_create_dialogue(db: AsyncSession, data: DialogueCreate) -> Dialogue:
@@ -63,12 +132,137 @@ async def get_or_create_dialogue(db: AsyncSession, data: DialogueCreate) -> Dial
     return dialogue
 
 
+def bot_should_reply(dialogue: Dialogue) -> bool:
+    """Whether the bot still handles the conversation, judged from the stored Dialogue only"""
+    if dialogue.status not in valid_statuses():
+        return False
+    if BOT_SKIP_ASSIGNED_CONVERSATIONS and dialogue.assignee_id is not None:
+        return False
+    return True
+
+
+async def stop_dify_generation(tagged_task_id: str) -> None:
+    """Ask Dify to stop a running (streaming) generation, on the endpoint it runs on"""
+    endpoint, dify_task_id = untag(tagged_task_id)
+    if endpoint is None:
+        logger.warning(f"Not stopping Dify generation {tagged_task_id}: its endpoint left the pool")
+        return
+    url = f"{endpoint.url}/chat-messages/{dify_task_id}/stop"
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.post(url, json={"user": "user"}, headers=endpoint.headers)
+            response.raise_for_status()
+    except Exception as e:
+        logger.warning(f"Failed to stop Dify generation {dify_task_id}: {e}")
+
+
+async def cancel_pending_dify_work(chatwoot_conversation_id: str) -> None:
+    """Revoke queued Dify tasks and stop running generations after a human takeover"""
+    task_ids, dify_task_ids = await cancel_conversation_tasks(chatwoot_conversation_id)
+    if task_ids:
+        # Broadcast through the broker; revoked tasks are discarded when a worker receives them
+        await asyncio.to_thread(tasks.celery.control.revoke, task_ids)
+        await backlog.forget(task_ids)
+    await asyncio.gather(*(stop_dify_generation(dify_task_id) for dify_task_id in dify_task_ids))
+    if task_ids or dify_task_ids:
+        logger.info(
+            f"Takeover of conversation {chatwoot_conversation_id}: revoked {len(task_ids)} task(s), "
+            f"stopped {len(dify_task_ids)} generation(s)"
+        )
+
+
+async def send_busy_notice(chatwoot: ChatwootHandler, conversation_id: int, admission: backlog.Backlog) -> None:
+    """Tell the customer their place in line, at most once per ADMISSION_NOTICE_COOLDOWN_SECONDS"""
+    try:
+        if await backlog.claim_notice(chatwoot.conversation_key(conversation_id)):
+            await chatwoot.send_message(conversation_id=conversation_id, message=backlog.busy_message(admission))
+            await metrics.aincr("admission.notices_sent")
+    except Exception as e:
+        logger.warning(f"Failed to send busy notice to conversation {conversation_id}: {e}")
+
+
+async def run_fast_lane_rule(
+    chatwoot: ChatwootHandler, rule: FastLaneRule, conversation_id: int, sender_name: Optional[str]
+):
+    """Post the reply of a matched fast lane rule, then apply its actions"""
+    try:
+        if rule.reply:
+            await chatwoot.send_message(
+                conversation_id=conversation_id,
+                message=RuleEngine.render_reply(rule, conversation_id=conversation_id, sender_name=sender_name),
+            )
+        if rule.actions:
+            report = await execute_conversation_actions(
+                chatwoot, conversation_id, rule.actions, resolve_team=chatwoot.get_team_id
+            )
+            log = logger.info if summarize_report(report) == "success" else logger.error
+            log(f"Applied fast lane rule '{rule.name}' actions for conversation {conversation_id}: {report}")
+    except Exception as e:
+        logger.error(f"Failed to apply fast lane rule '{rule.name}' for conversation {conversation_id}: {e}")
+
+
+async def enqueue_dify_message(
+    dialogue: Dialogue,
+    content: str,
+    message_type: str,
+    received_at: float,
+    countdown: Optional[float] = None,
+    use_lane: bool = CONVERSATION_LANES_ENABLED,
+    priority: Optional[str] = None,  # Chatwoot conversation priority, else the last one known
+) -> str:
+    """Queue a message for Dify with its answer and error callbacks, returns the task id"""
+    # Tasks and callbacks get the conversation key, which tells the workers the account as well
+    conversation_id = dialogue.chatwoot_conversation_id
+    chatwoot, chatwoot_conversation_id = chatwoot_registry.for_key(conversation_id)
+    if priority is None and chatwoot:
+        priority = chatwoot.state.get(chatwoot_conversation_id).get("priority")
+    # The task id is known up front so a takeover can revoke it even before it starts
+    task_id = uuid()
+    await track_task(dialogue.chatwoot_conversation_id, task_id)
+    await backlog.mark_waiting(task_id, received_at)
+    task_kwargs = {"received_at": received_at}
+    if use_lane:
+        # Tickets are taken in webhook order, workers answer the conversation in that order
+        try:
+            task_kwargs["ticket"] = await next_ticket(dialogue.chatwoot_conversation_id)
+        except Exception as e:
+            # Without a ticket the task runs outside the lane, answering out of order beats not answering
+            logger.warning(f"Failed to take a lane ticket for conversation {conversation_id}, not waiting: {e}")
+
+    # https://github.com/langgenius/dify/issues/11140 IMPORTANT : `inputs` are cached for conversation
+    tasks.process_message_with_dify.apply_async(
+        args=[
+            content,
+            dialogue.dify_conversation_id,
+            dialogue.chatwoot_conversation_id,
+            dialogue.status,
+            message_type,
+        ],
+        kwargs=task_kwargs,
+        task_id=task_id,
+        countdown=countdown,
+        # Outgoing messages have their own queue, urgent/high conversations jump ahead in theirs
+        **tasks.message_route(message_type, priority),
+        link=tasks.handle_dify_response.s(
+            conversation_id=conversation_id,
+            task_id=task_id,
+            received_at=received_at,
+        ),
+        link_error=tasks.handle_dify_error.s(
+            conversation_id=conversation_id,
+            task_id=task_id,
+        ),
+    )
+    return task_id
+
+
 @router.post("/send-chatwoot-message")
 async def send_chatwoot_message(
     conversation_id: int,
     message: str,
     is_private: bool = False,
     db: AsyncSession = Depends(get_db),
+    chatwoot: ChatwootHandler = Depends(get_chatwoot),
 ):
     """
     Send a message to Chatwoot conversation.
@@ -87,19 +281,36 @@ async def send_chatwoot_message(
         raise HTTPException(status_code=500, detail="Failed to send message to Chatwoot") from e
 
 
-@router.post("/chatwoot-webhook")
+@router.post("/chatwoot-webhook", dependencies=[Depends(reject_when_draining)])
 async def chatwoot_webhook(
     request: Request,
     background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db),
+    account_id: Optional[str] = Depends(route_account_id),
 ):
-    print("Received Chatwoot webhook request")
+    received_at = time.time()
+    await backlog.count_webhook()
     payload = await request.json()
     webhook_data = ChatwootWebhook.model_validate(payload)
 
     logger.info(f"Received webhook event: {webhook_data.event}")
     logger.debug(f"Webhook payload: {payload}")
 
+    conversation_payload = payload.get("conversation")
+    if conversation_payload is None and webhook_data.event.startswith("conversation_"):
+        conversation_payload = payload
+    # The account the event names, else the one of the route
+    account_id = webhook_account_id(payload, conversation_payload) or account_id
+    chatwoot = chatwoot_registry.get(account_id)
+    if chatwoot is None:
+        logger.warning(f"Rejecting {webhook_data.event} webhook of Chatwoot account {account_id}: not served here")
+        raise HTTPException(status_code=404, detail=f"Chatwoot account {account_id} is not served here")
+    key = chatwoot.conversation_key(webhook_data.conversation_id) if webhook_data.conversation_id else None
+
+    # Keep the locally known conversation state current so no-op Chatwoot writes can be skipped
+    if isinstance(conversation_payload, dict):
+        chatwoot.state.observe(conversation_payload)
+
     if webhook_data.event == "message_created":
         logger.info(f"Webhook data: {webhook_data}")
         if webhook_data.sender_type in [
@@ -118,55 +329,95 @@ async def chatwoot_webhook(
         ).startswith(BOT_ERROR_MESSAGE_INTERNAL):
             logger.info(f"Skipping agent_bot message: {webhook_data.content}")
             return {"status": "skipped", "reason": "agent_bot message"}
+        # Messages the bot posted itself, whatever sender Chatwoot reports for them
+        if await is_bot_echo(key, webhook_data.id):
+            logger.info(f"Skipping echo of bot message {webhook_data.id}")
+            return {"status": "skipped", "reason": "bot message echo"}
+        if webhook_data.sender_type == "user":
+            await reset_bot_turns(key)
+        elif await is_bot_loop(key):
+            logger.warning(
+                f"Bot loop suspected in conversation {webhook_data.conversation_id}, "
+                "not answering until a human agent replies"
+            )
+            await metrics.aincr("bot.loops_detected")
+            return {"status": "skipped", "reason": "bot loop detected"}
 
-        if True:  # we'll see if we need to filter by status later
-            print(f"Processing message: {webhook_data}")
-            try:
-                dialogue_data = webhook_data.to_dialogue_create()
-                dialogue = await get_or_create_dialogue(db, dialogue_data)
-
-                # Just start the task and return immediately
-
-                # https://github.com/langgenius/dify/issues/11140 IMPORTANT : `inputs` are cached for conversation
-                tasks.process_message_with_dify.apply_async(
-                    args=[
-                        webhook_data.content,
-                        dialogue.dify_conversation_id,
-                        dialogue.chatwoot_conversation_id,
-                        dialogue.status,
-                        webhook_data.message_type,
-                    ],
-                    link=tasks.handle_dify_response.s(
-                        conversation_id=webhook_data.conversation_id,
-                        dialogue_id=dialogue.id,
-                    ),
-                    link_error=tasks.handle_dify_error.s(
-                        conversation_id=webhook_data.conversation_id,
-                    ),
+        try:
+            dialogue_data = webhook_data.to_dialogue_create(key)
+            dialogue = await get_or_create_dialogue(db, dialogue_data)
+
+            # Gate on the locally stored state, no Chatwoot call needed
+            if not bot_should_reply(dialogue):
+                logger.info(
+                    f"Skipping message for conversation {dialogue.chatwoot_conversation_id}: "
+                    f"status={dialogue.status}, assignee_id={dialogue.assignee_id}"
                 )
-
-                return {"status": "processing"}
-
-            except Exception as e:
-                logger.error(f"Failed to process message with Dify: {e}")
-                if webhook_data.conversation_id is not None:
-                    await send_chatwoot_message(
-                        conversation_id=webhook_data.conversation_id,
-                        message=BOT_CONVERSATION_OPENED_MESSAGE_EXTERNAL,
-                        is_private=False,
-                        db=db,
+                return {"status": "skipped", "reason": "conversation not handled by bot"}
+
+            mode = MESSAGE_DIRECTION_MODES.get(webhook_data.message_type, "dispatch")
+            if mode == "ignore":
+                return {"status": "skipped", "reason": f"{webhook_data.message_type} messages are ignored"}
+            if mode == "context":
+                await buffer_message(dialogue.chatwoot_conversation_id, webhook_data.message_type, webhook_data.content)
+                return {"status": "buffered"}
+            # Deterministic intents are answered locally, without a Dify call
+            rule = fast_lane.match(webhook_data.content) if webhook_data.message_type == "incoming" else None
+            if rule:
+                logger.info(f"Fast lane rule '{rule.name}' matched in conversation {webhook_data.conversation_id}")
+                await metrics.aincr(f"fast_lane.{rule.name}")
+                sender_name = webhook_data.sender.name if webhook_data.sender else None
+                background_tasks.add_task(run_fast_lane_rule, chatwoot, rule, webhook_data.conversation_id, sender_name)
+                return {"status": "answered", "rule": rule.name}
+
+            if webhook_data.message_type == "incoming":
+                admission = await backlog.admission()
+                if admission.level == "shed":
+                    # Past the hard threshold the bot can't answer in useful time, a human takes over
+                    logger.warning(
+                        f"Backlog of {admission.depth} messages, oldest waiting {admission.oldest_wait_seconds:.0f}s: "
+                        f"handing conversation {dialogue.chatwoot_conversation_id} over to a human"
                     )
-                else:
-                    logger.error(
-                        "Cannot send error message: conversation_id is "
-                        f"None in webhook data for event {webhook_data.event}"
+                    await metrics.aincr("admission.shed")
+                    background_tasks.add_task(
+                        tasks.hand_over_to_human, dialogue.chatwoot_conversation_id, dialogue.status
                     )
+                    return {"status": "shed", "reason": "backlog past hard threshold"}
+                if admission.level == "busy":
+                    await metrics.aincr("admission.busy")
+                    background_tasks.add_task(send_busy_notice, chatwoot, webhook_data.conversation_id, admission)
+
+            # Just start the task and return immediately
+            await enqueue_dify_message(
+                dialogue,
+                webhook_data.content,
+                webhook_data.message_type,
+                received_at,
+                priority=conversation_payload.get("priority") if isinstance(conversation_payload, dict) else None,
+            )
+
+            return {"status": "processing"}
+
+        except Exception as e:
+            logger.error(f"Failed to process message with Dify: {e}")
+            if webhook_data.conversation_id is not None:
+                await send_chatwoot_message(
+                    chatwoot=chatwoot,
+                    conversation_id=webhook_data.conversation_id,
+                    message=BOT_CONVERSATION_OPENED_MESSAGE_EXTERNAL,
+                    is_private=False,
+                    db=db,
+                )
+            else:
+                logger.error(
+                    f"Cannot send error message: conversation_id is None in webhook data for event {webhook_data.event}"
+                )
 
     elif webhook_data.event == "conversation_created":
         if not webhook_data.conversation:
             return {"status": "skipped", "reason": "no conversation data"}
 
-        dialogue_data = webhook_data.to_dialogue_create()
+        dialogue_data = webhook_data.to_dialogue_create(key)
         dialogue = await get_or_create_dialogue(db, dialogue_data)
         return {"status": "success", "dialogue_id": dialogue.id}
 
@@ -174,38 +425,61 @@ async def chatwoot_webhook(
         if not webhook_data.conversation:
             return {"status": "skipped", "reason": "no conversation data"}
 
-        dialogue_data = webhook_data.to_dialogue_create()
+        dialogue_data = webhook_data.to_dialogue_create(key)
         dialogue = await get_or_create_dialogue(db, dialogue_data)
+        if not bot_should_reply(dialogue):
+            await cancel_pending_dify_work(dialogue.chatwoot_conversation_id)
+        if dialogue.status in DIFY_ROTATE_ON_STATUSES and dialogue.dify_conversation_id:
+            await request_rotation(dialogue.chatwoot_conversation_id, dialogue.dify_conversation_id)
         return {"status": "success", "dialogue_id": dialogue.id}
 
     elif webhook_data.event == "conversation_deleted":
         if not webhook_data.conversation:
             return {"status": "skipped", "reason": "no conversation data"}
 
-        conversation_id = str(webhook_data.conversation.id)
-        statement = select(Dialogue).where(Dialogue.chatwoot_conversation_id == conversation_id)
-        dialogue = await db.execute(statement)
-        dialogue = dialogue.scalar_one_or_none()
+        chatwoot.state.forget(webhook_data.conversation.id)
+        statement = select(Dialogue).where(
+            Dialogue.chatwoot_conversation_id == chatwoot.conversation_key(webhook_data.conversation.id)
+        )
+        dialogues = (await db.execute(statement)).scalars().all()
 
-        if dialogue and dialogue.dify_conversation_id:
-            background_tasks.add_task(tasks.delete_dify_conversation, dialogue.dify_conversation_id)
+        # The workers delete the Dify conversations in batches, the dialogues go in any case
+        await queue_deletions(
+            tag(dialogue.dify_endpoint, dialogue.dify_conversation_id)
+            for dialogue in dialogues
+            if dialogue.dify_conversation_id
+        )
+        for dialogue in dialogues:
             await db.delete(dialogue)
-            await db.commit()
+        await db.commit()
 
     return {"status": "success"}
 
 
 @router.post("/update-labels/{conversation_id}")
-async def update_labels(conversation_id: int, labels: List[str], db: AsyncSession = Depends(get_db)):
+async def update_labels(
+    conversation_id: int,
+    labels: List[str],
+    force: bool = False,
+    db: AsyncSession = Depends(get_db),
+    chatwoot: ChatwootHandler = Depends(get_chatwoot),
+):
     """
     Update labels for a Chatwoot conversation
 
     Parameters:
     - conversation_id: The ID of the conversation to update (path parameter)
     - labels: List of label strings to apply to the conversation (request body)
+    - force: Write even if the labels are already known to be set (query parameter)
+
+    With WRITE_COALESCE_WINDOW_MS set, label lists sent for the same conversation within
+    the window are unioned into one Chatwoot write and every caller gets the combined result.
     """
     try:
-        result = await chatwoot.add_labels(conversation_id=conversation_id, labels=labels)
+        if force:
+            result = await chatwoot.add_labels(conversation_id=conversation_id, labels=labels, force=True)
+        else:
+            result = await label_writes.submit(chatwoot.conversation_key(conversation_id), labels)
         return {
             "status": "success",
             "conversation_id": conversation_id,
@@ -220,7 +494,9 @@ async def update_labels(conversation_id: int, labels: List[str], db: AsyncSessio
 async def update_custom_attributes(
     conversation_id: int,
     custom_attributes: Dict[str, Any],
+    force: bool = False,
     db: AsyncSession = Depends(get_db),
+    chatwoot: ChatwootHandler = Depends(get_chatwoot),
 ):
     """
     Update custom attributes for a Chatwoot conversation
@@ -228,9 +504,13 @@ async def update_custom_attributes(
     Parameters:
     - conversation_id: The ID of the conversation to update (path parameter)
     - custom_attributes: Dictionary of custom attributes to set (request body)
+    - force: Write even if the attributes are already known to be set (query parameter)
 
     Example request body:
     {"region": "Moscow", "region_original_string": "Moscow"}
+
+    With WRITE_COALESCE_WINDOW_MS set, attribute dicts sent for the same conversation within
+    the window are merged (later values win) into one Chatwoot write.
     """
     if not isinstance(custom_attributes, dict) or not custom_attributes:
         return {
@@ -239,9 +519,12 @@ async def update_custom_attributes(
             "custom_attributes": "No custom attrs provided",
         }
     try:
-        result = await chatwoot.update_custom_attributes(
-            conversation_id=conversation_id, custom_attributes=custom_attributes
-        )
+        if force:
+            result = await chatwoot.update_custom_attributes(
+                conversation_id=conversation_id, custom_attributes=custom_attributes, force=True
+            )
+        else:
+            result = await custom_attribute_writes.submit(chatwoot.conversation_key(conversation_id), custom_attributes)
         logger.info(f"Updated custom attributes for conversation {conversation_id}: {result}")
         return {
             "status": "success",
@@ -270,7 +553,9 @@ async def toggle_conversation_priority(
         embed=True,
         description="Priority level: 'urgent', 'high', 'medium', 'low', or None",
     ),
+    force: bool = False,
     db: AsyncSession = Depends(get_db),
+    chatwoot: ChatwootHandler = Depends(get_chatwoot),
 ):
     """
     Toggle the priority of a Chatwoot conversation
@@ -278,6 +563,7 @@ async def toggle_conversation_priority(
     Parameters:
     - conversation_id: The ID of the conversation to update (path parameter)
     - priority: Priority level to set (request body)
+    - force: Write even if the priority is already known to be set (query parameter)
 
     Example request body:
         {
@@ -293,7 +579,9 @@ async def toggle_conversation_priority(
                 "priority": "None",
             }
         logger.info(f"Attempting to set priority {priority_value} for conversation {conversation_id}")
-        result = await chatwoot.toggle_priority(conversation_id=conversation_id, priority=str(priority_value))
+        result = await chatwoot.toggle_priority(
+            conversation_id=conversation_id, priority=str(priority_value), force=force
+        )
         return {
             "status": "success",
             "conversation_id": conversation_id,
@@ -327,21 +615,29 @@ async def get_chatwoot_conversation_id(dify_conversation_id: str, db: AsyncSessi
             detail=f"No conversation found with Dify ID: {dify_conversation_id}",
         )
 
+    account_id, chatwoot_conversation_id = split_key(dialogue.chatwoot_conversation_id)
     return {
-        "chatwoot_conversation_id": dialogue.chatwoot_conversation_id,
+        "chatwoot_conversation_id": str(chatwoot_conversation_id),
+        "account_id": account_id,
         "status": dialogue.status,
         "assignee_id": dialogue.assignee_id,
     }
 
 
 @router.get("/dialogue-info/{chatwoot_conversation_id}")
-async def get_dialogue_info(chatwoot_conversation_id: int, db: AsyncSession = Depends(get_db)):
+async def get_dialogue_info(
+    chatwoot_conversation_id: int,
+    db: AsyncSession = Depends(get_db),
+    chatwoot: ChatwootHandler = Depends(get_chatwoot),
+):
     """
     Retrieve dialogue information, including the Dify conversation ID,
     based on the Chatwoot conversation ID. Used for testing/debugging.
     """
     logger.debug(f"Received request for dialogue info for Chatwoot convo ID: {chatwoot_conversation_id}")
-    statement = select(Dialogue).where(Dialogue.chatwoot_conversation_id == str(chatwoot_conversation_id))
+    statement = select(Dialogue).where(
+        Dialogue.chatwoot_conversation_id == chatwoot.conversation_key(chatwoot_conversation_id)
+    )
     result = await db.execute(statement)
     dialogue = result.scalar_one_or_none()
 
@@ -356,7 +652,8 @@ async def get_dialogue_info(chatwoot_conversation_id: int, db: AsyncSession = De
         f"Found dialogue for Chatwoot convo ID {chatwoot_conversation_id}: Dify ID = {dialogue.dify_conversation_id}"
     )
     return {
-        "chatwoot_conversation_id": dialogue.chatwoot_conversation_id,
+        "chatwoot_conversation_id": str(chatwoot_conversation_id),
+        "account_id": chatwoot.account_id,
         "dify_conversation_id": dialogue.dify_conversation_id,
         "status": dialogue.status,  # TODO: this probably can be outdated
         "created_at": dialogue.created_at,
@@ -364,62 +661,9 @@ async def get_dialogue_info(chatwoot_conversation_id: int, db: AsyncSession = De
     }
 
 
-async def update_team_cache():
-    """Update the team name to ID mapping cache."""
-    if not ENABLE_TEAM_CACHE:
-        logger.warning("Team caching is disabled. Skipping cache update.")
-        return {}
-
-    global team_cache, last_update_time
-
-    async with team_cache_lock:
-        try:
-            teams = await chatwoot.get_teams()
-
-            # Create case-insensitive mappings from name to ID
-            new_cache = {team["name"].lower(): team["id"] for team in teams}
-
-            # Update the cache
-            team_cache = new_cache
-            last_update_time = datetime.now(UTC).timestamp()
-
-            logger.info(f"Updated team cache with {len(team_cache)} teams")
-            return team_cache
-        except Exception as e:
-            logger.error(f"Failed to update team cache: {e}", exc_info=True)
-            raise
-
-
-async def get_team_id(team_name: str) -> Optional[int]:
-    """Get team ID from name, updating cache if necessary.
-
-    Args:
-        team_name: The name of the team to look up
-
-    Returns:
-        The team ID or None if not found
-    """
-    if not ENABLE_TEAM_CACHE:
-        # Direct API call when caching is disabled
-        try:
-            teams = await chatwoot.get_teams()
-            team_map = {team["name"].lower(): team["id"] for team in teams}
-            return team_map.get(team_name.lower())
-        except Exception as e:
-            logger.error(f"Failed to get team ID for '{team_name}' (no cache): {e}")
-            return None
-
-    # Use cache when enabled
-    cache_age_hours = (datetime.now(UTC).timestamp() - last_update_time) / 3600
-    if not team_cache or cache_age_hours > TEAM_CACHE_TTL_HOURS:
-        await update_team_cache()
-
-    return team_cache.get(team_name.lower())
-
-
 @router.post("/refresh-teams")
-async def refresh_teams_cache():
-    """Manually refresh the team cache."""
+async def refresh_teams_cache(chatwoot: ChatwootHandler = Depends(get_chatwoot)):
+    """Manually refresh the team cache of the account."""
     if not ENABLE_TEAM_CACHE:
         # When caching is disabled, just return current teams from API
         try:
@@ -429,7 +673,7 @@ async def refresh_teams_cache():
             raise HTTPException(status_code=500, detail=f"Failed to fetch teams: {str(e)}") from e
 
     try:
-        teams = await update_team_cache()
+        teams = await chatwoot.refresh_team_cache()
         return {"status": "success", "teams": len(teams), "cache_enabled": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to refresh teams: {str(e)}") from e
@@ -443,7 +687,9 @@ async def assign_conversation_to_team(
         embed=True,
         description="Team name to assign the conversation to",
     ),
+    force: bool = False,
     db: AsyncSession = Depends(get_db),
+    chatwoot: ChatwootHandler = Depends(get_chatwoot),
 ):
     """
     Assign a Chatwoot conversation to a team
@@ -451,6 +697,7 @@ async def assign_conversation_to_team(
     Parameters:
     - conversation_id: The ID of the conversation to update (path parameter)
     - team: Team name to assign (request body)
+    - force: Write even if the team is already known to be assigned (query parameter)
 
     Example request body:
         {
@@ -464,22 +711,18 @@ async def assign_conversation_to_team(
         logger.info(f"Attempting to assign conversation {conversation_id} to team {team}")
 
         # Get team_id from name
-        team_id = await get_team_id(team)
+        team_id = await chatwoot.get_team_id(team)
 
         if team_id is None:
             if ENABLE_TEAM_CACHE:
                 # Try to refresh the cache and try again
-                await update_team_cache()
-                team_id = await get_team_id(team)
+                await chatwoot.refresh_team_cache()
+                team_id = await chatwoot.get_team_id(team)
 
             if team_id is None:
                 # Get available teams for error message
                 try:
-                    if ENABLE_TEAM_CACHE:
-                        available_teams = list(team_cache.keys())
-                    else:
-                        teams = await chatwoot.get_teams()
-                        available_teams = [team["name"].lower() for team in teams]
+                    available_teams = await chatwoot.team_names()
                 except Exception:
                     available_teams = ["Unable to fetch teams"]
 
@@ -489,7 +732,7 @@ async def assign_conversation_to_team(
                 )
 
         # Assign the conversation to the team
-        result = await chatwoot.assign_team(conversation_id=conversation_id, team_id=team_id)
+        result = await chatwoot.assign_team(conversation_id=conversation_id, team_id=team_id, force=force)
 
         # Log successful result
         logger.info(f"Successfully assigned conversation {conversation_id} to team {team} (ID: {team_id})")
@@ -509,11 +752,7 @@ async def assign_conversation_to_team(
 
         # Get available teams for error details
         try:
-            if ENABLE_TEAM_CACHE:
-                available_teams = list(team_cache.keys())
-            else:
-                teams = await chatwoot.get_teams()
-                available_teams = [team["name"].lower() for team in teams]
+            available_teams = await chatwoot.team_names()
         except Exception:
             available_teams = ["Unable to fetch teams"]
 
@@ -533,7 +772,9 @@ async def assign_conversation_to_team(
 async def toggle_conversation_status(
     conversation_id: int,
     status: ConversationStatus = Body(..., embed=True),
+    force: bool = False,
     db: AsyncSession = Depends(get_db),
+    chatwoot: ChatwootHandler = Depends(get_chatwoot),
 ):
     """
     Toggle the status of a Chatwoot conversation
@@ -541,6 +782,7 @@ async def toggle_conversation_status(
     Parameters:
     - conversation_id: The ID of the conversation to update (path parameter)
     - status: Status to set (request body)
+    - force: Write even if the status is already known to be set (query parameter)
 
     Example request body:
         {
@@ -564,6 +806,7 @@ async def toggle_conversation_status(
             status=status.value,
             previous_status=previous_status_val,
             is_error_transition=False,  # This is not an error-induced transition
+            force=force,
         )
         return {
             "status": "success",
@@ -578,6 +821,47 @@ async def toggle_conversation_status(
         ) from e
 
 
+@router.post("/conversations/{conversation_id}/actions")
+async def apply_conversation_actions(
+    conversation_id: int,
+    actions: ConversationActions,
+    db: AsyncSession = Depends(get_db),
+    chatwoot: ChatwootHandler = Depends(get_chatwoot),
+):
+    """
+    Apply several conversation updates in one request
+
+    Independent updates (priority, labels, custom attributes, team) run concurrently;
+    the status change runs after them. Each action is reported separately, so a failed
+    action does not roll back the others.
+
+    Parameters:
+    - conversation_id: The ID of the conversation to update (path parameter)
+    - actions: Updates to apply, any subset of the fields below (request body)
+
+    Example request body:
+        {
+            "status": "open",
+            "priority": "high",
+            "labels": ["delivery"],
+            "custom_attributes": {"region": "Moscow"},
+            "team": "Support"
+        }
+    """
+    report = await execute_conversation_actions(
+        chatwoot,
+        conversation_id,
+        actions,
+        resolve_team=chatwoot.get_team_id,
+    )
+    logger.info(f"Applied actions for conversation {conversation_id}: {report}")
+    return {
+        "status": summarize_report(report),
+        "conversation_id": conversation_id,
+        "actions": report,
+    }
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan events manager"""
@@ -585,15 +869,24 @@ async def lifespan(app: FastAPI):
     await create_db_tables()
     logger.info("Application startup: Database tables checked/created.")
     # Consider any other startup logic here, e.g., initializing caches, connecting to external services
+    await chatwoot_registry.open()
 
     if ENABLE_TEAM_CACHE:
-        await update_team_cache()
-        logger.info(f"Initialized team cache with {len(team_cache)} teams")
+        handlers = list(chatwoot_registry.handlers.values())
+        await asyncio.gather(*(chatwoot.refresh_team_cache() for chatwoot in handlers))
+        logger.info(f"Initialized team caches of {len(handlers)} Chatwoot account(s)")
     else:
         logger.info("Team caching is disabled. Teams will be fetched directly from API.")
+    # Installed after the server's own SIGTERM handler, which it hands the signal on to
+    drain.install_signal_handler()
 
     yield  # Application is now running
 
-    # Application shutdown
-    # Consider any cleanup logic here, e.g., closing connections, saving state
-    logger.info("Application shutdown: Cleaning up resources.")
+    # Application shutdown: the server took no new connections and finished the requests in progress;
+    # the writes still held back for coalescing go out before the clients they need are closed
+    logger.info(
+        f"Application shutdown: flushing writes and closing clients (drained for {drain.draining_seconds():.1f}s)"
+    )
+    await asyncio.gather(label_writes.flush_all(), custom_attribute_writes.flush_all())
+    await chatwoot_registry.aclose()
+    await asyncio.gather(async_redis_client.aclose(), async_broker_client.aclose(), async_engine.dispose())
@@ -1,3 +1,4 @@
+import json
 import os
 from typing import List
 
@@ -24,6 +25,9 @@ REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 REDIS_PORT = os.getenv("REDIS_PORT", "6379")
 REDIS_BROKER = os.getenv("REDIS_BROKER", f"redis://{REDIS_HOST}:{REDIS_PORT}/0")
 REDIS_BACKEND = os.getenv("REDIS_BACKEND", f"redis://{REDIS_HOST}:{REDIS_PORT}/1")
+# Application state (metrics, coordination keys) lives in its own DB, apart from broker and results
+REDIS_STATE_URL = os.getenv("REDIS_STATE_URL", f"redis://{REDIS_HOST}:{REDIS_PORT}/2")
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "1.0"))
 
 # Celery configuration - using modern naming conventions for Celery 5.x+
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", REDIS_BROKER)  # Keep for backwards compatibility
@@ -46,12 +50,114 @@ broker_connection_retry_on_startup = True  # Retain current behavior for connect
 # Custom settings for our application
 CELERY_RETRY_COUNTDOWN = int(os.getenv("CELERY_RETRY_COUNTDOWN", "5"))
 
+# Dify tasks that failed after all retries are kept for inspection and replay (/api/v1/dead-letters)
+DEAD_LETTERS_ENABLED = os.getenv("DEAD_LETTERS_ENABLED", "True").lower() in ("true", "1", "t")
+DEAD_LETTER_MAX_ERROR_LENGTH = int(os.getenv("DEAD_LETTER_MAX_ERROR_LENGTH", "2000"))
+DEAD_LETTER_REPLAY_RATE = float(os.getenv("DEAD_LETTER_REPLAY_RATE", "1.0"))  # replayed tasks started per second
+DEAD_LETTER_REPLAY_MAX = int(os.getenv("DEAD_LETTER_REPLAY_MAX", "500"))  # entries per replay request
+
+# Task queues, so housekeeping and retry storms can't delay live replies. The docker-compose
+# `worker` consumes live and agent traffic, `worker-background` retries and maintenance.
+CELERY_QUEUE_LIVE = os.getenv("CELERY_QUEUE_LIVE", "chatdify.live")  # incoming messages and answer delivery
+CELERY_QUEUE_AGENT = os.getenv("CELERY_QUEUE_AGENT", "chatdify.agent")  # outgoing (agent) messages
+CELERY_QUEUE_RETRY = os.getenv("CELERY_QUEUE_RETRY", "chatdify.retry")  # Dify calls retried after an error
+CELERY_QUEUE_MAINTENANCE = os.getenv("CELERY_QUEUE_MAINTENANCE", "chatdify.maintenance")  # deletions, sweeps
+CELERY_TASK_DEFAULT_QUEUE = CELERY_QUEUE_LIVE
+CELERY_TASK_ROUTES = {
+    "app.tasks.process_message_with_dify": {"queue": CELERY_QUEUE_LIVE},
+    "app.tasks.handle_dify_response": {"queue": CELERY_QUEUE_LIVE},
+    "app.tasks.handle_dify_error": {"queue": CELERY_QUEUE_LIVE},
+    "app.tasks.delete_dify_conversation": {"queue": CELERY_QUEUE_MAINTENANCE},
+    "app.tasks.process_dify_deletions": {"queue": CELERY_QUEUE_MAINTENANCE},
+    "app.tasks.sweep_stale_dify_conversations": {"queue": CELERY_QUEUE_MAINTENANCE},
+    "app.tasks.sweep_orphaned_dify_conversations": {"queue": CELERY_QUEUE_MAINTENANCE},
+    "app.tasks.check_dify_endpoints": {"queue": CELERY_QUEUE_MAINTENANCE},
+}
+# Priorities within a queue; with the Redis broker 0 is served first. A message taken by a worker that
+# went away without acknowledging it is delivered again after the visibility timeout.
+CELERY_VISIBILITY_TIMEOUT = int(os.getenv("CELERY_VISIBILITY_TIMEOUT", "3600"))
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "priority_steps": list(range(10)),
+    "sep": ":",
+    "queue_order_strategy": "priority",
+    "visibility_timeout": CELERY_VISIBILITY_TIMEOUT,
+}
+CELERY_TASK_DEFAULT_PRIORITY = 5
+# Broker priority of messages by Chatwoot conversation priority (others get the default)
+CONVERSATION_PRIORITY_TASK_PRIORITIES = {"urgent": 0, "high": 2}
+# Compact task messages (measured by scripts/benchmark_task_payload.py). "msgpack" needs the msgpack
+# package; workers accept JSON as well, so messages queued before a switch are still read.
+CELERY_TASK_SERIALIZER = os.getenv("CELERY_TASK_SERIALIZER", "json")
+CELERY_ACCEPT_CONTENT = sorted({"json", CELERY_TASK_SERIALIZER})
+CELERY_TASK_COMPRESSION = os.getenv("CELERY_TASK_COMPRESSION", "zlib") or None  # empty disables
+# Results reach the answer callbacks through the link chain, nothing reads them from the backend
+CELERY_TASK_IGNORE_RESULT = os.getenv("CELERY_TASK_IGNORE_RESULT", "True").lower() in ("true", "1", "t")
+# Task arguments are also written to the message headers for monitoring, clipped to this length
+TASK_ARGSREPR_MAX_CHARS = int(os.getenv("TASK_ARGSREPR_MAX_CHARS", "100"))
+
+# Graceful drain for rolling restarts. Tasks are acknowledged once done, so a task cut off by a
+# stopping worker is delivered again rather than lost; a warm shutdown (SIGTERM) lets the running
+# tasks finish, within the task time limit, so stop grace periods should exceed CELERY_TASK_TIME_LIMIT.
+CELERY_TASK_ACKS_LATE = os.getenv("CELERY_TASK_ACKS_LATE", "True").lower() in ("true", "1", "t")
+CELERY_TASK_REJECT_ON_WORKER_LOST = os.getenv("CELERY_TASK_REJECT_ON_WORKER_LOST", "True").lower() in ("true", "1", "t")
+# Dify answers are checkpointed per task, a task delivered again doesn't ask Dify twice (app/utils/task_checkpoints.py)
+TASK_CHECKPOINT_TTL_SECONDS = int(os.getenv("TASK_CHECKPOINT_TTL_SECONDS", str(2 * CELERY_VISIBILITY_TIMEOUT)))
+# On SIGTERM an API replica refuses webhooks with a retryable 503 and fails its health check for
+# DRAIN_GRACE_SECONDS before it stops taking connections (0 stops right away, see app/utils/drain.py)
+DRAIN_GRACE_SECONDS = float(os.getenv("DRAIN_GRACE_SECONDS", "5"))
+DRAIN_RETRY_AFTER_SECONDS = int(os.getenv("DRAIN_RETRY_AFTER_SECONDS", "5"))
+
+# Periodic tasks, run by the `beat` service
+# How often stored Dify conversation IDs are checked against Dify (0 disables)
+DIFY_SWEEP_INTERVAL_SECONDS = int(os.getenv("DIFY_SWEEP_INTERVAL_SECONDS", "3600"))
+# Dify conversations queued for deletion are deleted in batches (see app/utils/dify_deletions.py)
+DIFY_DELETION_INTERVAL_SECONDS = int(os.getenv("DIFY_DELETION_INTERVAL_SECONDS", "30"))
+DIFY_DELETION_BATCH_SIZE = int(os.getenv("DIFY_DELETION_BATCH_SIZE", "50"))
+DIFY_DELETION_CONCURRENCY = int(os.getenv("DIFY_DELETION_CONCURRENCY", "5"))
+DIFY_DELETION_RATE = float(os.getenv("DIFY_DELETION_RATE", "10"))  # deletions started per second
+DIFY_DELETION_MAX_PER_RUN = int(os.getenv("DIFY_DELETION_MAX_PER_RUN", "1000"))
+DIFY_DELETION_MAX_ATTEMPTS = int(os.getenv("DIFY_DELETION_MAX_ATTEMPTS", "5"))
+# Deleting Dify conversations left behind by lost Chatwoot events deletes data, so it is opt-in (0 disables)
+DIFY_ORPHAN_SWEEP_INTERVAL_SECONDS = int(os.getenv("DIFY_ORPHAN_SWEEP_INTERVAL_SECONDS", "0"))
+DIFY_ORPHAN_GRACE_SECONDS = int(os.getenv("DIFY_ORPHAN_GRACE_SECONDS", "86400"))
+DIFY_ORPHAN_IDLE_DAYS = int(os.getenv("DIFY_ORPHAN_IDLE_DAYS", "30"))
+DIFY_ORPHAN_CHECK_LIMIT = int(os.getenv("DIFY_ORPHAN_CHECK_LIMIT", "200"))
+CELERY_BEAT_SCHEDULE = {}
+if DIFY_SWEEP_INTERVAL_SECONDS > 0:
+    CELERY_BEAT_SCHEDULE["sweep-stale-dify-conversations"] = {
+        "task": "app.tasks.sweep_stale_dify_conversations",
+        "schedule": float(DIFY_SWEEP_INTERVAL_SECONDS),
+    }
+if DIFY_DELETION_INTERVAL_SECONDS > 0:
+    CELERY_BEAT_SCHEDULE["process-dify-deletions"] = {
+        "task": "app.tasks.process_dify_deletions",
+        "schedule": float(DIFY_DELETION_INTERVAL_SECONDS),
+    }
+if DIFY_ORPHAN_SWEEP_INTERVAL_SECONDS > 0:
+    CELERY_BEAT_SCHEDULE["sweep-orphaned-dify-conversations"] = {
+        "task": "app.tasks.sweep_orphaned_dify_conversations",
+        "schedule": float(DIFY_ORPHAN_SWEEP_INTERVAL_SECONDS),
+    }
+
 # Dify.ai configuration
 DIFY_API_URL = os.getenv("DIFY_API_URL", "https://api.dify.ai/v1")
 DIFY_API_KEY = os.getenv("DIFY_API_KEY", "")
+# Pool of Dify endpoints as a JSON list of {"name", "url", "key", "weight"} (see app/utils/dify_endpoints.py);
+# unset, DIFY_API_URL and DIFY_API_KEY are the only endpoint
+DIFY_ENDPOINTS = json.loads(os.getenv("DIFY_ENDPOINTS") or "[]") or [
+    {"name": "default", "url": DIFY_API_URL, "key": DIFY_API_KEY}
+]
+DIFY_HEALTH_CHECK_INTERVAL_SECONDS = int(os.getenv("DIFY_HEALTH_CHECK_INTERVAL_SECONDS", "30"))
+if DIFY_HEALTH_CHECK_INTERVAL_SECONDS > 0 and len(DIFY_ENDPOINTS) > 1:
+    CELERY_BEAT_SCHEDULE["check-dify-endpoints"] = {
+        "task": "app.tasks.check_dify_endpoints",
+        "schedule": float(DIFY_HEALTH_CHECK_INTERVAL_SECONDS),
+    }
 DIFY_RESPONSE_MODE = os.getenv("DIFY_RESPONSE_MODE", "blocking")
 DIFY_TEMPERATURE = float(os.getenv("DIFY_TEMPERATURE", "0.7"))
 DIFY_MAX_TOKENS = int(os.getenv("DIFY_MAX_TOKENS", "2000"))
+# Tag wrapping a JSON action block in Dify answers (also looked up as a metadata key)
+DIFY_ACTIONS_TAG = os.getenv("DIFY_ACTIONS_TAG", "chatdify_actions")
 # Constants potentially used for polling/checking Dify conversation status (from tests)
 DIFY_CHECK_WAIT_TIME = int(os.getenv("DIFY_CHECK_WAIT_TIME", "15"))
 DIFY_CHECK_POLL_INTERVAL = int(os.getenv("DIFY_CHECK_POLL_INTERVAL", "2"))
@@ -61,7 +167,121 @@ CHATWOOT_API_URL = os.getenv("CHATWOOT_API_URL", "https://app.chatwoot.com/api/v
 CHATWOOT_API_KEY = os.getenv("CHATWOOT_API_KEY", "")
 CHATWOOT_ADMIN_API_KEY = os.getenv("CHATWOOT_ADMIN_API_KEY", "")
 CHATWOOT_ACCOUNT_ID = os.getenv("CHATWOOT_ACCOUNT_ID", "1")
-ALLOWED_CONVERSATION_STATUSES = os.getenv("ALLOWED_CONVERSATION_STATUSES", "open,pending").split(",")
+# Chatwoot accounts served by this deployment as a JSON list of {"account_id", "api_key", "admin_api_key",
+# "api_url"} (see app/utils/accounts.py); unset, CHATWOOT_ACCOUNT_ID with the keys above is the only account
+CHATWOOT_ACCOUNTS = json.loads(os.getenv("CHATWOOT_ACCOUNTS") or "[]") or [
+    {"account_id": CHATWOOT_ACCOUNT_ID, "api_key": CHATWOOT_API_KEY, "admin_api_key": CHATWOOT_ADMIN_API_KEY}
+]
+# Statuses in which the bot answers. "open" means a human has the conversation (the bot hands over by
+# opening it), so by default only pending conversations go to Dify and opening one cancels its Dify work
+ALLOWED_CONVERSATION_STATUSES = os.getenv("ALLOWED_CONVERSATION_STATUSES", "pending").split(",")
+# Stop answering once a human agent is assigned to the conversation
+BOT_SKIP_ASSIGNED_CONVERSATIONS = os.getenv("BOT_SKIP_ASSIGNED_CONVERSATIONS", "True").lower() in ("true", "1", "t")
+# How long per-conversation task bookkeeping (queued/running Dify work, cancellations) is kept
+CONVERSATION_TASKS_TTL_SECONDS = int(os.getenv("CONVERSATION_TASKS_TTL_SECONDS", "3600"))
+# Echoes of bot messages are recognized by ID for this long
+BOT_ECHO_TTL_SECONDS = int(os.getenv("BOT_ECHO_TTL_SECONDS", "600"))
+# Stop answering after this many bot turns within the window without a human agent (0 disables)
+BOT_LOOP_MAX_TURNS = int(os.getenv("BOT_LOOP_MAX_TURNS", "10"))
+BOT_LOOP_WINDOW_SECONDS = int(os.getenv("BOT_LOOP_WINDOW_SECONDS", "120"))
+# Per message direction: "dispatch" (own Dify call), "context" (prepended to the next dispatched
+# message, see app/utils/conversation_context.py) or "ignore"
+MESSAGE_DIRECTION_MODES = {
+    "incoming": os.getenv("INCOMING_MESSAGE_MODE", "dispatch").lower(),
+    "outgoing": os.getenv("OUTGOING_MESSAGE_MODE", "dispatch").lower(),
+}
+CONTEXT_BUFFER_MAX_MESSAGES = int(os.getenv("CONTEXT_BUFFER_MAX_MESSAGES", "20"))
+CONTEXT_BUFFER_TTL_SECONDS = int(os.getenv("CONTEXT_BUFFER_TTL_SECONDS", "86400"))
+# Opt-in cache of answers to the first message of a conversation (see app/utils/answer_cache.py)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "False").lower() in ("true", "1", "t")
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+# Longer openers are too specific to be worth caching
+ANSWER_CACHE_MAX_QUERY_LENGTH = int(os.getenv("ANSWER_CACHE_MAX_QUERY_LENGTH", "200"))
+# JSON file with fast lane rules answered without Dify (see app/utils/rules.py)
+FAST_LANE_RULES_FILE = os.getenv("FAST_LANE_RULES_FILE", "")
+# Start a fresh Dify conversation after this many turns / this long without messages (0 disables),
+# or once the Chatwoot conversation reaches one of these statuses (see app/utils/dify_rotation.py).
+# All off by default: a rotated conversation keeps only a short transcript of the old one
+DIFY_ROTATE_AFTER_TURNS = int(os.getenv("DIFY_ROTATE_AFTER_TURNS", "0"))
+DIFY_ROTATE_AFTER_IDLE_SECONDS = int(os.getenv("DIFY_ROTATE_AFTER_IDLE_SECONDS", "0"))
+DIFY_ROTATE_ON_STATUSES = [s for s in os.getenv("DIFY_ROTATE_ON_STATUSES", "").split(",") if s]
+# The new conversation is seeded with the last turns of the old one, each clipped to this length
+DIFY_ROTATION_SUMMARY_TURNS = int(os.getenv("DIFY_ROTATION_SUMMARY_TURNS", "5"))
+DIFY_ROTATION_SUMMARY_MESSAGE_CHARS = int(os.getenv("DIFY_ROTATION_SUMMARY_MESSAGE_CHARS", "300"))
+# Messages older than this when a worker picks them up are not answered (0, the default, disables). The
+# age counts from webhook receipt, lane and retry waits included: "handoff" opens the conversation for a
+# human, "drop" skips the message silently
+MESSAGE_DEADLINE_SECONDS = int(os.getenv("MESSAGE_DEADLINE_SECONDS", "0"))
+EXPIRED_MESSAGE_ACTION = os.getenv("EXPIRED_MESSAGE_ACTION", "handoff").lower()
+# Skip a message if a newer one of the same conversation is queued; it is sent to Dify with the newer one,
+# so consecutive questions get one answer. Off by default
+SKIP_SUPERSEDED_MESSAGES = os.getenv("SKIP_SUPERSEDED_MESSAGES", "False").lower() in ("true", "1", "t")
+# Admission control in the webhook (see app/utils/backlog.py), each threshold 0 to disable. Past a soft
+# threshold new messages are told their place in line; past a hard one they go straight to a human.
+ADMISSION_SOFT_QUEUE_DEPTH = int(os.getenv("ADMISSION_SOFT_QUEUE_DEPTH", "0"))
+ADMISSION_SOFT_WAIT_SECONDS = float(os.getenv("ADMISSION_SOFT_WAIT_SECONDS", "0"))
+ADMISSION_HARD_QUEUE_DEPTH = int(os.getenv("ADMISSION_HARD_QUEUE_DEPTH", "0"))
+ADMISSION_HARD_WAIT_SECONDS = float(os.getenv("ADMISSION_HARD_WAIT_SECONDS", "0"))
+ADMISSION_BUSY_MESSAGE = os.getenv(
+    "ADMISSION_BUSY_MESSAGE",
+    "We are answering many conversations right now. You are number {position} in line, "
+    "the expected wait is about {wait_minutes} min.",
+)
+ADMISSION_NOTICE_COOLDOWN_SECONDS = int(os.getenv("ADMISSION_NOTICE_COOLDOWN_SECONDS", "300"))  # per conversation
+ADMISSION_SAMPLE_SECONDS = float(os.getenv("ADMISSION_SAMPLE_SECONDS", "1"))  # backlog readings reused this long
+# Scaling signals for an external autoscaler (GET /api/v1/health/autoscaling): worker and API replica
+# counts that answer within the target latency, from the rates and service time of the last window
+AUTOSCALE_TARGET_LATENCY_SECONDS = float(os.getenv("AUTOSCALE_TARGET_LATENCY_SECONDS", "30"))
+AUTOSCALE_WINDOW_SECONDS = int(os.getenv("AUTOSCALE_WINDOW_SECONDS", "300"))
+AUTOSCALE_DEFAULT_SERVICE_SECONDS = float(os.getenv("AUTOSCALE_DEFAULT_SERVICE_SECONDS", "10"))  # until measured
+AUTOSCALE_MIN_WORKERS = int(os.getenv("AUTOSCALE_MIN_WORKERS", "1"))
+AUTOSCALE_MAX_WORKERS = int(os.getenv("AUTOSCALE_MAX_WORKERS", "20"))
+AUTOSCALE_API_REPLICA_RPS = float(os.getenv("AUTOSCALE_API_REPLICA_RPS", "50"))  # webhooks one API replica takes
+AUTOSCALE_MIN_API_REPLICAS = int(os.getenv("AUTOSCALE_MIN_API_REPLICAS", "1"))
+AUTOSCALE_MAX_API_REPLICAS = int(os.getenv("AUTOSCALE_MAX_API_REPLICAS", "10"))
+# Posted when the Dify call takes more than this share of the time left until the deadline (empty disables)
+HOLDING_MESSAGE = os.getenv("HOLDING_MESSAGE", "")
+DIFY_CALL_DEADLINE_SHARE = float(os.getenv("DIFY_CALL_DEADLINE_SHARE", "0.5"))
+# Show Chatwoot's typing indicator while Dify generates, re-sent so it stays visible on long generations
+TYPING_INDICATOR_ENABLED = os.getenv("TYPING_INDICATOR_ENABLED", "True").lower() in ("true", "1", "t")
+TYPING_KEEPALIVE_SECONDS = float(os.getenv("TYPING_KEEPALIVE_SECONDS", "10"))
+# Outbound Chatwoot messages from the workers go through the outbox, posted by `python -m app.outbox`.
+# Off by default: once on, answers are only posted while that dispatcher runs
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "False").lower() in ("true", "1", "t")
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", "2"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))  # due conversations read per round
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "10"))  # conversations posted to in parallel
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "2"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "300"))
+OUTBOX_RETENTION_HOURS = int(os.getenv("OUTBOX_RETENTION_HOURS", "24"))  # sent messages kept this long
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "30"))  # only one dispatcher posts at a time
+# One Dify call in flight per conversation, in message order (see app/utils/conversation_tasks.py)
+CONVERSATION_LANES_ENABLED = os.getenv("CONVERSATION_LANES_ENABLED", "True").lower() in ("true", "1", "t")
+CONVERSATION_LANE_RETRY_DELAY = float(os.getenv("CONVERSATION_LANE_RETRY_DELAY", "1"))
+CONVERSATION_LANE_STALL_SECONDS = int(os.getenv("CONVERSATION_LANE_STALL_SECONDS", "60"))
+# Outlives a task that hits the hard time limit, so a crashed holder cannot block a lane forever
+CONVERSATION_LEASE_SECONDS = int(os.getenv("CONVERSATION_LEASE_SECONDS", str(task_time_limit + 30)))
+# Pooled Chatwoot client limits (used while a ChatwootHandler is opened)
+CHATWOOT_MAX_CONNECTIONS = int(os.getenv("CHATWOOT_MAX_CONNECTIONS", "20"))
+CHATWOOT_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("CHATWOOT_MAX_KEEPALIVE_CONNECTIONS", "10"))
+# Max Chatwoot calls run in parallel for a single /conversations/{id}/actions request
+CONVERSATION_ACTIONS_CONCURRENCY = int(os.getenv("CONVERSATION_ACTIONS_CONCURRENCY", "4"))
+# Window for merging label/custom attribute updates to the same conversation, 0 disables coalescing
+WRITE_COALESCE_WINDOW_MS = int(os.getenv("WRITE_COALESCE_WINDOW_MS", "0"))
+# Bulk conversation operations (/conversations/bulk)
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "8"))
+BULK_MAX_CONVERSATIONS = int(os.getenv("BULK_MAX_CONVERSATIONS", "10000"))
+BULK_MAX_ATTEMPTS = int(os.getenv("BULK_MAX_ATTEMPTS", "3"))
+BULK_RATE_LIMIT_BACKOFF_SECONDS = float(os.getenv("BULK_RATE_LIMIT_BACKOFF_SECONDS", "10"))
+BULK_JOB_TTL_SECONDS = int(os.getenv("BULK_JOB_TTL_SECONDS", str(7 * 24 * 3600)))
+BULK_JOB_LOCK_SECONDS = int(os.getenv("BULK_JOB_LOCK_SECONDS", "120"))
+# Locally known conversation state used to skip no-op Chatwoot writes, TTL of 0 (the default) disables
+# suppression. The state is per process and fed by the webhooks it receives, so only enable it with a
+# single API replica: another replica may have seen a change this one doesn't know of
+CHATWOOT_STATE_TTL_SECONDS = int(os.getenv("CHATWOOT_STATE_TTL_SECONDS", "0"))
+CHATWOOT_STATE_MAX_ENTRIES = int(os.getenv("CHATWOOT_STATE_MAX_ENTRIES", "10000"))
 
 # Team cache configuration - disabled by default for better API reliability
 ENABLE_TEAM_CACHE = os.getenv("ENABLE_TEAM_CACHE", "False").lower() in ("true", "1", "t")
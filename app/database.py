@@ -1,6 +1,8 @@
 from contextlib import asynccontextmanager, contextmanager
 from typing import AsyncGenerator, Generator
 
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.pool import QueuePool
 from sqlmodel import Session, SQLModel, create_engine
@@ -69,8 +71,37 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
             raise
 
 
+# Replicas starting together would each create the same tables and columns, and all but one fail on
+# the duplicates: a transaction-level advisory lock makes them take turns, the later ones find the
+# schema in place
+SCHEMA_LOCK_ID = 4_281_703_121
+
+
 async def create_db_tables():
     """Create tables asynchronously at startup."""
     # Use sync_engine for table creation as it's more reliable
     # SQLModel.metadata.create_all() only works with sync engine
-    SQLModel.metadata.create_all(sync_engine)
+    with sync_engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": SCHEMA_LOCK_ID})
+        SQLModel.metadata.create_all(connection)
+        add_missing_columns(connection)
+
+
+def add_missing_columns(connection: Connection) -> None:
+    """Add model columns missing from existing tables, create_all() only creates whole tables.
+
+    New columns must be nullable or have a server_default so existing rows stay valid.
+    """
+    inspector = inspect(connection)
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(connection.dialect)}'
+            if column.server_default is not None:
+                ddl += f" DEFAULT {column.server_default.arg!r}"
+            connection.execute(text(ddl))
@@ -3,7 +3,7 @@ import os
 
 from fastapi import FastAPI
 
-from app.api import health, webhooks
+from app.api import bulk, dead_letters, health, webhooks
 from app.api.webhooks import lifespan
 from app.utils.sentry import init_sentry
 
@@ -25,4 +25,9 @@ if sentry_initialized:
 app = FastAPI(title="Chatdify", lifespan=lifespan, debug=os.getenv("DEBUG", "False") == "True")
 
 app.include_router(webhooks.router, prefix="/api/v1")
+app.include_router(bulk.router, prefix="/api/v1")
+# The same routes for each Chatwoot account of CHATWOOT_ACCOUNTS, the ones above serve the first account
+app.include_router(webhooks.router, prefix="/api/v1/accounts/{account_id}")
+app.include_router(bulk.router, prefix="/api/v1/accounts/{account_id}")
+app.include_router(dead_letters.router, prefix="/api/v1")
 app.include_router(health.router, prefix="/api/v1/health")
@@ -1,7 +1,7 @@
 from datetime import UTC, datetime
-from typing import Literal, Optional
+from typing import Any, Dict, Literal, Optional
 
-from sqlalchemy import Column
+from sqlalchemy import JSON, Column
 from sqlalchemy.types import DateTime as SqlaDateTime
 from sqlmodel import Field, SQLModel
 
@@ -10,8 +10,15 @@ class Dialogue(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     chatwoot_conversation_id: str = Field(index=True)
     dify_conversation_id: Optional[str] = Field(default=None)
+    dify_endpoint: Optional[str] = Field(default=None)  # pool endpoint owning the Dify conversation
     status: str = Field(default="pending")
     assignee_id: Optional[int] = Field(default=None)
+    # Turns sent to the current Dify conversation and when the last one was, for rotation
+    dify_turns: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    last_message_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(SqlaDateTime(timezone=True), nullable=True),
+    )
     created_at: datetime = Field(
         default_factory=lambda: datetime.now(UTC),
         sa_column=Column(
@@ -31,6 +38,74 @@ class Dialogue(SQLModel, table=True):
     )
 
 
+class DialogueRotation(SQLModel, table=True):
+    """A Dify conversation that was replaced by a fresh one for the same Chatwoot conversation"""
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    chatwoot_conversation_id: str = Field(index=True)
+    dify_conversation_id: str
+    reason: str  # "turns", "inactivity" or "status"
+    turns: int = 0
+    rotated_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC),
+        sa_column=Column(
+            SqlaDateTime(timezone=True),
+            nullable=False,
+            default=lambda: datetime.now(UTC),
+        ),
+    )
+
+
+class DeadLetter(SQLModel, table=True):
+    """A Dify task that failed for good, kept with its payload so it can be inspected and replayed"""
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    task_id: str = Field(index=True)
+    task_name: str
+    chatwoot_conversation_id: Optional[str] = Field(default=None, index=True)
+    payload: Dict[str, Any] = Field(default_factory=dict, sa_column=Column(JSON, nullable=False))  # args and kwargs
+    error_type: str = Field(index=True)  # exception class, e.g. "HTTPStatusError"
+    error_message: str = ""
+    attempts: int = 1
+    failed_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC),
+        sa_column=Column(SqlaDateTime(timezone=True), nullable=False, index=True, default=lambda: datetime.now(UTC)),
+    )
+    replays: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    replayed_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(SqlaDateTime(timezone=True), nullable=True),
+    )
+    replay_task_id: Optional[str] = None
+
+
+class OutboxMessage(SQLModel, table=True):
+    """A message for Chatwoot, posted by the outbox dispatcher (app/outbox.py) in per-conversation order"""
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    idempotency_key: str = Field(unique=True, index=True)  # queueing the same message twice is a no-op
+    conversation_id: int = Field(index=True)
+    account_id: Optional[str] = None  # Chatwoot account of the conversation, the first configured one if unset
+    content: str
+    private: bool = False
+    status: str = Field(default="pending", index=True)  # "pending", "sent" or "failed"
+    attempts: int = 0
+    next_attempt_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(SqlaDateTime(timezone=True), nullable=True),
+    )
+    last_error: Optional[str] = None
+    chatwoot_message_id: Optional[int] = None
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(UTC),
+        sa_column=Column(SqlaDateTime(timezone=True), nullable=False, default=lambda: datetime.now(UTC)),
+    )
+    sent_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(SqlaDateTime(timezone=True), nullable=True),
+    )
+
+
 # This can be used for both validation and creation
 class DialogueCreate(SQLModel):
     chatwoot_conversation_id: str
@@ -43,6 +118,7 @@ class DialogueCreate(SQLModel):
 class ChatwootSender(SQLModel):
     id: Optional[int] = None
     type: Optional[str] = None  # "user", "agent_bot", etc.
+    name: Optional[str] = None
 
 
 class ChatwootMeta(SQLModel):
@@ -74,6 +150,7 @@ class ChatwootMessage(SQLModel):
 
 class ChatwootWebhook(SQLModel):
     event: str
+    id: Optional[int] = None  # From payload["id"], the message ID for message events
     message_type: Literal["incoming", "outgoing"]  # TODO: ideally remove this
     sender: Optional[ChatwootSender] = None  # From payload["sender"]
     message: Optional[ChatwootMessage] = None
@@ -121,9 +198,10 @@ class ChatwootWebhook(SQLModel):
         """Get sender type"""
         return self.sender.type if self.sender else None
 
-    def to_dialogue_create(self) -> DialogueCreate:
+    def to_dialogue_create(self, conversation_key: Optional[str] = None) -> DialogueCreate:
+        """Dialogue data of the event, stored under the conversation key of its account if given"""
         return DialogueCreate(
-            chatwoot_conversation_id=str(self.conversation_id),
+            chatwoot_conversation_id=conversation_key or str(self.conversation_id),
             status=self.status or "pending",
             assignee_id=self.assignee_id,
         )
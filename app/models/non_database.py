@@ -1,4 +1,8 @@
+from datetime import datetime
 from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from sqlmodel import SQLModel
 
 
 class ConversationPriority(str, Enum):
@@ -13,3 +17,35 @@ class ConversationStatus(str, Enum):
     OPEN = "open"
     RESOLVED = "resolved"
     PENDING = "pending"
+
+
+class ConversationActions(SQLModel):
+    """Batch of conversation updates applied by a single /conversations/{id}/actions call"""
+
+    status: Optional[ConversationStatus] = None
+    priority: Optional[ConversationPriority] = None
+    labels: Optional[List[str]] = None
+    custom_attributes: Optional[Dict[str, Any]] = None
+    team: Optional[str] = None
+    force: bool = False  # write even when the known Chatwoot state already matches
+
+
+class BulkConversationActions(SQLModel):
+    """Same set of actions applied to many conversations by /conversations/bulk"""
+
+    conversation_ids: List[int]
+    actions: ConversationActions
+
+
+class DeadLetterReplay(SQLModel):
+    """Selection of dead letters replayed by /dead-letters/replay; filters combine, ids narrow them further"""
+
+    ids: Optional[List[int]] = None
+    error_type: Optional[str] = None
+    conversation_id: Optional[int] = None
+    account_id: Optional[str] = None  # Chatwoot account of conversation_id, the first configured one if unset
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    include_replayed: bool = False  # entries replayed before are skipped unless set
+    limit: Optional[int] = None  # at most DEAD_LETTER_REPLAY_MAX
+    rate: Optional[float] = None  # tasks started per second, DEAD_LETTER_REPLAY_RATE by default
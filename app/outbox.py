@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import signal
+import uuid
+from datetime import UTC, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import delete, func, or_, update
+from sqlalchemy.future import select
+
+from app import config
+from app.api.chatwoot import ChatwootRegistry
+from app.database import get_async_db
+from app.models.database import OutboxMessage
+from app.redis_client import async_redis_client
+from app.utils import metrics
+from app.utils.outbox import ANSWER_KEY_SUFFIX, WAKEUP_KEY
+
+logger = logging.getLogger(__name__)
+
+# Posts the messages queued in the outbox (see app/utils/outbox.py) to Chatwoot:
+#
+#   python -m app.outbox
+#
+# Each round picks up to OUTBOX_BATCH_SIZE conversations whose oldest pending message is due and
+# posts their queued messages with one pooled client shared by the handlers of all Chatwoot accounts,
+# up to OUTBOX_CONCURRENCY conversations in parallel and in queue order within a conversation: a
+# message waiting for a retry holds back the later ones of its conversation, not other conversations.
+# Failed posts are retried with exponential backoff; after OUTBOX_MAX_ATTEMPTS, or on an error
+# retrying can't fix, the message is marked failed and the conversation moves on. A Redis lease
+# keeps a second dispatcher from posting the same messages, so extra replicas only stand by. Once
+# a Dify answer is posted, the typing indicator the worker left on is cleared.
+
+LEASE_KEY = "chatdify:outbox:lease"
+PRUNE_INTERVAL_SECONDS = 60
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is None:  # drivers without timezone support
+        return value.replace(tzinfo=UTC)
+    return value
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code >= 500 or status_code in (408, 429)
+    return True
+
+
+class OutboxDispatcher:
+    def __init__(self, chatwoot: ChatwootRegistry):
+        self.chatwoot = chatwoot
+        self.owner = uuid.uuid4().hex
+        self._semaphore = asyncio.Semaphore(config.OUTBOX_CONCURRENCY)
+        self._pruned_at = 0.0
+
+    async def _hold_lease(self) -> bool:
+        """Take or renew the dispatcher lease, False while another dispatcher holds it"""
+        if await async_redis_client.set(LEASE_KEY, self.owner, nx=True, ex=config.OUTBOX_LEASE_SECONDS):
+            return True
+        if await async_redis_client.get(LEASE_KEY) == self.owner:
+            await async_redis_client.expire(LEASE_KEY, config.OUTBOX_LEASE_SECONDS)
+            return True
+        return False
+
+    async def _renew_lease(self) -> None:
+        # Keeps the lease through rounds that take longer than the lease itself
+        while True:
+            await asyncio.sleep(config.OUTBOX_LEASE_SECONDS / 3)
+            try:
+                if await async_redis_client.get(LEASE_KEY) == self.owner:
+                    await async_redis_client.expire(LEASE_KEY, config.OUTBOX_LEASE_SECONDS)
+            except Exception as e:
+                logger.warning(f"Failed to renew outbox lease: {e}")
+
+    async def _release_lease(self) -> None:
+        try:
+            if await async_redis_client.get(LEASE_KEY) == self.owner:
+                await async_redis_client.delete(LEASE_KEY)
+        except Exception as e:
+            logger.warning(f"Failed to release outbox lease: {e}")
+
+    async def _wait(self, stop: asyncio.Event) -> None:
+        """Sleep until a message is queued, the poll interval passed or the dispatcher is stopped"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + config.OUTBOX_POLL_INTERVAL_SECONDS
+        while not stop.is_set() and (remaining := deadline - loop.time()) > 0:
+            try:
+                # Short blocking reads, the Redis client's socket timeout would cut longer ones
+                if await async_redis_client.blpop(
+                    [WAKEUP_KEY], timeout=min(remaining, config.REDIS_SOCKET_TIMEOUT / 2)
+                ):
+                    return
+            except Exception as e:
+                logger.debug(f"Outbox wake-up read failed, polling: {e}")
+                await asyncio.sleep(remaining)
+                return
+
+    async def run(self, stop: asyncio.Event) -> None:
+        logger.info(f"Outbox dispatcher {self.owner} started")
+        renewer = asyncio.create_task(self._renew_lease())
+        try:
+            while not stop.is_set():
+                try:
+                    if await self._hold_lease():
+                        posted = await self.dispatch_once()
+                        await self._prune()
+                        if posted:
+                            continue  # more may be pending already
+                except Exception as e:
+                    logger.error(f"Outbox dispatch round failed: {e}", exc_info=True)
+                await self._wait(stop)
+        finally:
+            renewer.cancel()
+            await self._release_lease()
+            logger.info(f"Outbox dispatcher {self.owner} stopped")
+
+    async def dispatch_once(self) -> int:
+        """Post what is due now, returns the number of messages posted"""
+        # Due conversations are picked in SQL by their oldest pending message: reading the oldest
+        # messages first would let those backing off after an outage fill the batch and hold back
+        # every other conversation until their retries are over
+        heads = (
+            select(func.min(OutboxMessage.id))
+            .where(OutboxMessage.status == "pending")
+            .group_by(OutboxMessage.account_id, OutboxMessage.conversation_id)
+        )
+        async with get_async_db() as db:
+            result = await db.execute(
+                select(OutboxMessage.account_id, OutboxMessage.conversation_id)
+                .where(
+                    OutboxMessage.id.in_(heads),
+                    or_(OutboxMessage.next_attempt_at.is_(None), OutboxMessage.next_attempt_at <= datetime.now(UTC)),
+                )
+                .order_by(OutboxMessage.id)
+                .limit(config.OUTBOX_BATCH_SIZE)
+            )
+            due = {tuple(row) for row in result.all()}
+            if not due:
+                return 0
+            result = await db.execute(
+                select(OutboxMessage)
+                .where(
+                    OutboxMessage.status == "pending",
+                    OutboxMessage.conversation_id.in_({conversation_id for _, conversation_id in due}),
+                )
+                .order_by(OutboxMessage.id)
+            )
+            messages = result.scalars().all()
+            db.expunge_all()
+
+        by_conversation: Dict[Tuple[Optional[str], int], List[OutboxMessage]] = {}
+        for message in messages:
+            key = (message.account_id, message.conversation_id)
+            if key in due:  # the same conversation ID in another account may not be due
+                by_conversation.setdefault(key, []).append(message)
+        posted = await asyncio.gather(*(self._post_conversation(queued) for queued in by_conversation.values()))
+        return sum(posted)
+
+    async def _post_conversation(self, messages: List[OutboxMessage]) -> int:
+        posted = 0
+        async with self._semaphore:
+            for message in messages:
+                if not await self._post(message):
+                    break  # the rest waits for this one's retry
+                posted += 1
+        return posted
+
+    async def _post(self, message: OutboxMessage) -> bool:
+        """Post one message, False if it is to be retried later"""
+        attempts = message.attempts + 1
+        chatwoot = self.chatwoot.get(message.account_id)
+        if chatwoot is None:
+            logger.error(f"Dropping outbox message {message.id}: Chatwoot account {message.account_id} not configured")
+            await self._update(message.id, status="failed", attempts=attempts, last_error="account not configured")
+            await metrics.aincr("outbox.failed")
+            return True
+        try:
+            result = await chatwoot.send_message(
+                conversation_id=message.conversation_id, message=message.content, private=message.private
+            )
+        except Exception as e:
+            if _retryable(e) and attempts < config.OUTBOX_MAX_ATTEMPTS:
+                delay = min(config.OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), config.OUTBOX_RETRY_MAX_SECONDS)
+                logger.warning(
+                    f"Outbox message {message.id} for conversation {message.conversation_id} failed "
+                    f"(attempt {attempts}/{config.OUTBOX_MAX_ATTEMPTS}), retrying in {delay:.0f}s: {e}"
+                )
+                await self._update(
+                    message.id,
+                    attempts=attempts,
+                    last_error=str(e)[:500],
+                    next_attempt_at=datetime.now(UTC) + timedelta(seconds=delay),
+                )
+                await metrics.aincr("outbox.retries")
+                return False
+            logger.error(
+                f"Giving up on outbox message {message.id} for conversation {message.conversation_id} "
+                f"after {attempts} attempts: {e}"
+            )
+            await self._update(message.id, status="failed", attempts=attempts, last_error=str(e)[:500])
+            await metrics.aincr("outbox.failed")
+            return True
+
+        await self._update(
+            message.id,
+            status="sent",
+            attempts=attempts,
+            sent_at=datetime.now(UTC),
+            chatwoot_message_id=result.get("id") if isinstance(result, dict) else None,
+        )
+        await metrics.aincr("outbox.sent")
+        await metrics.aobserve(
+            "outbox.queued_to_sent_seconds", (datetime.now(UTC) - _as_utc(message.created_at)).total_seconds()
+        )
+        if config.TYPING_INDICATOR_ENABLED and message.idempotency_key.endswith(ANSWER_KEY_SUFFIX):
+            try:
+                await chatwoot.toggle_typing(message.conversation_id, False)
+            except Exception as e:
+                logger.debug(f"Failed to clear typing indicator of conversation {message.conversation_id}: {e}")
+        return True
+
+    @staticmethod
+    async def _update(message_id: int, **values) -> None:
+        async with get_async_db() as db:
+            await db.execute(update(OutboxMessage).where(OutboxMessage.id == message_id).values(**values))
+
+    async def _prune(self) -> None:
+        """Drop sent messages past OUTBOX_RETENTION_HOURS, once a minute"""
+        loop_time = asyncio.get_running_loop().time()
+        if loop_time - self._pruned_at < PRUNE_INTERVAL_SECONDS:
+            return
+        self._pruned_at = loop_time
+        cutoff = datetime.now(UTC) - timedelta(hours=config.OUTBOX_RETENTION_HOURS)
+        async with get_async_db() as db:
+            result = await db.execute(
+                delete(OutboxMessage).where(OutboxMessage.status == "sent", OutboxMessage.sent_at < cutoff)
+            )
+        if result.rowcount:
+            logger.info(f"Pruned {result.rowcount} sent outbox messages")
+
+
+async def main() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    async with ChatwootRegistry() as chatwoot:
+        await OutboxDispatcher(chatwoot).run(stop)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=getattr(logging, config.LOG_LEVEL.upper()),
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    asyncio.run(main())
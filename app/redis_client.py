@@ -0,0 +1,30 @@
+import redis
+import redis.asyncio
+
+from app import config
+
+# Redis connection for application state (metrics, coordination keys).
+# Connections are opened lazily, so importing this module does not require Redis to be up.
+redis_client = redis.Redis.from_url(
+    config.REDIS_STATE_URL,
+    decode_responses=True,
+    socket_timeout=config.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=config.REDIS_SOCKET_TIMEOUT,
+)
+
+# Async counterpart for the API process. Bound to the event loop it is first used in,
+# so Celery tasks should stick to the sync client above.
+async_redis_client = redis.asyncio.Redis.from_url(
+    config.REDIS_STATE_URL,
+    decode_responses=True,
+    socket_timeout=config.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=config.REDIS_SOCKET_TIMEOUT,
+)
+
+# The Celery broker, read by the API to measure the queues (see app/utils/backlog.py)
+async_broker_client = redis.asyncio.Redis.from_url(
+    config.CELERY_BROKER_URL,
+    decode_responses=True,
+    socket_timeout=config.REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=config.REDIS_SOCKET_TIMEOUT,
+)
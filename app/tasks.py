@@ -1,18 +1,58 @@
+import asyncio
+import json
 import logging
-from typing import Any, Dict, Optional
+import threading
+import time
+from contextlib import contextmanager
+from datetime import UTC, datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import httpx
 from celery import Celery, signals
+from celery.app.task import Context
 from dotenv import load_dotenv
+from sqlalchemy import delete, func, select, update
 
 from app import config
-from app.api.chatwoot import ChatwootHandler
+from app.api.chatwoot import ChatwootRegistry, chatwoot_for
+from app.api.conversation_actions import (
+    EMBEDDED_ACTIONS_PATTERN,
+    execute_conversation_actions,
+    extract_embedded_actions,
+    summarize_report,
+)
 from app.config import (
     BOT_CONVERSATION_OPENED_MESSAGE_EXTERNAL,
     BOT_ERROR_MESSAGE_INTERNAL,
 )
 from app.database import SessionLocal
-from app.models.database import Dialogue, DifyResponse
+from app.models.database import DeadLetter, Dialogue, DialogueRotation, DifyResponse
+from app.models.non_database import ConversationActions
+from app.utils import backlog, dify_deletions, metrics, task_checkpoints
+from app.utils.accounts import split_key
+from app.utils.answer_cache import get_first_turn_answer, store_first_turn_answer
+from app.utils.conversation_context import buffer_lines_sync, context_line, pop_buffered_messages_sync, with_context
+from app.utils.conversation_tasks import (
+    acquire_turn,
+    is_cancelled,
+    is_superseded,
+    register_generation,
+    release_turn,
+    untrack_task,
+)
+from app.utils.dify_endpoints import (
+    DEFAULT_ENDPOINT,
+    ENDPOINTS,
+    DifyEndpoint,
+    check_endpoint,
+    get_endpoint,
+    in_flight,
+    pick_endpoint,
+    tag,
+    untag,
+)
+from app.utils.dify_rotation import build_summary, clear_rotation_request, rotation_reason
+from app.utils.outbox import ANSWER_KEY_SUFFIX
 from app.utils.sentry import init_sentry
 
 load_dotenv()
@@ -51,6 +91,22 @@ logger.propagate = True
 
 celery = Celery("tasks")
 celery.config_from_object(config, namespace="CELERY")
+# The headers would otherwise repeat up to 1 KB of each message and Dify answer
+celery.amqp.argsrepr_maxsize = celery.amqp.kwargsrepr_maxsize = config.TASK_ARGSREPR_MAX_CHARS
+
+# Fields of a Dify response the answer callback uses; the rest (retriever resources, usage)
+# would travel through the broker again for nothing
+DIFY_RESULT_FIELDS = ("event", "answer", "conversation_id", "message_id", "task_id", "created_at")
+
+
+def message_route(message_type: Optional[str], conversation_priority: Optional[str]) -> Dict[str, Any]:
+    """Queue and broker priority for a message's Dify task"""
+    return {
+        "queue": config.CELERY_QUEUE_AGENT if message_type == "outgoing" else config.CELERY_QUEUE_LIVE,
+        "priority": config.CONVERSATION_PRIORITY_TASK_PRIORITIES.get(
+            conversation_priority or "", config.CELERY_TASK_DEFAULT_PRIORITY
+        ),
+    }
 
 
 # Initialize Sentry on Celery daemon startup
@@ -79,6 +135,27 @@ def init_sentry_for_worker(**_kwargs):
         logger.info("Celery worker: Sentry initialized with Celery, HTTPX, and SQLAlchemy integrations")
 
 
+# Warm shutdown (SIGTERM): the worker stops taking messages and waits for the running tasks, which
+# the task time limit bounds; anything cut off later is delivered again (task_acks_late)
+@signals.worker_shutting_down.connect
+def log_worker_drain(sig=None, how=None, **_kwargs):
+    if how == "Warm":
+        logger.info(f"Worker draining on {sig}: finishing running tasks, at most {config.task_time_limit}s")
+
+
+def compact_dify_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a Dify response that is handed on to handle_dify_response"""
+    compact = {key: result[key] for key in DIFY_RESULT_FIELDS if key in result}
+    metadata = {
+        key: value
+        for key, value in (result.get("metadata") or {}).items()
+        if key in (config.DIFY_ACTIONS_TAG, "cached")
+    }
+    if metadata:
+        compact["metadata"] = metadata
+    return compact
+
+
 def make_dify_request(url: str, data: dict, headers: dict) -> dict:
     """Make a request to Dify API with retry logic"""
     with httpx.Client(timeout=HTTPX_TIMEOUT) as client:
@@ -87,8 +164,258 @@ def make_dify_request(url: str, data: dict, headers: dict) -> dict:
         return response.json()
 
 
+def stream_dify_chat(
+    client: httpx.Client,
+    url: str,
+    data: dict,
+    headers: dict,
+    on_task_id: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    """Consume a streaming chat-messages response and return it in the blocking-mode shape.
+
+    on_task_id is called with Dify's task_id as soon as the first event arrives, which is
+    what the stop API needs to cancel the generation while it runs.
+    """
+    result: Dict[str, Any] = {"event": "message", "answer": ""}
+    with client.stream("POST", url, json=data, headers=headers) as response:
+        if response.status_code >= 400:
+            response.read()
+            logger.error(f"Dify API error response ({response.status_code}): {response.text}")
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line.startswith("data:"):
+                continue
+            event = json.loads(line[len("data:") :])
+            kind = event.get("event")
+            if "task_id" in event and "task_id" not in result:
+                result["task_id"] = event["task_id"]
+                if on_task_id:
+                    on_task_id(event["task_id"])
+            for key in ("id", "message_id", "conversation_id", "mode", "created_at"):
+                if key in event:
+                    result.setdefault(key, event[key])
+            if kind in ("message", "agent_message"):
+                result["answer"] += event.get("answer", "")
+            elif kind == "message_replace":
+                result["answer"] = event.get("answer", "")
+            elif kind == "message_end":
+                result["metadata"] = event.get("metadata")
+            elif kind == "error":
+                raise RuntimeError(
+                    f"Dify stream error {event.get('status')} {event.get('code')}: {event.get('message')}"
+                )
+    return result
+
+
+def get_dialogue_sync(chatwoot_convo_id: str) -> Optional[Dialogue]:
+    """Read the current state of a dialogue (synchronous), None if missing or unreadable"""
+    with SessionLocal() as db:
+        try:
+            return db.query(Dialogue).filter_by(chatwoot_conversation_id=chatwoot_convo_id).first()
+        except Exception as e:
+            logger.error(f"Failed to read dialogue for chatwoot_convo_id={chatwoot_convo_id}: {e}")
+            return None
+
+
+def record_dify_turn_sync(chatwoot_convo_id: str):
+    """Count a turn sent to the dialogue's current Dify conversation (synchronous)"""
+    with SessionLocal() as db:
+        try:
+            db.execute(
+                update(Dialogue)
+                .where(Dialogue.chatwoot_conversation_id == chatwoot_convo_id)
+                .values(dify_turns=Dialogue.dify_turns + 1, last_message_at=datetime.now(UTC))
+            )
+            db.commit()
+        except Exception as e:
+            logger.error(f"Failed to record Dify turn for chatwoot_convo_id={chatwoot_convo_id}: {e}")
+            db.rollback()
+
+
+def rotate_dialogue_sync(dialogue: Dialogue, reason: str) -> bool:
+    """Detach the dialogue from its Dify conversation and keep the old ID in its history (synchronous)"""
+    with SessionLocal() as db:
+        try:
+            rows = db.execute(
+                update(Dialogue)
+                .where(
+                    Dialogue.id == dialogue.id,
+                    Dialogue.dify_conversation_id == dialogue.dify_conversation_id,
+                )
+                .values(dify_conversation_id=None, dify_endpoint=None, dify_turns=0)
+            ).rowcount
+            if not rows:
+                # Rotated or recreated meanwhile, nothing to do
+                db.rollback()
+                return False
+            db.add(
+                DialogueRotation(
+                    chatwoot_conversation_id=dialogue.chatwoot_conversation_id,
+                    dify_conversation_id=dialogue.dify_conversation_id,
+                    reason=reason,
+                    turns=dialogue.dify_turns,
+                )
+            )
+            db.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to rotate dialogue {dialogue.id}: {e}", exc_info=True)
+            db.rollback()
+            return False
+
+
+def rotate_dify_conversation(dialogue: Dialogue, reason: str) -> Tuple[bool, Optional[str]]:
+    """Replace the dialogue's Dify conversation by a fresh one, created by the next Dify call.
+
+    Returns:
+        Whether the dialogue was rotated and a summary of the old conversation to seed the new one
+    """
+    old_dify_id = dialogue.dify_conversation_id
+    endpoint = get_endpoint(dialogue.dify_endpoint)
+    summary = None
+    if endpoint:  # an endpoint removed from the pool can't be asked anymore
+        with httpx.Client(timeout=HTTPX_TIMEOUT) as client:
+            summary = build_summary(client, endpoint, old_dify_id)
+    if not rotate_dialogue_sync(dialogue, reason):
+        return False, None
+    clear_rotation_request(dialogue.chatwoot_conversation_id)
+    dify_deletions.queue_deletions_sync([tag(dialogue.dify_endpoint, old_dify_id)])
+    metrics.incr(f"dify.rotations.{reason}")
+    logger.info(
+        f"Rotated Dify conversation {old_dify_id} of chatwoot_convo_id={dialogue.chatwoot_conversation_id} "
+        f"after {dialogue.dify_turns} turns (reason: {reason})"
+    )
+    return True, summary
+
+
+def hand_over_to_human(
+    chatwoot_conversation_id: str, conversation_status: Optional[str], task_id: Optional[str] = None
+):
+    """Open the conversation for the operators and tell the customer so"""
+    try:
+        chatwoot, conversation_id = chatwoot_for(chatwoot_conversation_id)
+        chatwoot.toggle_status_sync(
+            conversation_id=conversation_id,
+            status="open",
+            previous_status=conversation_status,
+            is_error_transition=True,
+        )
+        chatwoot.queue_message_sync(
+            conversation_id=conversation_id,
+            message=config.BOT_CONVERSATION_OPENED_MESSAGE_EXTERNAL,
+            private=False,
+            idempotency_key=f"{task_id}:handoff" if task_id else None,
+        )
+    except Exception as e:
+        logger.error(f"Failed to hand conversation {chatwoot_conversation_id} over to a human: {e}")
+
+
+@contextmanager
+def holding_message(chatwoot_conversation_id: Optional[str], received_at: Optional[float]) -> Iterator[None]:
+    """Send HOLDING_MESSAGE if the Dify call outlives its share of the time left until the deadline"""
+    if not (config.HOLDING_MESSAGE and config.MESSAGE_DEADLINE_SECONDS and received_at and chatwoot_conversation_id):
+        yield
+        return
+
+    def send_holding_message():
+        try:
+            chatwoot, conversation_id = chatwoot_for(chatwoot_conversation_id)
+            chatwoot.send_message_sync(conversation_id=conversation_id, message=config.HOLDING_MESSAGE)
+            metrics.incr("messages.holding_sent")
+        except Exception as e:
+            logger.warning(f"Failed to send holding message to conversation {chatwoot_conversation_id}: {e}")
+
+    remaining = received_at + config.MESSAGE_DEADLINE_SECONDS - time.time()
+    timer = threading.Timer(max(0.0, remaining * config.DIFY_CALL_DEADLINE_SHARE), send_holding_message)
+    timer.daemon = True
+    timer.start()
+    try:
+        yield
+    finally:
+        timer.cancel()
+
+
+@contextmanager
+def typing_indicator(chatwoot_conversation_id: Optional[str], dequeued_at: float) -> Iterator[None]:
+    """Show the customer an answer is being written while Dify generates it.
+
+    The indicator is sent from a background thread so the Dify request never waits on Chatwoot,
+    and re-sent every TYPING_KEEPALIVE_SECONDS. It is switched off by handle_dify_response or
+    handle_dify_error, once the outcome is posted, or by the outbox dispatcher posting the answer.
+    """
+    if not (config.TYPING_INDICATOR_ENABLED and chatwoot_conversation_id):
+        yield
+        return
+    stop = threading.Event()
+
+    def keep_typing():
+        try:
+            chatwoot, conversation_id = chatwoot_for(chatwoot_conversation_id)
+        except ValueError as e:
+            logger.debug(f"No typing indicator for conversation {chatwoot_conversation_id}: {e}")
+            return
+        first = True
+        while True:
+            try:
+                chatwoot.toggle_typing_sync(conversation_id, True)
+                if first:
+                    metrics.observe("typing.dequeue_to_signal_seconds", time.time() - dequeued_at)
+                    first = False
+            except Exception as e:
+                logger.debug(f"Failed to send typing indicator to conversation {chatwoot_conversation_id}: {e}")
+            if stop.wait(config.TYPING_KEEPALIVE_SECONDS):
+                return
+
+    threading.Thread(target=keep_typing, daemon=True).start()
+    try:
+        yield
+    finally:
+        stop.set()
+
+
+def stop_typing(conversation_id: int | str) -> None:
+    if not config.TYPING_INDICATOR_ENABLED:
+        return
+    try:
+        chatwoot, chatwoot_conversation_id = chatwoot_for(conversation_id)
+        chatwoot.toggle_typing_sync(chatwoot_conversation_id, False)
+    except Exception as e:
+        logger.debug(f"Failed to clear typing indicator of conversation {conversation_id}: {e}")
+
+
+def is_missing_dify_conversation(response: httpx.Response) -> bool:
+    """True for Dify's 404 'Conversation Not Exists.' (other 404s are not about the conversation)"""
+    if response.status_code != 404:
+        return False
+    try:
+        response.read()
+        return "conversation" in str(response.json().get("message", "")).lower()
+    except Exception:
+        return False
+
+
+def clear_dialogue_dify_id_sync(chatwoot_convo_id: str, stale_dify_id: str) -> bool:
+    """Drop a dify_conversation_id that Dify no longer knows, unless it was replaced already (synchronous)"""
+    with SessionLocal() as db:
+        try:
+            rows = db.execute(
+                update(Dialogue)
+                .where(
+                    Dialogue.chatwoot_conversation_id == chatwoot_convo_id,
+                    Dialogue.dify_conversation_id == stale_dify_id,
+                )
+                .values(dify_conversation_id=None, dify_endpoint=None, dify_turns=0)
+            ).rowcount
+            db.commit()
+            return bool(rows)
+        except Exception as e:
+            logger.error(f"Failed to clear stale dify_conversation_id for chatwoot_convo_id={chatwoot_convo_id}: {e}")
+            db.rollback()
+            return False
+
+
 # Helper function to update dialogue in DB (synchronous)
-def update_dialogue_dify_id_sync(chatwoot_convo_id: str, new_dify_id: str):
+def update_dialogue_dify_id_sync(chatwoot_convo_id: str, new_dify_id: str, endpoint_name: Optional[str] = None):
     logger.info(f"Attempting to update dify_conversation_id for chatwoot_convo_id={chatwoot_convo_id} to {new_dify_id}")
     with SessionLocal() as db:  # Use synchronous session
         try:
@@ -97,6 +424,7 @@ def update_dialogue_dify_id_sync(chatwoot_convo_id: str, new_dify_id: str):
             if dialogue:
                 if not dialogue.dify_conversation_id:  # Update only if it's not already set
                     dialogue.dify_conversation_id = new_dify_id
+                    dialogue.dify_endpoint = endpoint_name
                     db.commit()
                     logger.info(f"Successfully updated dify_conversation_id for chatwoot_convo_id={chatwoot_convo_id}")
                 else:
@@ -123,30 +451,125 @@ def process_message_with_dify(
     chatwoot_conversation_id: Optional[str] = None,
     conversation_status: Optional[str] = None,
     message_type: Optional[str] = None,  # `incoming` and `outgoing`
+    received_at: Optional[float] = None,  # webhook receipt time (unix seconds)
+    ticket: Optional[int] = None,  # position in the conversation's lane
+    lane_waits: int = 0,  # retries spent waiting for the lane, not counted against max_retries
 ) -> Dict[str, Any]:
     """
     Process a message with Dify and return the response as a dictionary.
     Handles initial conversation creation if dify_conversation_id is None.
     Retries on 404 if an existing dify_conversation_id is provided but not found.
+    With a ticket, waits for its turn so only one Dify call per conversation is in flight;
+    the lease is released by handle_dify_response/handle_dify_error.
     """
+    dequeued_at = time.time()
+    if chatwoot_conversation_id and ticket is not None:
+        if not acquire_turn(chatwoot_conversation_id, ticket, self.request.id):
+            logger.debug(f"Conversation {chatwoot_conversation_id} busy, ticket {ticket} waits for its turn")
+            raise self.retry(
+                kwargs={**self.request.kwargs, "lane_waits": lane_waits + 1},
+                countdown=config.CONVERSATION_LANE_RETRY_DELAY,
+                max_retries=None,
+            )
+
+    backlog.mark_started_sync(self.request.id)
+
+    # Delivered again after its worker stopped (task_acks_late): what the earlier run got is reused
+    checkpointed_context, checkpointed_result = task_checkpoints.load_sync(self.request.id)
+    if checkpointed_result is not None:
+        logger.info(f"Reusing the Dify answer an earlier run of task {self.request.id} checkpointed")
+        metrics.incr("tasks.resumed_from_checkpoint")
+        return checkpointed_result
+
     # Prevent bot from replying to its own error or status messages
     if message.startswith(BOT_CONVERSATION_OPENED_MESSAGE_EXTERNAL) or message.startswith(BOT_ERROR_MESSAGE_INTERNAL):
         logger.info(f"Skipping self-generated message: {message[:50]}...")
         return {"status": "skipped", "reason": "agent_bot message"}
-    url = f"{config.DIFY_API_URL}/chat-messages"
-    headers = {
-        "Authorization": f"Bearer {config.DIFY_API_KEY}",
-        "Content-Type": "application/json",
-    }
+    # A human took the conversation over after this message arrived
+    if chatwoot_conversation_id and is_cancelled(chatwoot_conversation_id, received_at):
+        logger.info(f"Skipping message for conversation {chatwoot_conversation_id}: taken over by a human")
+        return {"status": "skipped", "reason": "conversation taken over"}
+    # An answer this late helps nobody, don't pay for it
+    age = time.time() - received_at if received_at else 0.0
+    if config.MESSAGE_DEADLINE_SECONDS and age > config.MESSAGE_DEADLINE_SECONDS:
+        logger.warning(
+            f"Message for conversation {chatwoot_conversation_id} waited {age:.0f}s, "
+            f"past its {config.MESSAGE_DEADLINE_SECONDS}s deadline ({config.EXPIRED_MESSAGE_ACTION})"
+        )
+        metrics.incr(f"messages.expired.{config.EXPIRED_MESSAGE_ACTION}")
+        if config.EXPIRED_MESSAGE_ACTION == "handoff" and chatwoot_conversation_id:
+            hand_over_to_human(chatwoot_conversation_id, conversation_status, self.request.id)
+        return {"status": "skipped", "reason": "deadline exceeded"}
+    # A newer message of the conversation is queued already: it answers both in one Dify call
+    if config.SKIP_SUPERSEDED_MESSAGES and ticket is not None and is_superseded(chatwoot_conversation_id, ticket):
+        logger.info(f"Message for conversation {chatwoot_conversation_id} superseded, folding it into the next one")
+        metrics.incr("messages.superseded")
+        buffer_lines_sync(chatwoot_conversation_id, [*checkpointed_context, context_line(message_type, message)])
+        task_checkpoints.clear_context_sync(self.request.id)
+        return {"status": "skipped", "reason": "superseded by a newer message"}
+
+    # Messages buffered for this conversation since its last Dify call go along with this one
+    context = checkpointed_context + (
+        pop_buffered_messages_sync(chatwoot_conversation_id) if chatwoot_conversation_id else []
+    )
+
+    rotated = False
+    dialogue = get_dialogue_sync(chatwoot_conversation_id) if chatwoot_conversation_id else None
+    if dialogue:
+        # The stored ID wins: an earlier message may have created or rotated the Dify conversation meanwhile
+        dify_conversation_id = dialogue.dify_conversation_id
+        reason = rotation_reason(dialogue)
+        if reason:
+            rotated, summary = rotate_dify_conversation(dialogue, reason)
+            if rotated:
+                dify_conversation_id = None
+                if summary:
+                    context.insert(0, summary)
+
+    # A Dify conversation only exists on the endpoint that created it
+    endpoint = None
+    if dify_conversation_id:
+        endpoint = get_endpoint(dialogue.dify_endpoint if dialogue else None)
+        if endpoint is None:
+            logger.warning(
+                f"Dify endpoint {dialogue.dify_endpoint} of chatwoot_convo_id={chatwoot_conversation_id} "
+                "left the pool, starting a new Dify conversation"
+            )
+            clear_dialogue_dify_id_sync(chatwoot_conversation_id, dify_conversation_id)
+            dify_conversation_id = None
+    # Kept until the task is done, a run cut off by a stopping worker would take it out of the buffer for good
+    task_checkpoints.save_context_sync(self.request.id, context)
+
+    # The opener of a new conversation may be answered from cache, Dify is then called on the next message
+    first_turn_cacheable = bool(
+        config.ANSWER_CACHE_ENABLED
+        and chatwoot_conversation_id
+        and not dify_conversation_id
+        and not rotated
+        and not context
+        and message_type == "incoming"
+    )
+    if first_turn_cacheable:
+        cached_answer = get_first_turn_answer(chatwoot_conversation_id, message)
+        if cached_answer is not None:
+            logger.info(f"Answered first message of conversation {chatwoot_conversation_id} from cache")
+            return {"event": "message", "answer": cached_answer, "metadata": {"cached": True}}
+
+    endpoint = endpoint or pick_endpoint()
+    url = f"{endpoint.url}/chat-messages"
+    headers = endpoint.headers
 
     logger.info(
         f"Processing message with Dify for chatwoot_conversation_id={chatwoot_conversation_id}, "
-        f"dify_conversation_id={dify_conversation_id}, direction: {message_type}"
+        f"dify_conversation_id={dify_conversation_id}, endpoint: {endpoint.name}, direction: {message_type}"
     )
+    # Dify sees the conversation as Chatwoot knows it, with the account to address it in
+    account_id, chatwoot_id = split_key(chatwoot_conversation_id) if chatwoot_conversation_id else (None, None)
     data = {
-        "query": message,
+        "query": with_context(message, message_type, context),
         "inputs": {
-            "chatwoot_conversation_id": chatwoot_conversation_id,
+            "chatwoot_conversation_id": str(chatwoot_id) if chatwoot_id is not None else None,
+            "chatwoot_account_id": account_id,
             "conversation_status": conversation_status,
             "message_direction": message_type,
         },
@@ -162,15 +585,74 @@ def process_message_with_dify(
         logger.info("No dify_conversation_id provided. Attempting to create conversation via first message.")
         # Payload for creation doesn't include 'conversation_id' key
 
+    restored = False
+
+    def restore_context():
+        # The retried run, or the conversation's next message once this one failed, takes the context again
+        nonlocal restored
+        if restored or not context:
+            return
+        try:
+            buffer_lines_sync(chatwoot_conversation_id, context)
+        except Exception as e:
+            logger.warning(f"Failed to restore context of conversation {chatwoot_conversation_id}: {e}")
+            return
+        task_checkpoints.clear_context_sync(self.request.id)
+        restored = True
+
+    def send(client: httpx.Client) -> Dict[str, Any]:
+        if config.DIFY_RESPONSE_MODE == "streaming":
+            # Streaming exposes Dify's task_id early, so a takeover can stop the generation
+            return stream_dify_chat(
+                client,
+                url,
+                data,
+                headers,
+                on_task_id=lambda dify_task_id: register_generation(
+                    chatwoot_conversation_id, self.request.id, tag(endpoint.name, dify_task_id)
+                ),
+            )
+        response = client.post(url, json=data, headers=headers)
+        # Store response content before raising exception
+        if response.status_code >= 400:
+            error_content = response.text
+            logger.error(f"Dify API error response ({response.status_code}): {error_content}")
+        response.raise_for_status()  # Raise exception for 4xx/5xx
+        return response.json()
+
     try:
-        with httpx.Client(timeout=HTTPX_TIMEOUT) as client:
-            response = client.post(url, json=data, headers=headers)
-            # Store response content before raising exception
-            if response.status_code >= 400:
-                error_content = response.text
-                logger.error(f"Dify API error response ({response.status_code}): {error_content}")
-            response.raise_for_status()  # Raise exception for 4xx/5xx
-            result = response.json()
+        with (
+            httpx.Client(timeout=HTTPX_TIMEOUT) as client,
+            holding_message(chatwoot_conversation_id, received_at),
+            typing_indicator(chatwoot_conversation_id, dequeued_at),
+            in_flight(endpoint, self.request.id),
+            backlog.timed_service(),
+        ):
+            try:
+                result = send(client)
+            except httpx.HTTPStatusError as e:
+                if not (dify_conversation_id and chatwoot_conversation_id and is_missing_dify_conversation(e.response)):
+                    raise
+                # The conversation is gone on the Dify side (e.g. after a data reset), retrying the same ID
+                # can't help: drop it and send the message again right away as a conversation-creating call
+                metrics.incr("dify.missing_conversations")
+                logger.warning(
+                    f"Dify conversation {dify_conversation_id} of chatwoot_convo_id={chatwoot_conversation_id} "
+                    "no longer exists, recreating it"
+                )
+                clear_dialogue_dify_id_sync(chatwoot_conversation_id, dify_conversation_id)
+                dialogue = get_dialogue_sync(chatwoot_conversation_id)
+                # Someone else may have recreated it meanwhile, possibly on another endpoint
+                dify_conversation_id = dialogue.dify_conversation_id if dialogue else None
+                recreated_on = get_endpoint(dialogue.dify_endpoint) if dify_conversation_id else None
+                if recreated_on:
+                    data["conversation_id"] = dify_conversation_id
+                    endpoint = recreated_on
+                    url, headers = f"{endpoint.url}/chat-messages", endpoint.headers
+                else:
+                    dify_conversation_id = None
+                    data.pop("conversation_id", None)
+                result = send(client)
             logger.info(f"Dify API success for chatwoot_conversation_id={chatwoot_conversation_id}")
 
             # --- Handle Conversation Creation ---
@@ -180,11 +662,11 @@ def process_message_with_dify(
                 if new_dify_id:
                     logger.info(f"New Dify conversation created: {new_dify_id}. Updating database.")
                     # Update DB synchronously within the task
-                    update_dialogue_dify_id_sync(chatwoot_conversation_id, new_dify_id)
+                    update_dialogue_dify_id_sync(chatwoot_conversation_id, new_dify_id, endpoint.name)
                 else:
                     # --- MODIFIED: Error log and retry ---
                     error_msg = (
-                        f"Dify API call succeeded (status {response.status_code}) but didn't return a 'conversation_id'"
+                        "Dify API call succeeded but didn't return a 'conversation_id'"
                         f"when one was expected (initial creation for chatwoot_convo_id={chatwoot_conversation_id}). "
                         f"Dify response: {result}"
                     )
@@ -193,12 +675,15 @@ def process_message_with_dify(
                     try:
                         logger.warning(
                             f"Retrying task due to missing conversation_id on creation "
-                            f"(attempt {self.request.retries + 1}/{self.max_retries})..."
+                            f"(attempt {self.request.retries - lane_waits + 1}/{self.max_retries})..."
                         )
                         # Using default retry delay configured for the task
+                        restore_context()
                         self.retry(
                             exc=RuntimeError(error_msg),
                             countdown=config.CELERY_RETRY_COUNTDOWN,
+                            max_retries=self.max_retries + lane_waits,
+                            queue=config.CELERY_QUEUE_RETRY,
                         )
                     except self.MaxRetriesExceededError:
                         logger.error(
@@ -211,18 +696,41 @@ def process_message_with_dify(
                     # --- END MODIFICATION ---
             # --- End Handle Conversation Creation ---
 
-            return result  # Return successful result (contains first message answer)
+            if chatwoot_conversation_id:
+                record_dify_turn_sync(chatwoot_conversation_id)
+
+            # Answers carrying actions are specific to their conversation and are not reused
+            answer = result.get("answer") or ""
+            metadata = result.get("metadata") or {}
+            if first_turn_cacheable and not (
+                EMBEDDED_ACTIONS_PATTERN.search(answer) or config.DIFY_ACTIONS_TAG in metadata
+            ):
+                store_first_turn_answer(message, answer)
+            total_tokens = (metadata.get("usage") or {}).get("total_tokens")
+            if total_tokens:
+                metrics.incr("dify.tokens", int(total_tokens))
+
+            # A run delivered again after this one was cut off before acknowledging returns it as is
+            compact = compact_dify_result(result)
+            task_checkpoints.save_result_sync(self.request.id, compact)
+            return compact  # Return successful result (contains first message answer)
 
     except httpx.HTTPStatusError as e:
         # Specific retry logic for 404 ONLY when a conversation ID WAS provided
         if e.response.status_code == 404 and dify_conversation_id:
             logger.warning(
                 f"Dify 404 (Conversation Not Found) for *existing* dify_id={dify_conversation_id}. "
-                f"Retrying task (attempt {self.request.retries + 1}/{self.max_retries})..."
+                f"Retrying task (attempt {self.request.retries - lane_waits + 1}/{self.max_retries})..."
             )
             try:
-                # Use Celery's retry mechanism with countdown
-                self.retry(exc=e, countdown=config.CELERY_RETRY_COUNTDOWN)  # Use configured countdown
+                # Use Celery's retry mechanism with countdown, lane waits don't use up the budget
+                restore_context()
+                self.retry(
+                    exc=e,
+                    countdown=config.CELERY_RETRY_COUNTDOWN,
+                    max_retries=self.max_retries + lane_waits,
+                    queue=config.CELERY_QUEUE_RETRY,
+                )
             except self.MaxRetriesExceededError:
                 logger.error(
                     f"Max retries exceeded for Dify 404 on conversation {dify_conversation_id}. Failing task.",
@@ -254,16 +762,18 @@ def process_message_with_dify(
         # If it's an HTTP error, try to extract and log the response content again (might be redundant but safe)
         if isinstance(e, httpx.HTTPStatusError) and hasattr(e, "response"):
             logger.error(f"Final Response content on failure: {e.response.text}")
+        # Failing for good: the buffered lines go along with the conversation's next message
+        restore_context()
 
         # Set conversation status to open on error
         if chatwoot_conversation_id:
             try:
                 logger.info(f"Setting Chatwoot conversation {chatwoot_conversation_id} status to 'open' due to error")
-                chatwoot = ChatwootHandler()
+                chatwoot, chatwoot_id = chatwoot_for(chatwoot_conversation_id)
                 current_status_before_toggle = conversation_status
                 # Set status to open, indicating it's an error transition for internal note
                 chatwoot.toggle_status_sync(
-                    conversation_id=int(chatwoot_conversation_id),
+                    conversation_id=chatwoot_id,
                     status="open",
                     previous_status=current_status_before_toggle,
                     is_error_transition=True,  # Indicate this is an error-induced transition
@@ -272,10 +782,11 @@ def process_message_with_dify(
 
                 # Send public error message to the user
                 logger.info(f"Sending external error message to conversation {chatwoot_conversation_id}")
-                chatwoot.send_message_sync(
-                    conversation_id=int(chatwoot_conversation_id),
+                chatwoot.queue_message_sync(
+                    conversation_id=chatwoot_id,
                     message=config.BOT_CONVERSATION_OPENED_MESSAGE_EXTERNAL,
                     private=False,
+                    idempotency_key=f"{self.request.id}:error",
                 )
 
             except Exception as status_error:
@@ -293,17 +804,18 @@ def process_message_with_dify(
             f"chatwoot_conversation_id: {chatwoot_conversation_id}",
             exc_info=True,
         )
+        restore_context()
         # Set conversation status to open on error and send messages
         if chatwoot_conversation_id:
             try:
                 logger.info(
                     f"Setting Chatwoot conversation {chatwoot_conversation_id} status to 'open' due to non-HTTP error"
                 )
-                chatwoot = ChatwootHandler()
+                chatwoot, chatwoot_id = chatwoot_for(chatwoot_conversation_id)
                 current_status_before_toggle = conversation_status
                 # Set status to open, indicating it's an error transition for internal note
                 chatwoot.toggle_status_sync(
-                    conversation_id=int(chatwoot_conversation_id),
+                    conversation_id=chatwoot_id,
                     status="open",
                     previous_status=current_status_before_toggle,
                     is_error_transition=True,  # Indicate this is an error-induced transition
@@ -314,10 +826,11 @@ def process_message_with_dify(
 
                 # Send public error message to the user
                 logger.info(f"Sending external error message to conversation {chatwoot_conversation_id}")
-                chatwoot.send_message_sync(
-                    conversation_id=int(chatwoot_conversation_id),
+                chatwoot.queue_message_sync(
+                    conversation_id=chatwoot_id,
                     message=config.BOT_CONVERSATION_OPENED_MESSAGE_EXTERNAL,
                     private=False,
+                    idempotency_key=f"{self.request.id}:error",
                 )
             except Exception as status_error:
                 logger.error(
@@ -328,64 +841,366 @@ def process_message_with_dify(
         raise e from e
 
 
+async def apply_embedded_actions(conversation_id: int | str, actions: ConversationActions) -> Dict[str, Dict[str, Any]]:
+    """Apply actions from a Dify answer with one pooled Chatwoot client"""
+    chatwoot, chatwoot_id = chatwoot_for(conversation_id)
+    async with chatwoot:
+        return await execute_conversation_actions(chatwoot, chatwoot_id, actions)
+
+
 @celery.task(name="app.tasks.handle_dify_response")
-def handle_dify_response(dify_result: Dict[str, Any], conversation_id: int, dialogue_id: int):
-    """Handle the response from Dify"""
+def handle_dify_response(
+    dify_result: Dict[str, Any],
+    conversation_id: int | str,  # conversation key, see app/utils/accounts.py
+    dialogue_id: Optional[int] = None,  # unused, still sent by callbacks queued before it was dropped
+    task_id: Optional[str] = None,
+    received_at: Optional[float] = None,
+):
+    """Handle the response from Dify and hand the conversation lane to the next message"""
+    untrack_task(conversation_id, task_id)
+    answer_queued = False
+    try:
+        answer_queued = _deliver_dify_response(dify_result, conversation_id, received_at, task_id)
+    finally:
+        # An answer left to the outbox dispatcher is still being "written" until it's posted
+        if dify_result.get("status") != "skipped" and not answer_queued:
+            stop_typing(conversation_id)
+        release_turn(conversation_id, task_id)
 
-    chatwoot = ChatwootHandler()
+
+def _deliver_dify_response(
+    dify_result: Dict[str, Any], conversation_id: int | str, received_at: Optional[float], task_id: Optional[str]
+) -> bool:
+    """Post the answer and apply its actions, True if the outbox dispatcher posts the answer"""
+    if dify_result.get("status") == "skipped":
+        logger.info(f"Nothing to send for conversation {conversation_id}: {dify_result.get('reason')}")
+        return False
+    # The answer was generated but a human took over meanwhile, nobody should receive it
+    if is_cancelled(conversation_id, received_at):
+        logger.info(f"Dropping Dify answer for conversation {conversation_id}: taken over by a human")
+        return False
+
+    chatwoot, chatwoot_id = chatwoot_for(conversation_id)
 
     # No need to update dialogue here anymore, it's done in process_message_with_dify if needed.
     # We still need the DifyResponse model for validation/extraction.
     try:
         dify_response_data = DifyResponse(**dify_result)
+        # Actions embedded by Dify are applied here instead of via callbacks into our API
+        answer, actions = extract_embedded_actions(dify_response_data.answer, dify_result.get("metadata"))
 
-        # Send message back to Chatwoot. Sync is okay because we use separate instance of ChatwootHandler
-        if dify_response_data.answer.strip():
-            chatwoot.send_message_sync(
-                conversation_id=conversation_id,
-                message=dify_response_data.answer,
+        # The outbox dispatcher posts the answer, this worker doesn't wait for Chatwoot
+        answer_queued = False
+        if answer.strip():
+            chatwoot.queue_message_sync(
+                conversation_id=chatwoot_id,
+                message=answer,
                 private=False,
+                idempotency_key=f"{task_id}{ANSWER_KEY_SUFFIX}" if task_id else None,
             )
+            answer_queued = config.OUTBOX_ENABLED and task_id is not None
         else:
             logger.debug(
                 f"Dify response for conversation_id {conversation_id} had an empty or whitespace-only answer. "
                 "Skipping sending message to Chatwoot."
             )
+
+        if actions:
+            report = asyncio.run(apply_embedded_actions(conversation_id, actions))
+            log = logger.info if summarize_report(report) == "success" else logger.error
+            log(f"Applied embedded Dify actions for conversation {conversation_id}: {report}")
+        return answer_queued
     except Exception as e:
         logger.error(f"Error handling Dify response: {str(e)}", exc_info=True)
         # Re-raise to ensure Celery knows this task failed
         raise
 
 
+def record_dead_letter_sync(request: Context, exc: Exception, conversation_id: Optional[int | str]) -> None:
+    """Keep a failed task with its payload, see app/api/dead_letters.py for listing and replay"""
+    kwargs = dict(request.kwargs or {})
+    try:
+        with SessionLocal() as db:
+            db.add(
+                DeadLetter(
+                    task_id=request.id,
+                    task_name=request.task or "",
+                    chatwoot_conversation_id=str(conversation_id) if conversation_id is not None else None,
+                    payload={"args": list(request.args or []), "kwargs": kwargs},
+                    error_type=type(exc).__name__,
+                    error_message=str(exc)[: config.DEAD_LETTER_MAX_ERROR_LENGTH],
+                    # Retries spent waiting for the conversation lane are not attempts
+                    attempts=(request.retries or 0) - kwargs.get("lane_waits", 0) + 1,
+                )
+            )
+            db.commit()
+        metrics.incr(f"dead_letters.{type(exc).__name__}")
+    except Exception as e:
+        logger.error(f"Failed to record dead letter for task {request.id}: {e}", exc_info=True)
+
+
 @celery.task(name="app.tasks.handle_dify_error")
-def handle_dify_error(request: Dict[str, Any], exc: Exception, traceback: str, conversation_id: int):
+def handle_dify_error(
+    request: Context, exc: Exception, traceback: str, conversation_id: int | str, task_id: Optional[str] = None
+):
     """Handle any errors from the Dify task"""
-    # The import 'from .api.chatwoot import ChatwootHandler' and associated message sending logic
-    # have been removed as per new requirements. Only logging remains.
-
+    untrack_task(conversation_id, task_id)
+    stop_typing(conversation_id)
+    release_turn(conversation_id, task_id)
     logger.error(f"Dify task failed for conversation {conversation_id}: {exc} \n {request} \n {traceback}")
+    if config.DEAD_LETTERS_ENABLED:
+        record_dead_letter_sync(request, exc, conversation_id)
 
 
 @celery.task(name="app.tasks.delete_dify_conversation")
 def delete_dify_conversation(dify_conversation_id: str):
-    """Delete a conversation from Dify when it's deleted in Chatwoot"""
-    logger.info(f"Deleting Dify conversation: {dify_conversation_id}")
+    """Delete a conversation from Dify (the default endpoint, or the one tagged), through the batched deletion queue"""
+    dify_deletions.queue_deletions_sync([dify_conversation_id])
+    return {"status": "queued", "conversation_id": dify_conversation_id}
 
-    url = f"{config.DIFY_API_URL}/conversations/{dify_conversation_id}"
-    headers = {
-        "Authorization": f"Bearer {config.DIFY_API_KEY}",
-        "Content-Type": "application/json",
-    }
 
-    try:
-        with httpx.Client(timeout=HTTPX_TIMEOUT) as client:
-            response = client.delete(url, headers=headers)
-            response.raise_for_status()
-            logger.info(f"Successfully deleted Dify conversation: {dify_conversation_id}")
-            return {"status": "success", "conversation_id": dify_conversation_id}
-    except Exception as e:
-        logger.error(
-            f"Failed to delete Dify conversation {dify_conversation_id}: {e}",
-            exc_info=True,
+async def _delete_dify_conversations(dify_conversation_ids: List[str]) -> Tuple[List[str], List[str]]:
+    """Delete conversations in Dify, DIFY_DELETION_CONCURRENCY at a time, started at DIFY_DELETION_RATE per second.
+
+    Args:
+        dify_conversation_ids: IDs tagged with their endpoint (see dify_endpoints.tag)
+
+    Returns:
+        The IDs deleted (or already gone) and the IDs that failed
+    """
+    semaphore = asyncio.Semaphore(config.DIFY_DELETION_CONCURRENCY)
+
+    async def delete_one(client: httpx.AsyncClient, index: int, tagged_id: str) -> bool:
+        endpoint, dify_conversation_id = untag(tagged_id)
+        if endpoint is None:
+            logger.warning(f"Not deleting Dify conversation {tagged_id}: its endpoint left the pool")
+            return True
+        await asyncio.sleep(index / config.DIFY_DELETION_RATE)
+        async with semaphore:
+            try:
+                response = await client.request(
+                    "DELETE",
+                    f"{endpoint.url}/conversations/{dify_conversation_id}",
+                    json={"user": "user"},
+                    headers=endpoint.headers,
+                )
+                if response.status_code != 404:  # already gone is as good as deleted
+                    response.raise_for_status()
+                return True
+            except Exception as e:
+                logger.warning(f"Failed to delete Dify conversation {tagged_id}: {e}")
+                return False
+
+    async with httpx.AsyncClient(timeout=HTTPX_TIMEOUT) as client:
+        results = await asyncio.gather(
+            *(delete_one(client, index, dify_id) for index, dify_id in enumerate(dify_conversation_ids))
         )
-        raise e from e
+    deleted = [dify_id for dify_id, ok in zip(dify_conversation_ids, results, strict=True) if ok]
+    failed = [dify_id for dify_id, ok in zip(dify_conversation_ids, results, strict=True) if not ok]
+    return deleted, failed
+
+
+@celery.task(name="app.tasks.process_dify_deletions")
+def process_dify_deletions():
+    """Delete the queued Dify conversations in batches (see app/utils/dify_deletions.py)"""
+    if not dify_deletions.acquire_lock_sync(config.task_time_limit):
+        return {"status": "skipped", "reason": "already running"}
+    deleted = dropped = 0
+    try:
+        while deleted + dropped < config.DIFY_DELETION_MAX_PER_RUN:
+            batch = dify_deletions.take_batch_sync(
+                min(config.DIFY_DELETION_BATCH_SIZE, config.DIFY_DELETION_MAX_PER_RUN - deleted - dropped)
+            )
+            if not batch:
+                break
+            batch_deleted, batch_failed = asyncio.run(_delete_dify_conversations(batch))
+            batch_dropped = dify_deletions.finish_sync(batch_deleted, batch_failed)
+            if batch_dropped:
+                logger.error(
+                    f"Giving up on deleting {len(batch_dropped)} Dify conversations after "
+                    f"{config.DIFY_DELETION_MAX_ATTEMPTS} attempts: {batch_dropped}"
+                )
+            deleted += len(batch_deleted)
+            dropped += len(batch_dropped)
+            metrics.incr("dify.deletions.deleted", len(batch_deleted))
+            metrics.incr("dify.deletions.failed", len(batch_failed))
+            if batch_failed:
+                break  # Dify is struggling, the rest waits for the next run
+    finally:
+        dify_deletions.release_lock_sync()
+    if deleted or dropped:
+        logger.info(f"Deleted {deleted} Dify conversations, {dify_deletions.pending_count_sync()} still queued")
+    return {"status": "success", "deleted": deleted, "dropped": dropped}
+
+
+def list_dify_conversations(client: httpx.Client, endpoint: DifyEndpoint) -> List[Dict[str, Any]]:
+    """All conversations of the Dify app behind the endpoint, page by page"""
+    url = f"{endpoint.url}/conversations"
+    params: Dict[str, Any] = {"user": "user", "limit": 100}
+    conversations: List[Dict[str, Any]] = []
+    while True:
+        response = client.get(url, params=params, headers=endpoint.headers)
+        response.raise_for_status()
+        page = response.json()
+        conversations.extend(page.get("data", []))
+        if not page.get("has_more") or not page.get("data"):
+            return conversations
+        params["last_id"] = conversations[-1]["id"]
+
+
+def list_pool_conversations(client: httpx.Client) -> Dict[str, List[Dict[str, Any]]]:
+    """The conversations of each endpoint by endpoint name; endpoints failing to list them are left out"""
+    listed = {}
+    for endpoint in ENDPOINTS.values():
+        try:
+            listed[endpoint.name] = list_dify_conversations(client, endpoint)
+        except Exception as e:
+            logger.warning(f"Failed to list conversations of Dify endpoint {endpoint.name}, skipping it: {e}")
+    return listed
+
+
+@celery.task(name="app.tasks.sweep_stale_dify_conversations")
+def sweep_stale_dify_conversations():
+    """Clear dify_conversation_ids Dify no longer knows, e.g. after a Dify data reset.
+
+    All conversations of the Dify app are listed page by page and compared with the dialogues
+    in one pass, instead of each dialogue finding out through a failed message later. Dialogues
+    touched since the sweep started are left alone, their conversation may be newer than the listing.
+    """
+    started_at = datetime.now(UTC)
+    with httpx.Client(timeout=HTTPX_TIMEOUT) as client:
+        listed = list_pool_conversations(client)
+    known = {tag(name, conversation["id"]) for name, conversations in listed.items() for conversation in conversations}
+
+    with SessionLocal() as db:
+        rows = db.execute(
+            select(Dialogue.id, Dialogue.dify_endpoint, Dialogue.dify_conversation_id).where(
+                Dialogue.dify_conversation_id.is_not(None), Dialogue.updated_at < started_at
+            )
+        ).all()
+        # Only conversations of endpoints that were listed can be judged
+        checked = [
+            (dialogue_id, tag(name, dify_id))
+            for dialogue_id, name, dify_id in rows
+            if (name or DEFAULT_ENDPOINT.name) in listed
+        ]
+        stale = [dialogue_id for dialogue_id, tagged_id in checked if tagged_id not in known]
+        cleared = 0
+        for start in range(0, len(stale), 1000):
+            cleared += db.execute(
+                update(Dialogue)
+                .where(Dialogue.id.in_(stale[start : start + 1000]), Dialogue.updated_at < started_at)
+                .values(dify_conversation_id=None, dify_endpoint=None, dify_turns=0)
+            ).rowcount
+        db.commit()
+
+    metrics.incr("dify.swept_conversations", cleared)
+    logger.info(f"Dify conversation sweep: {len(known)} known, {len(checked)} checked, {cleared} stale IDs cleared")
+    return {"status": "success", "known": len(known), "checked": len(checked), "cleared": cleared}
+
+
+async def _missing_chatwoot_conversations(conversation_ids: List[str]) -> List[str]:
+    """The conversations (by conversation key) Chatwoot answers 404 for"""
+    semaphore = asyncio.Semaphore(config.BULK_CONCURRENCY)
+
+    async def is_missing(chatwoot_accounts: ChatwootRegistry, key: str) -> bool:
+        chatwoot, conversation_id = chatwoot_accounts.for_key(key)
+        if chatwoot is None:  # the account is not served anymore, nothing to compare with
+            return False
+        async with semaphore:
+            try:
+                await chatwoot.get_conversation_data(conversation_id)
+            except httpx.HTTPStatusError as e:
+                return e.response.status_code == 404
+            except Exception:
+                return False
+            return False
+
+    async with ChatwootRegistry() as chatwoot_accounts:
+        missing = await asyncio.gather(*(is_missing(chatwoot_accounts, key) for key in conversation_ids))
+    return [conversation_id for conversation_id, gone in zip(conversation_ids, missing, strict=True) if gone]
+
+
+@celery.task(name="app.tasks.sweep_orphaned_dify_conversations")
+def sweep_orphaned_dify_conversations():
+    """Queue for deletion the Dify conversations left behind by lost Chatwoot events.
+
+    Dify conversations no dialogue refers to are deleted once older than DIFY_ORPHAN_GRACE_SECONDS,
+    which keeps conversations being created right now safe. Dialogues idle for DIFY_ORPHAN_IDLE_DAYS
+    are checked against Chatwoot, DIFY_ORPHAN_CHECK_LIMIT per run, continuing where the last run
+    stopped; those whose Chatwoot conversation is gone are removed along with their Dify conversation.
+    """
+    cutoff = time.time() - config.DIFY_ORPHAN_GRACE_SECONDS
+    with httpx.Client(timeout=HTTPX_TIMEOUT) as client:
+        listed = list_pool_conversations(client)
+    with SessionLocal() as db:
+        referenced = {
+            tag(name, dify_id)
+            for name, dify_id in db.execute(
+                select(Dialogue.dify_endpoint, Dialogue.dify_conversation_id).where(
+                    Dialogue.dify_conversation_id.is_not(None)
+                )
+            )
+        }
+        dialogues = db.execute(select(func.count()).select_from(Dialogue)).scalar()
+
+    unreferenced = [
+        tag(name, conversation["id"])
+        for name, conversations in listed.items()
+        for conversation in conversations
+        if tag(name, conversation["id"]) not in referenced
+        and (conversation.get("updated_at") or conversation.get("created_at") or cutoff) < cutoff
+    ]
+    if unreferenced and not dialogues:
+        # An empty table rather means a fresh or reset database than that every conversation is orphaned
+        logger.warning(f"No dialogues stored, not deleting {len(unreferenced)} unreferenced Dify conversations")
+        unreferenced = []
+
+    cursor = dify_deletions.orphan_cursor_sync()
+    idle_before = datetime.now(UTC) - timedelta(days=config.DIFY_ORPHAN_IDLE_DAYS)
+    with SessionLocal() as db:
+        candidates = db.execute(
+            select(Dialogue.id, Dialogue.chatwoot_conversation_id)
+            .where(Dialogue.id > cursor, Dialogue.updated_at < idle_before)
+            .order_by(Dialogue.id)
+            .limit(config.DIFY_ORPHAN_CHECK_LIMIT)
+        ).all()
+    dify_deletions.set_orphan_cursor_sync(candidates[-1][0] if len(candidates) == config.DIFY_ORPHAN_CHECK_LIMIT else 0)
+    gone = asyncio.run(_missing_chatwoot_conversations(list({cid for _, cid in candidates})))
+    abandoned: List[str] = []
+    if gone:
+        with SessionLocal() as db:
+            abandoned = [
+                tag(name, dify_id)
+                for name, dify_id in db.execute(
+                    select(Dialogue.dify_endpoint, Dialogue.dify_conversation_id).where(
+                        Dialogue.chatwoot_conversation_id.in_(gone), Dialogue.dify_conversation_id.is_not(None)
+                    )
+                )
+            ]
+            db.execute(delete(Dialogue).where(Dialogue.chatwoot_conversation_id.in_(gone)))
+            db.commit()
+
+    dify_deletions.queue_deletions_sync([*unreferenced, *abandoned])
+    if unreferenced or abandoned:
+        process_dify_deletions.delay()
+    metrics.incr("dify.orphans.unreferenced", len(unreferenced))
+    metrics.incr("dify.orphans.abandoned", len(abandoned))
+    logger.info(
+        f"Orphan sweep: {len(unreferenced)} unreferenced Dify conversations, {len(gone)} of {len(candidates)} "
+        f"idle dialogues gone from Chatwoot, {len(abandoned)} of their Dify conversations queued for deletion"
+    )
+    return {"status": "success", "unreferenced": len(unreferenced), "checked": len(candidates), "gone": len(gone)}
+
+
+@celery.task(name="app.tasks.check_dify_endpoints")
+def check_dify_endpoints():
+    """Probe each Dify endpoint of the pool; failing ones get no new conversations until they recover"""
+    with httpx.Client(timeout=HTTPX_TIMEOUT) as client:
+        health = {endpoint.name: check_endpoint(client, endpoint) for endpoint in ENDPOINTS.values()}
+    for name, healthy in health.items():
+        metrics.incr(f"dify.endpoints.{name}.{'up' if healthy else 'down'}")
+    down = [name for name, healthy in health.items() if not healthy]
+    if down:
+        logger.warning(f"Dify endpoints down: {', '.join(down)}")
+    return {"status": "success", "endpoints": health}
@@ -0,0 +1,51 @@
+from typing import Dict, List, Optional, Tuple
+
+from sqlmodel import SQLModel
+
+from app import config
+
+# Chatwoot accounts served by one deployment, from CHATWOOT_ACCOUNTS. Conversation IDs are only
+# unique within an account, so what is kept per conversation (dialogues, dead letters, Redis
+# bookkeeping, task arguments) is keyed by a conversation key: the bare ID for the first account,
+# which is what was stored before there were several, "<account_id>/<conversation_id>" for the others.
+
+
+class ChatwootAccount(SQLModel):
+    account_id: str
+    api_key: str
+    admin_api_key: Optional[str] = None  # defaults to api_key
+    api_url: Optional[str] = None  # defaults to CHATWOOT_API_URL
+
+
+def _load(entries: List[dict]) -> Dict[str, ChatwootAccount]:
+    accounts = {}
+    for entry in entries:
+        account = ChatwootAccount.model_validate({**entry, "account_id": str(entry.get("account_id", ""))})
+        if not account.account_id or "/" in account.account_id or account.account_id in accounts:
+            raise ValueError(f"Invalid Chatwoot account '{account.account_id}': IDs must be unique, without '/'")
+        accounts[account.account_id] = account
+    return accounts
+
+
+ACCOUNTS = _load(config.CHATWOOT_ACCOUNTS)
+DEFAULT_ACCOUNT_ID = next(iter(ACCOUNTS))
+
+
+def get_account(account_id: Optional[int | str]) -> Optional[ChatwootAccount]:
+    """A configured account, the first one for no ID; None if it isn't served here"""
+    if account_id is None or account_id == "":
+        return ACCOUNTS[DEFAULT_ACCOUNT_ID]
+    return ACCOUNTS.get(str(account_id))
+
+
+def conversation_key(account_id: Optional[int | str], conversation_id: int | str) -> str:
+    """The conversation's ID qualified with its account, for storage and bookkeeping shared by all accounts"""
+    if account_id is None or str(account_id) in ("", DEFAULT_ACCOUNT_ID):
+        return str(conversation_id)
+    return f"{account_id}/{conversation_id}"
+
+
+def split_key(key: int | str) -> Tuple[str, int]:
+    """Account and Chatwoot conversation ID of a conversation key"""
+    account_id, separator, conversation_id = str(key).rpartition("/")
+    return (account_id if separator else DEFAULT_ACCOUNT_ID), int(conversation_id)
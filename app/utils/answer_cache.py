@@ -0,0 +1,85 @@
+import hashlib
+import logging
+import re
+import time
+from typing import Optional
+
+from app import config
+from app.redis_client import redis_client
+from app.utils import metrics
+from app.utils.conversation_context import buffer_messages_sync
+from app.utils.dify_endpoints import pool_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Answers to the first message of a conversation, keyed on the normalized query and the Dify app.
+# On a hit no Dify conversation is created: the cached exchange is buffered as context (see
+# app/utils/conversation_context.py) and the conversation is created by the next message.
+# Entries expire after ANSWER_CACHE_TTL_SECONDS; past ANSWER_CACHE_MAX_ENTRIES the oldest are evicted.
+
+CACHE_PREFIX = "chatdify:answer_cache"
+INDEX_KEY = f"{CACHE_PREFIX}:index"
+
+# Everything but letters and digits is noise for matching openers ("Hi!!" == "hi")
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(_NON_WORD.sub(" ", query.lower()).split())
+
+
+def _cache_key(query: str) -> Optional[str]:
+    normalized = normalize_query(query)
+    if not normalized or len(normalized) > config.ANSWER_CACHE_MAX_QUERY_LENGTH:
+        return None
+    # Answers differ between Dify apps, so the app (endpoint URLs and keys) is part of the key
+    app = pool_fingerprint()
+    digest = hashlib.sha256(normalized.encode()).hexdigest()
+    return f"{CACHE_PREFIX}:{app}:{digest}"
+
+
+def _marker_key(conversation_id: int | str) -> str:
+    return f"chatdify:conversation:{conversation_id}:cached_turn"
+
+
+def get_first_turn_answer(conversation_id: int | str, query: str) -> Optional[str]:
+    """Cached answer for the first message of a conversation, or None"""
+    key = _cache_key(query)
+    if key is None:
+        return None
+    try:
+        # Only the very first message can be answered from cache, later ones need the Dify conversation
+        if redis_client.exists(_marker_key(conversation_id)):
+            return None
+        answer = redis_client.get(key)
+        if answer is None:
+            metrics.incr("answer_cache.misses")
+            return None
+        redis_client.set(_marker_key(conversation_id), 1, ex=config.CONTEXT_BUFFER_TTL_SECONDS)
+        buffer_messages_sync(conversation_id, [("incoming", query.strip()), ("assistant", answer)])
+    except Exception as e:
+        logger.warning(f"Answer cache lookup failed for conversation {conversation_id}: {e}")
+        return None
+    metrics.incr("answer_cache.hits")
+    return answer
+
+
+def store_first_turn_answer(query: str, answer: str) -> None:
+    """Cache the answer Dify gave to a conversation's first message"""
+    key = _cache_key(query)
+    if key is None or not answer.strip():
+        return
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.set(key, answer, ex=config.ANSWER_CACHE_TTL_SECONDS)
+            pipe.zadd(INDEX_KEY, {key: time.time()})
+            pipe.zcard(INDEX_KEY)
+            *_, size = pipe.execute()
+        overflow = size - config.ANSWER_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            evicted = [member for member, _ in redis_client.zpopmin(INDEX_KEY, overflow)]
+            redis_client.delete(*evicted)
+            metrics.incr("answer_cache.evictions", len(evicted))
+        metrics.incr("answer_cache.stores")
+    except Exception as e:
+        logger.warning(f"Failed to cache first-turn answer: {e}")
@@ -0,0 +1,272 @@
+import logging
+import math
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlmodel import SQLModel
+
+from app import config
+from app.redis_client import async_broker_client, async_redis_client, redis_client
+from app.utils.dify_endpoints import in_flight_counts
+
+logger = logging.getLogger(__name__)
+
+# How far behind the Dify workers are, for admission control in the webhook. Queue depth is read
+# from the broker's lists (one per priority step of a queue). Messages are also kept in a sorted set
+# by receipt time from when the webhook queues them until a worker takes them up, which gives the
+# age of the oldest one still waiting, including those held back by a countdown or a busy lane.
+# Arrivals, webhooks and Dify service times are counted in per-minute buckets, from which
+# autoscaling_signals() derives the worker and API replica counts an external autoscaler should run.
+
+WAITING_KEY = "chatdify:backlog:waiting"
+WINDOW_PREFIX = "chatdify:backlog:window"
+
+
+class Backlog(SQLModel):
+    depth: int = 0  # messages in the live queue
+    waiting: int = 0  # messages queued and not yet taken up by a worker
+    oldest_wait_seconds: float = 0.0
+    level: str = "normal"  # normal, busy (past a soft threshold) or shed (past a hard one)
+
+
+def broker_lists(queue: str) -> List[str]:
+    """The broker's Redis lists of a queue, one per priority step (the lowest step uses the bare name)"""
+    options = config.CELERY_BROKER_TRANSPORT_OPTIONS
+    sep = options.get("sep", "\x06\x16")
+    return [f"{queue}{sep}{step}" if step else queue for step in options.get("priority_steps", [0, 3, 6, 9])]
+
+
+async def queue_depths(queues: Iterable[str]) -> Dict[str, int]:
+    """Messages waiting in each broker queue"""
+    queues = list(queues)
+    async with async_broker_client.pipeline(transaction=False) as pipe:
+        for queue in queues:
+            for name in broker_lists(queue):
+                pipe.llen(name)
+        lengths = await pipe.execute()
+    steps = len(broker_lists(""))
+    return {queue: sum(lengths[index * steps : (index + 1) * steps]) for index, queue in enumerate(queues)}
+
+
+class AutoscalingSignals(SQLModel):
+    queues: Dict[str, int]  # broker queue depths
+    waiting: int
+    oldest_wait_seconds: float
+    in_flight: Dict[str, int]  # Dify requests running per endpoint
+    in_flight_total: int
+    arrival_rate: float  # messages queued for Dify per second
+    dify_call_rate: float  # Dify calls finished per second
+    webhook_rate: float  # webhooks received per second
+    mean_service_seconds: float
+    target_latency_seconds: float
+    desired_worker_slots: int
+    desired_workers: int
+    desired_api_replicas: int
+
+
+def _bucket_key(now: float) -> str:
+    return f"{WINDOW_PREFIX}:{int(now // 60)}"
+
+
+def _bucket_ttl() -> int:
+    return config.AUTOSCALE_WINDOW_SECONDS + 120
+
+
+async def count_webhook() -> None:
+    """A webhook arrived (API side), best-effort"""
+    try:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            pipe.hincrby(_bucket_key(time.time()), "webhooks", 1)
+            pipe.expire(_bucket_key(time.time()), _bucket_ttl())
+            await pipe.execute()
+    except Exception as e:
+        logger.debug(f"Failed to count webhook: {e}")
+
+
+async def mark_waiting(task_id: str, received_at: float) -> None:
+    """A message was queued for Dify (API side), best-effort: a message left out is still admitted"""
+    key = _bucket_key(time.time())
+    try:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            pipe.zadd(WAITING_KEY, {task_id: received_at})
+            pipe.hincrby(key, "arrivals", 1)
+            pipe.expire(key, _bucket_ttl())
+            await pipe.execute()
+    except Exception as e:
+        logger.debug(f"Failed to mark task {task_id} waiting: {e}")
+
+
+def mark_started_sync(task_id: Optional[str]) -> None:
+    """A worker took the message up (worker side)"""
+    if not task_id:
+        return
+    try:
+        redis_client.zrem(WAITING_KEY, task_id)
+    except Exception as e:
+        logger.debug(f"Failed to mark task {task_id} started: {e}")
+
+
+@contextmanager
+def timed_service() -> Iterator[None]:
+    """Record how long a worker spends on a Dify call, failed or not (worker side)"""
+    started_at = time.time()
+    try:
+        yield
+    finally:
+        key = _bucket_key(started_at)
+        try:
+            with redis_client.pipeline(transaction=False) as pipe:
+                pipe.hincrbyfloat(key, "service_seconds", time.time() - started_at)
+                pipe.hincrby(key, "services", 1)
+                pipe.expire(key, _bucket_ttl())
+                pipe.execute()
+        except Exception as e:
+            logger.debug(f"Failed to record service time: {e}")
+
+
+async def forget(task_ids: List[str]) -> None:
+    """Revoked messages are not waiting anymore (API side)"""
+    if task_ids:
+        await async_redis_client.zrem(WAITING_KEY, *task_ids)
+
+
+async def waiting() -> Tuple[int, float]:
+    """Number of messages waiting for a worker and the age of the oldest one"""
+    now = time.time()
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        # Entries of tasks lost without ever starting (e.g. purged queues) age out with the task bookkeeping
+        pipe.zremrangebyscore(WAITING_KEY, "-inf", now - config.CONVERSATION_TASKS_TTL_SECONDS)
+        pipe.zcard(WAITING_KEY)
+        pipe.zrange(WAITING_KEY, 0, 0, withscores=True)
+        _, count, oldest = await pipe.execute()
+    # Replays are queued with a receipt time in the future, they are not late yet
+    return count, max(0.0, now - oldest[0][1]) if oldest else 0.0
+
+
+def _level(backlog: Backlog) -> str:
+    def past(value: float, threshold: float) -> bool:
+        return bool(threshold) and value >= threshold
+
+    if past(backlog.depth, config.ADMISSION_HARD_QUEUE_DEPTH) or past(
+        backlog.oldest_wait_seconds, config.ADMISSION_HARD_WAIT_SECONDS
+    ):
+        return "shed"
+    if past(backlog.depth, config.ADMISSION_SOFT_QUEUE_DEPTH) or past(
+        backlog.oldest_wait_seconds, config.ADMISSION_SOFT_WAIT_SECONDS
+    ):
+        return "busy"
+    return "normal"
+
+
+def admission_enabled() -> bool:
+    return any(
+        (
+            config.ADMISSION_SOFT_QUEUE_DEPTH,
+            config.ADMISSION_SOFT_WAIT_SECONDS,
+            config.ADMISSION_HARD_QUEUE_DEPTH,
+            config.ADMISSION_HARD_WAIT_SECONDS,
+        )
+    )
+
+
+_sample: Optional[Backlog] = None
+_sampled_at = 0.0
+
+
+async def admission() -> Backlog:
+    """The current backlog and its admission level, read at most every ADMISSION_SAMPLE_SECONDS"""
+    global _sample, _sampled_at
+    if not admission_enabled():
+        return Backlog()
+    if _sample is not None and time.monotonic() - _sampled_at < config.ADMISSION_SAMPLE_SECONDS:
+        return _sample
+    try:
+        depth = (await queue_depths([config.CELERY_QUEUE_LIVE]))[config.CELERY_QUEUE_LIVE]
+        count, oldest_wait = await waiting()
+    except Exception as e:
+        # Without a reading, admit: shedding on a Redis hiccup would hand everything to humans
+        logger.warning(f"Failed to read the backlog, admitting: {e}")
+        return Backlog()
+    backlog = Backlog(depth=depth, waiting=count, oldest_wait_seconds=oldest_wait)
+    backlog.level = _level(backlog)
+    _sample, _sampled_at = backlog, time.monotonic()
+    return backlog
+
+
+async def claim_notice(conversation_id: int | str) -> bool:
+    """True if the conversation wasn't told about the wait within ADMISSION_NOTICE_COOLDOWN_SECONDS"""
+    key = f"chatdify:conversation:{conversation_id}:busy_notice"
+    return bool(await async_redis_client.set(key, 1, nx=True, ex=config.ADMISSION_NOTICE_COOLDOWN_SECONDS))
+
+
+def busy_message(backlog: Backlog) -> str:
+    """ADMISSION_BUSY_MESSAGE filled in: the new message queues behind the others and waits about as long"""
+    return config.ADMISSION_BUSY_MESSAGE.format(
+        position=max(backlog.depth, backlog.waiting) + 1,
+        wait_minutes=max(1, round(backlog.oldest_wait_seconds / 60)),
+    )
+
+
+async def _window() -> Tuple[Dict[str, float], float]:
+    """Counts of the last AUTOSCALE_WINDOW_SECONDS summed over the minute buckets, and the seconds they cover"""
+    now = time.time()
+    minutes = max(1, math.ceil(config.AUTOSCALE_WINDOW_SECONDS / 60))
+    first = int(now // 60) - minutes + 1
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        for minute in range(first, first + minutes):
+            pipe.hgetall(f"{WINDOW_PREFIX}:{minute}")
+        buckets = await pipe.execute()
+    totals: Dict[str, float] = {}
+    for bucket in buckets:
+        for field, value in bucket.items():
+            totals[field] = totals.get(field, 0.0) + float(value)
+    return totals, now - first * 60
+
+
+async def autoscaling_signals() -> AutoscalingSignals:
+    """Load of the Dify workers and the API, with the replica counts that keep waits within the target latency.
+
+    Busy worker slots follow Little's law, arrival rate x service time; on top, the messages already
+    waiting have to be worked off within the target latency.
+    """
+    queues = await queue_depths(
+        [
+            config.CELERY_QUEUE_LIVE,
+            config.CELERY_QUEUE_AGENT,
+            config.CELERY_QUEUE_RETRY,
+            config.CELERY_QUEUE_MAINTENANCE,
+        ]
+    )
+    count, oldest_wait = await waiting()
+    in_flight = await in_flight_counts()
+    totals, seconds = await _window()
+
+    services = totals.get("services", 0.0)
+    service_seconds = (
+        totals.get("service_seconds", 0.0) / services if services else config.AUTOSCALE_DEFAULT_SERVICE_SECONDS
+    )
+    arrival_rate = totals.get("arrivals", 0.0) / seconds
+    webhook_rate = totals.get("webhooks", 0.0) / seconds
+    slots = math.ceil(
+        arrival_rate * service_seconds + count * service_seconds / max(config.AUTOSCALE_TARGET_LATENCY_SECONDS, 1.0)
+    )
+    workers = math.ceil(slots / max(config.worker_concurrency, 1))
+    api_replicas = math.ceil(webhook_rate / config.AUTOSCALE_API_REPLICA_RPS)
+    return AutoscalingSignals(
+        queues=queues,
+        waiting=count,
+        oldest_wait_seconds=round(oldest_wait, 3),
+        in_flight=in_flight,
+        in_flight_total=sum(in_flight.values()),
+        arrival_rate=round(arrival_rate, 4),
+        dify_call_rate=round(services / seconds, 4),
+        webhook_rate=round(webhook_rate, 4),
+        mean_service_seconds=round(service_seconds, 3),
+        target_latency_seconds=config.AUTOSCALE_TARGET_LATENCY_SECONDS,
+        desired_worker_slots=slots,
+        desired_workers=min(max(workers, config.AUTOSCALE_MIN_WORKERS), config.AUTOSCALE_MAX_WORKERS),
+        desired_api_replicas=min(
+            max(api_replicas, config.AUTOSCALE_MIN_API_REPLICAS), config.AUTOSCALE_MAX_API_REPLICAS
+        ),
+    )
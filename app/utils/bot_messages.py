@@ -0,0 +1,81 @@
+import logging
+from typing import Any, Dict, Optional
+
+from app import config
+from app.redis_client import async_redis_client, redis_client
+
+logger = logging.getLogger(__name__)
+
+# Ids of the messages the bot posted are kept per conversation for BOT_ECHO_TTL_SECONDS, so the
+# webhook recognizes their echoes no matter which sender Chatwoot attributes them to.
+# Bot turns are also counted per conversation in a fixed BOT_LOOP_WINDOW_SECONDS window; only a
+# human agent resets the count, because the "contact" on the other side may be a bot as well.
+# Both are best-effort: if Redis is unavailable, messages are treated as not echoed and no loop trips.
+
+
+def _key(conversation_id: int | str, suffix: str) -> str:
+    return f"chatdify:conversation:{conversation_id}:{suffix}"
+
+
+def _sent_message_commands(pipe, conversation_id: int | str, message: Dict[str, Any], private: bool) -> None:
+    pipe.sadd(_key(conversation_id, "sent"), message["id"])
+    pipe.expire(_key(conversation_id, "sent"), config.BOT_ECHO_TTL_SECONDS)
+    # Private notes are bookkeeping, not a turn in the conversation
+    if not private and config.BOT_LOOP_MAX_TURNS > 0:
+        pipe.incr(_key(conversation_id, "bot_turns"))
+        pipe.expire(_key(conversation_id, "bot_turns"), config.BOT_LOOP_WINDOW_SECONDS, nx=True)
+
+
+def record_sent_message(conversation_id: int | str, message: Dict[str, Any], private: bool = False) -> None:
+    """Remember a message the bot posted (sync, Celery side)"""
+    if not message.get("id"):
+        return
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            _sent_message_commands(pipe, conversation_id, message, private)
+            pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to record sent message for conversation {conversation_id}: {e}")
+
+
+async def arecord_sent_message(conversation_id: int | str, message: Dict[str, Any], private: bool = False) -> None:
+    """Remember a message the bot posted (async, API side)"""
+    if not message.get("id"):
+        return
+    try:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            _sent_message_commands(pipe, conversation_id, message, private)
+            await pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to record sent message for conversation {conversation_id}: {e}")
+
+
+async def is_bot_echo(conversation_id: int | str, message_id: Optional[int]) -> bool:
+    """True if the webhook message is one the bot posted itself"""
+    if not message_id:
+        return False
+    try:
+        return bool(await async_redis_client.sismember(_key(conversation_id, "sent"), message_id))
+    except Exception as e:
+        logger.warning(f"Failed to check echo of message {message_id} in conversation {conversation_id}: {e}")
+        return False
+
+
+async def is_bot_loop(conversation_id: int | str) -> bool:
+    """True if the bot took BOT_LOOP_MAX_TURNS turns in the current window without a human agent"""
+    if config.BOT_LOOP_MAX_TURNS <= 0:
+        return False
+    try:
+        turns = await async_redis_client.get(_key(conversation_id, "bot_turns"))
+    except Exception as e:
+        logger.warning(f"Failed to read bot turns of conversation {conversation_id}: {e}")
+        return False
+    return turns is not None and int(turns) >= config.BOT_LOOP_MAX_TURNS
+
+
+async def reset_bot_turns(conversation_id: int | str) -> None:
+    """A human agent spoke, the bot is not talking to itself"""
+    try:
+        await async_redis_client.delete(_key(conversation_id, "bot_turns"))
+    except Exception as e:
+        logger.warning(f"Failed to reset bot turns of conversation {conversation_id}: {e}")
@@ -0,0 +1,70 @@
+import logging
+from typing import List, Tuple
+
+from app import config
+from app.redis_client import async_redis_client, redis_client
+
+logger = logging.getLogger(__name__)
+
+# Messages that don't get a Dify call of their own are buffered per conversation and prepended to
+# the next Dify call of that conversation: messages of a direction in "context" mode (see
+# MESSAGE_DIRECTION_MODES), a first turn answered from cache, messages superseded by a newer one.
+# The worker takes the buffer right before calling Dify, in conversation lane order.
+
+SPEAKERS = {"incoming": "Customer", "outgoing": "Agent", "assistant": "Assistant"}
+
+
+def _key(conversation_id: int | str) -> str:
+    return f"chatdify:conversation:{conversation_id}:context"
+
+
+def context_line(message_type: str, content: str) -> str:
+    return f"{SPEAKERS.get(message_type, message_type)}: {content}"
+
+
+async def buffer_message(conversation_id: int | str, message_type: str, content: str) -> None:
+    """Keep a message to send along with the next dispatched one"""
+    if not content:
+        return
+    line = context_line(message_type, content)
+    async with async_redis_client.pipeline(transaction=True) as pipe:
+        pipe.rpush(_key(conversation_id), line)
+        pipe.ltrim(_key(conversation_id), -config.CONTEXT_BUFFER_MAX_MESSAGES, -1)
+        pipe.expire(_key(conversation_id), config.CONTEXT_BUFFER_TTL_SECONDS)
+        await pipe.execute()
+
+
+def buffer_lines_sync(conversation_id: int | str, lines: List[str]) -> None:
+    """Keep context lines for the next Dify call (worker side)"""
+    if not lines:
+        return
+    with redis_client.pipeline(transaction=True) as pipe:
+        pipe.rpush(_key(conversation_id), *lines)
+        pipe.ltrim(_key(conversation_id), -config.CONTEXT_BUFFER_MAX_MESSAGES, -1)
+        pipe.expire(_key(conversation_id), config.CONTEXT_BUFFER_TTL_SECONDS)
+        pipe.execute()
+
+
+def buffer_messages_sync(conversation_id: int | str, messages: List[Tuple[str, str]]) -> None:
+    """Keep (message_type, content) pairs for the next Dify call (worker side)"""
+    buffer_lines_sync(conversation_id, [context_line(message_type, content) for message_type, content in messages])
+
+
+def pop_buffered_messages_sync(conversation_id: int | str) -> List[str]:
+    """Take the buffered lines, oldest first. Best-effort: on Redis errors nothing is prepended."""
+    try:
+        with redis_client.pipeline(transaction=True) as pipe:
+            pipe.lrange(_key(conversation_id), 0, -1)
+            pipe.delete(_key(conversation_id))
+            lines, _ = pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to read buffered context of conversation {conversation_id}: {e}")
+        return []
+    return lines
+
+
+def with_context(message: str, message_type: str, buffered: List[str]) -> str:
+    """Prepend buffered messages to the query sent to Dify"""
+    if not buffered:
+        return message
+    return "\n".join([*buffered, "", context_line(message_type, message)])
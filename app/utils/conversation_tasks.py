@@ -0,0 +1,202 @@
+import logging
+import time
+from typing import List, Optional, Tuple
+
+from app import config
+from app.redis_client import async_redis_client, redis_client
+
+logger = logging.getLogger(__name__)
+
+# Redis bookkeeping of the Dify work queued or running for each Chatwoot conversation.
+# The API registers every dispatched task and, when a human takes the conversation over,
+# collects the tasks to revoke and the Dify generations to stop. Workers compare the
+# cancellation timestamp with the message receipt time to drop work dispatched before it.
+
+
+def _key(conversation_id: int | str, suffix: str) -> str:
+    return f"chatdify:conversation:{conversation_id}:{suffix}"
+
+
+async def track_task(conversation_id: int | str, task_id: str) -> None:
+    """Remember a dispatched Celery task for the conversation (API side)"""
+    try:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            pipe.sadd(_key(conversation_id, "tasks"), task_id)
+            pipe.expire(_key(conversation_id, "tasks"), config.CONVERSATION_TASKS_TTL_SECONDS)
+            await pipe.execute()
+    except Exception as e:
+        # The task still runs, a takeover just can't revoke it before it starts (workers check the cancellation)
+        logger.warning(f"Failed to track task {task_id} for conversation {conversation_id}: {e}")
+
+
+def untrack_task(conversation_id: int | str, task_id: Optional[str]) -> None:
+    """Forget a task once its answer was posted or it failed (worker side)"""
+    if not task_id:
+        return
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.srem(_key(conversation_id, "tasks"), task_id)
+            pipe.hdel(_key(conversation_id, "generations"), task_id)
+            pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to untrack task {task_id} for conversation {conversation_id}: {e}")
+
+
+def register_generation(conversation_id: int | str, task_id: Optional[str], dify_task_id: str) -> None:
+    """Record the Dify task_id of a running generation so it can be stopped (worker side)"""
+    if not task_id:
+        return
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(_key(conversation_id, "generations"), task_id, dify_task_id)
+            pipe.expire(_key(conversation_id, "generations"), config.CONVERSATION_TASKS_TTL_SECONDS)
+            pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to register Dify task {dify_task_id} for conversation {conversation_id}: {e}")
+
+
+# Every ticket handed out so far belongs to a message received before the takeover, so none of them
+# is answered anymore: the lane moves past them, or the next message would wait for revoked tickets
+# until the stall timeout. A ticket still holding the lease keeps it until its task releases it.
+_SKIP_ISSUED_TICKETS = async_redis_client.register_script(
+    """
+    local issued = tonumber(redis.call('GET', KEYS[1]) or '0')
+    if issued > tonumber(redis.call('GET', KEYS[2]) or '0') then
+        redis.call('SET', KEYS[2], issued, 'EX', ARGV[2])
+        redis.call('SET', KEYS[3], ARGV[1], 'EX', ARGV[2])
+    end
+    return issued
+    """
+)
+
+
+async def cancel_conversation_tasks(conversation_id: int | str) -> Tuple[List[str], List[str]]:
+    """Mark the conversation's pending work as cancelled (API side).
+
+    Returns:
+        Celery task IDs to revoke and Dify task IDs of generations to stop
+    """
+    now = time.time()
+    async with async_redis_client.pipeline(transaction=True) as pipe:
+        pipe.set(_key(conversation_id, "cancelled_at"), now, ex=config.CONVERSATION_TASKS_TTL_SECONDS)
+        pipe.smembers(_key(conversation_id, "tasks"))
+        pipe.hvals(_key(conversation_id, "generations"))
+        pipe.delete(_key(conversation_id, "tasks"), _key(conversation_id, "generations"))
+        _, task_ids, dify_task_ids, _ = await pipe.execute()
+    await _SKIP_ISSUED_TICKETS(
+        keys=[_key(conversation_id, "ticket"), _key(conversation_id, "served"), _key(conversation_id, "served_at")],
+        args=[now, config.CONVERSATION_TASKS_TTL_SECONDS],
+    )
+    return list(task_ids), list(dify_task_ids)
+
+
+def is_cancelled(conversation_id: int | str, received_at: Optional[float]) -> bool:
+    """True if a takeover happened after the message was received (worker side)"""
+    if received_at is None:
+        return False
+    try:
+        cancelled_at = redis_client.get(_key(conversation_id, "cancelled_at"))
+    except Exception as e:
+        logger.warning(f"Failed to read cancellation state for conversation {conversation_id}: {e}")
+        return False
+    return cancelled_at is not None and float(cancelled_at) >= received_at
+
+
+# Per-conversation lanes: each message gets a ticket at ingestion and only the holder of the
+# conversation lease talks to Dify. The lease is taken in ticket order and released once the
+# answer is posted, so answers cannot overtake each other. If the next ticket never shows up
+# (revoked or lost task), waiting tickets may jump the queue after CONVERSATION_LANE_STALL_SECONDS.
+_ACQUIRE_TURN = redis_client.register_script(
+    """
+    local holder = redis.call('GET', KEYS[1])
+    if holder == ARGV[2] then
+        redis.call('PEXPIRE', KEYS[1], ARGV[3])
+        return 1
+    end
+    if holder then
+        return 0
+    end
+    local ticket = tonumber(ARGV[1])
+    local served = tonumber(redis.call('GET', KEYS[2]) or '0')
+    local now = tonumber(ARGV[4])
+    local served_at = tonumber(redis.call('GET', KEYS[3]))
+    if not served_at then
+        -- Nothing served yet: the stall clock starts with the first waiting ticket
+        served_at = now
+        redis.call('SET', KEYS[3], now, 'EX', ARGV[6])
+    end
+    if ticket > served + 1 and now - served_at < tonumber(ARGV[5]) then
+        return 0
+    end
+    redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+    if ticket > served then
+        redis.call('SET', KEYS[2], ticket, 'EX', ARGV[6])
+    end
+    redis.call('SET', KEYS[3], now, 'EX', ARGV[6])
+    return 1
+    """
+)
+
+_RELEASE_TURN = redis_client.register_script(
+    """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        redis.call('DEL', KEYS[1])
+        redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+        return 1
+    end
+    return 0
+    """
+)
+
+
+async def next_ticket(conversation_id: int | str) -> int:
+    """Hand out the conversation's next ticket, in webhook arrival order (API side)"""
+    async with async_redis_client.pipeline(transaction=True) as pipe:
+        pipe.incr(_key(conversation_id, "ticket"))
+        pipe.expire(_key(conversation_id, "ticket"), config.CONVERSATION_TASKS_TTL_SECONDS)
+        ticket, _ = await pipe.execute()
+    return ticket
+
+
+def is_superseded(conversation_id: int | str, ticket: int) -> bool:
+    """True if a newer message of the conversation was dispatched after this ticket (worker side)"""
+    try:
+        latest = redis_client.get(_key(conversation_id, "ticket"))
+    except Exception as e:
+        logger.warning(f"Failed to read latest ticket of conversation {conversation_id}: {e}")
+        return False
+    return latest is not None and int(latest) > ticket
+
+
+def acquire_turn(conversation_id: int | str, ticket: int, task_id: str) -> bool:
+    """Take the conversation lease if it is this ticket's turn (worker side)"""
+    try:
+        acquired = _ACQUIRE_TURN(
+            keys=[_key(conversation_id, "lease"), _key(conversation_id, "served"), _key(conversation_id, "served_at")],
+            args=[
+                ticket,
+                task_id,
+                config.CONVERSATION_LEASE_SECONDS * 1000,
+                time.time(),
+                config.CONVERSATION_LANE_STALL_SECONDS,
+                config.CONVERSATION_TASKS_TTL_SECONDS,
+            ],
+        )
+    except Exception as e:
+        # Answering out of order beats not answering at all
+        logger.warning(f"Failed to take lease of conversation {conversation_id}, proceeding without it: {e}")
+        return True
+    return bool(acquired)
+
+
+def release_turn(conversation_id: int | str, task_id: Optional[str]) -> None:
+    """Give the lease to the next ticket, if this task holds it (worker side)"""
+    if not task_id:
+        return
+    try:
+        _RELEASE_TURN(
+            keys=[_key(conversation_id, "lease"), _key(conversation_id, "served_at")],
+            args=[task_id, time.time(), config.CONVERSATION_TASKS_TTL_SECONDS],
+        )
+    except Exception as e:
+        logger.warning(f"Failed to release lease of conversation {conversation_id} held by {task_id}: {e}")
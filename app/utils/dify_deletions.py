@@ -0,0 +1,78 @@
+import logging
+from typing import Iterable, List
+
+from app import config
+from app.redis_client import async_redis_client, redis_client
+
+logger = logging.getLogger(__name__)
+
+# Dify conversations to delete (Chatwoot conversation deleted, Dify conversation rotated or orphaned)
+# are collected in a Redis set and deleted in batches by tasks.process_dify_deletions, at most
+# DIFY_DELETION_CONCURRENCY at a time and DIFY_DELETION_RATE per second. A set, so an ID queued
+# twice is deleted once; failed deletions go back with their attempt count. Members are tagged with
+# the endpoint the conversation lives on (dify_endpoints.tag).
+
+PENDING_KEY = "chatdify:dify_deletions"
+ATTEMPTS_KEY = "chatdify:dify_deletions:attempts"
+LOCK_KEY = "chatdify:dify_deletions:lock"
+ORPHAN_CURSOR_KEY = "chatdify:dify_deletions:orphan_cursor"
+
+
+async def queue_deletions(dify_conversation_ids: Iterable[str]) -> None:
+    """Queue Dify conversations for deletion (API side)"""
+    ids = [dify_id for dify_id in dify_conversation_ids if dify_id]
+    if ids:
+        await async_redis_client.sadd(PENDING_KEY, *ids)
+
+
+def queue_deletions_sync(dify_conversation_ids: Iterable[str]) -> None:
+    """Queue Dify conversations for deletion (worker side)"""
+    ids = [dify_id for dify_id in dify_conversation_ids if dify_id]
+    if ids:
+        redis_client.sadd(PENDING_KEY, *ids)
+
+
+def take_batch_sync(size: int) -> List[str]:
+    return redis_client.spop(PENDING_KEY, size) or []
+
+
+def finish_sync(deleted: List[str], failed: List[str]) -> List[str]:
+    """Record a batch's outcome: failed IDs are queued again until DIFY_DELETION_MAX_ATTEMPTS, returns those dropped"""
+    dropped = []
+    with redis_client.pipeline(transaction=False) as pipe:
+        for dify_id in failed:
+            pipe.hincrby(ATTEMPTS_KEY, dify_id, 1)
+        attempts = pipe.execute()
+    with redis_client.pipeline(transaction=False) as pipe:
+        for dify_id, attempt in zip(failed, attempts, strict=True):
+            if attempt >= config.DIFY_DELETION_MAX_ATTEMPTS:
+                dropped.append(dify_id)
+                pipe.hdel(ATTEMPTS_KEY, dify_id)
+            else:
+                pipe.sadd(PENDING_KEY, dify_id)
+        if deleted:
+            pipe.hdel(ATTEMPTS_KEY, *deleted)
+        pipe.execute()
+    return dropped
+
+
+def pending_count_sync() -> int:
+    return redis_client.scard(PENDING_KEY)
+
+
+def acquire_lock_sync(ttl_seconds: int) -> bool:
+    """One deletion run at a time, so overlapping runs can't exceed the rate limit"""
+    return bool(redis_client.set(LOCK_KEY, 1, nx=True, ex=ttl_seconds))
+
+
+def release_lock_sync() -> None:
+    redis_client.delete(LOCK_KEY)
+
+
+def orphan_cursor_sync() -> int:
+    """Last dialogue ID checked by the orphan sweep, 0 to start over"""
+    return int(redis_client.get(ORPHAN_CURSOR_KEY) or 0)
+
+
+def set_orphan_cursor_sync(dialogue_id: int) -> None:
+    redis_client.set(ORPHAN_CURSOR_KEY, dialogue_id)
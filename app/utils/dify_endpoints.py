@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import random
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import httpx
+from sqlmodel import SQLModel
+
+from app import config
+from app.redis_client import async_redis_client, redis_client
+
+logger = logging.getLogger(__name__)
+
+# Pool of Dify endpoints (API URL and key) from DIFY_ENDPOINTS. A Dify conversation only exists on
+# the endpoint that created it, so a dialogue sticks to the endpoint stored with its
+# dify_conversation_id (Dialogue.dify_endpoint). New conversations go to the healthy endpoint with
+# the fewest requests in flight per unit of weight; the in-flight requests of all workers are
+# counted in Redis. tasks.check_dify_endpoints probes the endpoints and marks failing ones down.
+
+PREFIX = "chatdify:dify_endpoints"
+
+
+class DifyEndpoint(SQLModel):
+    name: str
+    url: str
+    key: str
+    weight: float = 1.0
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.key}", "Content-Type": "application/json"}
+
+
+def _load(entries: List[dict]) -> Dict[str, DifyEndpoint]:
+    endpoints = {}
+    for entry in entries:
+        endpoint = DifyEndpoint.model_validate(entry)
+        if "/" in endpoint.name or endpoint.name in endpoints or endpoint.weight <= 0:
+            raise ValueError(f"Invalid Dify endpoint '{endpoint.name}': names must be unique without '/', weights > 0")
+        endpoints[endpoint.name] = endpoint
+    return endpoints
+
+
+ENDPOINTS = _load(config.DIFY_ENDPOINTS)
+# Dialogues stored before the pool existed live on the first endpoint
+DEFAULT_ENDPOINT = next(iter(ENDPOINTS.values()))
+
+
+def get_endpoint(name: Optional[str]) -> Optional[DifyEndpoint]:
+    """The endpoint a stored conversation lives on, None if it was removed from the pool"""
+    if not name:
+        return DEFAULT_ENDPOINT
+    return ENDPOINTS.get(name)
+
+
+def tag(endpoint_name: Optional[str], value: str) -> str:
+    """An ID qualified with its endpoint, for queues and bookkeeping shared by all endpoints"""
+    return f"{endpoint_name or DEFAULT_ENDPOINT.name}/{value}"
+
+
+def untag(tagged: str) -> Tuple[Optional[DifyEndpoint], str]:
+    """Endpoint and ID of a tagged value; untagged values (from before the pool) are on the default endpoint"""
+    name, separator, value = tagged.partition("/")
+    if not separator:
+        return DEFAULT_ENDPOINT, tagged
+    return ENDPOINTS.get(name), value
+
+
+def pool_fingerprint() -> str:
+    """Identifies the Dify app(s) behind the pool, e.g. to key cached answers"""
+    identity = "|".join(f"{endpoint.url}|{endpoint.key}" for endpoint in ENDPOINTS.values())
+    return hashlib.sha256(identity.encode()).hexdigest()[:16]
+
+
+def _down_key(endpoint: DifyEndpoint) -> str:
+    return f"{PREFIX}:{endpoint.name}:down"
+
+
+def _in_flight_key(endpoint: DifyEndpoint) -> str:
+    return f"{PREFIX}:{endpoint.name}:in_flight"
+
+
+def pick_endpoint() -> DifyEndpoint:
+    """Endpoint for a new conversation: healthy, with the fewest requests in flight per unit of weight"""
+    endpoints = list(ENDPOINTS.values())
+    if len(endpoints) == 1:
+        return endpoints[0]
+    # Requests older than a task's hard time limit belong to crashed workers and don't count
+    horizon = time.time() - config.task_time_limit
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            for endpoint in endpoints:
+                pipe.exists(_down_key(endpoint))
+                pipe.zcount(_in_flight_key(endpoint), horizon, "+inf")
+            replies = pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to read Dify endpoint load, picking by weight: {e}")
+        return random.choices(endpoints, weights=[endpoint.weight for endpoint in endpoints])[0]
+
+    load = {endpoint.name: replies[2 * index + 1] for index, endpoint in enumerate(endpoints)}
+    healthy = [endpoint for index, endpoint in enumerate(endpoints) if not replies[2 * index]]
+    candidates = healthy or endpoints  # all down: better try one than fail outright
+    best = min((load[endpoint.name] + 1) / endpoint.weight for endpoint in candidates)
+    return random.choice([endpoint for endpoint in candidates if (load[endpoint.name] + 1) / endpoint.weight == best])
+
+
+@contextmanager
+def in_flight(endpoint: DifyEndpoint, request_id: str) -> Iterator[None]:
+    """Count a request against the endpoint's load while it runs"""
+    try:
+        redis_client.zadd(_in_flight_key(endpoint), {request_id: time.time()})
+    except Exception as e:
+        logger.debug(f"Failed to count request on Dify endpoint {endpoint.name}: {e}")
+    try:
+        yield
+    finally:
+        try:
+            redis_client.zrem(_in_flight_key(endpoint), request_id)
+        except Exception as e:
+            logger.debug(f"Failed to uncount request on Dify endpoint {endpoint.name}: {e}")
+
+
+async def in_flight_counts() -> Dict[str, int]:
+    """Requests in flight on each endpoint (API side)"""
+    horizon = time.time() - config.task_time_limit
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        for endpoint in ENDPOINTS.values():
+            pipe.zcount(_in_flight_key(endpoint), horizon, "+inf")
+        counts = await pipe.execute()
+    return dict(zip(ENDPOINTS, counts, strict=True))
+
+
+def check_endpoint(client: httpx.Client, endpoint: DifyEndpoint) -> bool:
+    """Probe the endpoint with a cheap authenticated call and record the outcome"""
+    try:
+        response = client.get(f"{endpoint.url}/parameters", params={"user": "user"}, headers=endpoint.headers)
+        healthy = response.status_code < 500 and response.status_code not in (401, 403)
+    except Exception as e:
+        logger.warning(f"Dify endpoint {endpoint.name} health check failed: {e}")
+        healthy = False
+    horizon = time.time() - config.task_time_limit
+    with redis_client.pipeline(transaction=False) as pipe:
+        if healthy:
+            pipe.delete(_down_key(endpoint))
+        else:
+            # Expires on its own should the checks stop running
+            pipe.set(_down_key(endpoint), 1, ex=3 * config.DIFY_HEALTH_CHECK_INTERVAL_SECONDS)
+        pipe.zremrangebyscore(_in_flight_key(endpoint), "-inf", horizon)
+        pipe.execute()
+    return healthy
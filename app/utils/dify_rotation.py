@@ -0,0 +1,97 @@
+import logging
+from datetime import UTC, datetime
+from typing import Optional
+
+import httpx
+
+from app import config
+from app.models.database import Dialogue
+from app.redis_client import async_redis_client, redis_client
+from app.utils.dify_endpoints import DifyEndpoint
+
+logger = logging.getLogger(__name__)
+
+# Dify keeps the whole history of a conversation in the prompt, so long-lived Chatwoot conversations
+# get slower and costlier with every turn, and the `inputs` Dify cached at creation go stale. A
+# conversation is rotated, i.e. the next message starts a fresh Dify conversation seeded with a short
+# transcript of the old one, after DIFY_ROTATE_AFTER_TURNS turns, after DIFY_ROTATE_AFTER_IDLE_SECONDS
+# without messages, or once the Chatwoot conversation reached one of DIFY_ROTATE_ON_STATUSES.
+
+
+def _status_key(conversation_id: int | str) -> str:
+    return f"chatdify:conversation:{conversation_id}:rotate"
+
+
+async def request_rotation(conversation_id: int | str, dify_conversation_id: str) -> None:
+    """Rotate this Dify conversation on the next message (API side, on status changes)"""
+    await async_redis_client.set(
+        _status_key(conversation_id), dify_conversation_id, ex=config.CONVERSATION_TASKS_TTL_SECONDS
+    )
+
+
+def rotation_reason(dialogue: Dialogue) -> Optional[str]:
+    """Why the dialogue's Dify conversation should be replaced before the next turn, if it should"""
+    if not dialogue.dify_conversation_id:
+        return None
+    if config.DIFY_ROTATE_AFTER_TURNS and dialogue.dify_turns >= config.DIFY_ROTATE_AFTER_TURNS:
+        return "turns"
+    if config.DIFY_ROTATE_AFTER_IDLE_SECONDS and dialogue.last_message_at:
+        last_message_at = dialogue.last_message_at
+        if last_message_at.tzinfo is None:  # drivers without timezone support
+            last_message_at = last_message_at.replace(tzinfo=UTC)
+        idle = (datetime.now(UTC) - last_message_at).total_seconds()
+        if idle >= config.DIFY_ROTATE_AFTER_IDLE_SECONDS:
+            return "inactivity"
+    try:
+        requested = redis_client.get(_status_key(dialogue.chatwoot_conversation_id))
+    except Exception as e:
+        logger.warning(f"Failed to read rotation request of conversation {dialogue.chatwoot_conversation_id}: {e}")
+        return None
+    # Only the conversation that was current at the status change, not the one replacing it
+    if requested == dialogue.dify_conversation_id:
+        return "status"
+    return None
+
+
+def clear_rotation_request(conversation_id: int | str) -> None:
+    try:
+        redis_client.delete(_status_key(conversation_id))
+    except Exception as e:
+        logger.warning(f"Failed to clear rotation request of conversation {conversation_id}: {e}")
+
+
+def build_summary(client: httpx.Client, endpoint: DifyEndpoint, dify_conversation_id: str) -> Optional[str]:
+    """Compact transcript of the last DIFY_ROTATION_SUMMARY_TURNS turns, to seed the new conversation"""
+    if config.DIFY_ROTATION_SUMMARY_TURNS <= 0:
+        return None
+    try:
+        response = client.get(
+            f"{endpoint.url}/messages",
+            params={
+                "user": "user",
+                "conversation_id": dify_conversation_id,
+                "limit": config.DIFY_ROTATION_SUMMARY_TURNS,
+            },
+            headers=endpoint.headers,
+        )
+        response.raise_for_status()
+        messages = response.json().get("data", [])
+    except Exception as e:
+        logger.warning(f"Failed to fetch history of Dify conversation {dify_conversation_id}: {e}")
+        return None
+
+    limit = config.DIFY_ROTATION_SUMMARY_MESSAGE_CHARS
+
+    def clip(text: Optional[str]) -> str:
+        text = " ".join((text or "").split())
+        return text if len(text) <= limit else text[: limit - 1] + "…"
+
+    lines = []
+    for message in messages:
+        if message.get("query"):
+            lines.append(f"Customer: {clip(message['query'])}")
+        if message.get("answer"):
+            lines.append(f"Assistant: {clip(message['answer'])}")
+    if not lines:
+        return None
+    return "\n".join(["Earlier in this conversation:", *lines])
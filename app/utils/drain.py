@@ -0,0 +1,61 @@
+import asyncio
+import logging
+import signal
+import threading
+import time
+from typing import Optional
+
+from app import config
+
+logger = logging.getLogger(__name__)
+
+# Graceful drain of an API replica for rolling restarts. Draining starts on SIGTERM, or ahead of it
+# from a preStop hook (POST /api/v1/health/drain): new webhooks are refused with a retryable 503 and
+# the health check fails, so the load balancer and Chatwoot's retries move to other replicas. The
+# server itself stops DRAIN_GRACE_SECONDS after the signal; it finishes the requests in progress,
+# then the lifespan shutdown flushes the coalesced Chatwoot writes and closes the clients.
+
+_draining_since: Optional[float] = None
+
+
+def start(reason: str) -> None:
+    global _draining_since
+    if _draining_since is None:
+        _draining_since = time.time()
+        logger.info(f"Draining ({reason}): refusing new webhooks")
+
+
+def is_draining() -> bool:
+    return _draining_since is not None
+
+
+def draining_seconds() -> float:
+    return time.time() - _draining_since if _draining_since is not None else 0.0
+
+
+def install_signal_handler() -> None:
+    """Drain on SIGTERM, handing the signal on to the server's own handler DRAIN_GRACE_SECONDS later.
+
+    To be called once the server has installed its handlers (lifespan startup). A SIGTERM while
+    already draining, e.g. after a preStop hook, is handed on right away.
+    """
+    if not config.DRAIN_GRACE_SECONDS or threading.current_thread() is not threading.main_thread():
+        return
+    loop = asyncio.get_running_loop()
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def hand_on(signum: int) -> None:
+        signal.signal(signal.SIGTERM, previous)
+        if callable(previous):
+            previous(signum, None)
+        else:
+            signal.raise_signal(signum)
+
+    def handle(signum, _frame) -> None:
+        if is_draining():
+            hand_on(signum)
+            return
+        start("SIGTERM")
+        loop.call_soon_threadsafe(loop.call_later, config.DRAIN_GRACE_SECONDS, hand_on, signum)
+
+    signal.signal(signal.SIGTERM, handle)
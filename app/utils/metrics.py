@@ -0,0 +1,74 @@
+import logging
+from typing import Dict
+
+from app.redis_client import async_redis_client, redis_client
+
+logger = logging.getLogger(__name__)
+
+# All counters live in one Redis hash so API and worker processes report into the same place.
+# The a* variants use the async client, for code running on the API's (or outbox's) event loop.
+METRICS_KEY = "chatdify:metrics"
+
+
+def incr(name: str, amount: int = 1) -> None:
+    """Increment a counter. Metrics are best-effort and never raise."""
+    try:
+        redis_client.hincrby(METRICS_KEY, name, amount)
+    except Exception as e:
+        logger.debug(f"Failed to record metric {name}: {e}")
+
+
+def observe(name: str, value: float) -> None:
+    """Record one observation of a timing/size, kept as <name>.sum and <name>.count"""
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hincrbyfloat(METRICS_KEY, f"{name}.sum", value)
+            pipe.hincrby(METRICS_KEY, f"{name}.count", 1)
+            pipe.execute()
+    except Exception as e:
+        logger.debug(f"Failed to record metric {name}: {e}")
+
+
+def gauge(name: str, value: float) -> None:
+    """Set a metric to its current value, e.g. a scaling signal"""
+    try:
+        redis_client.hset(METRICS_KEY, name, value)
+    except Exception as e:
+        logger.debug(f"Failed to record metric {name}: {e}")
+
+
+def snapshot() -> Dict[str, float]:
+    """Return all recorded metrics"""
+    return {name: float(value) for name, value in redis_client.hgetall(METRICS_KEY).items()}
+
+
+async def aincr(name: str, amount: int = 1) -> None:
+    """Increment a counter (async). Metrics are best-effort and never raise."""
+    try:
+        await async_redis_client.hincrby(METRICS_KEY, name, amount)
+    except Exception as e:
+        logger.debug(f"Failed to record metric {name}: {e}")
+
+
+async def aobserve(name: str, value: float) -> None:
+    """Record one observation of a timing/size (async)"""
+    try:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            pipe.hincrbyfloat(METRICS_KEY, f"{name}.sum", value)
+            pipe.hincrby(METRICS_KEY, f"{name}.count", 1)
+            await pipe.execute()
+    except Exception as e:
+        logger.debug(f"Failed to record metric {name}: {e}")
+
+
+async def agauge(name: str, value: float) -> None:
+    """Set a metric to its current value (async)"""
+    try:
+        await async_redis_client.hset(METRICS_KEY, name, value)
+    except Exception as e:
+        logger.debug(f"Failed to record metric {name}: {e}")
+
+
+async def asnapshot() -> Dict[str, float]:
+    """Return all recorded metrics (async)"""
+    return {name: float(value) for name, value in (await async_redis_client.hgetall(METRICS_KEY)).items()}
@@ -0,0 +1,60 @@
+import logging
+import uuid
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from app.database import SessionLocal
+from app.models.database import OutboxMessage
+from app.redis_client import redis_client
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Messages for Chatwoot are written to the outbox table by the workers and posted by the outbox
+# dispatcher (app/outbox.py), so a slow Chatwoot doesn't hold Dify workers and an answer Dify
+# already generated survives a failed post. The idempotency key makes re-queueing from a retried
+# task a no-op; the wake-up list lets the dispatcher pick new messages up without polling delay.
+# Dify answers are keyed "<task id>:answer": the dispatcher clears the typing indicator once it
+# posted one, the worker would clear it while the answer is still queued.
+
+WAKEUP_KEY = "chatdify:outbox:wakeup"
+ANSWER_KEY_SUFFIX = ":answer"
+
+
+def enqueue_message_sync(
+    conversation_id: int,
+    message: str,
+    private: bool = False,
+    idempotency_key: Optional[str] = None,
+    account_id: Optional[str] = None,
+) -> bool:
+    """Queue a message for the dispatcher, False if one with this key was queued already"""
+    idempotency_key = idempotency_key or uuid.uuid4().hex
+    with SessionLocal() as db:
+        db.add(
+            OutboxMessage(
+                idempotency_key=idempotency_key,
+                conversation_id=conversation_id,
+                account_id=account_id,
+                content=message,
+                private=private,
+            )
+        )
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            logger.info(f"Outbox message {idempotency_key} for conversation {conversation_id} already queued")
+            metrics.incr("outbox.duplicates")
+            return False
+    metrics.incr("outbox.queued")
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.rpush(WAKEUP_KEY, 1)
+            pipe.ltrim(WAKEUP_KEY, -1, -1)
+            pipe.execute()
+    except Exception as e:
+        # The dispatcher still finds the message on its next poll
+        logger.debug(f"Failed to wake the outbox dispatcher: {e}")
+    return True
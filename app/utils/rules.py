@@ -0,0 +1,69 @@
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+from sqlmodel import SQLModel
+
+from app.models.non_database import ConversationActions
+
+logger = logging.getLogger(__name__)
+
+# Fast lane for deterministic intents ("operator please", "stop", opening hours...). All rule
+# patterns are compiled into one regex with a named group per rule, so a message is matched
+# against every rule in a single pass; a match is answered locally without calling Dify.
+
+
+class FastLaneRule(SQLModel):
+    name: str
+    patterns: List[str]  # phrases, matched case-insensitively on word boundaries
+    exact: bool = False  # the whole message must be one of the phrases
+    regex: bool = False  # patterns are regular expressions instead of plain phrases
+    reply: Optional[str] = None  # may use {conversation_id} and {sender_name}
+    actions: Optional[ConversationActions] = None
+
+
+class _TemplateValues(dict):
+    def __missing__(self, key: str) -> str:
+        return "{" + key + "}"
+
+
+class RuleEngine:
+    """Matches a message against all rules at once and returns the first rule that applies"""
+
+    def __init__(self, rules: List[FastLaneRule]):
+        self.rules = rules
+        alternatives = []
+        for index, rule in enumerate(rules):
+            if not rule.patterns:
+                raise ValueError(f"Fast lane rule '{rule.name}' has no patterns")
+            if not rule.reply and not rule.actions:
+                raise ValueError(f"Fast lane rule '{rule.name}' has neither a reply nor actions")
+            phrases = "|".join(pattern if rule.regex else re.escape(pattern) for pattern in rule.patterns)
+            # Not \b: a phrase may start or end with punctuation, e.g. "price (eur)"
+            body = rf"^\s*(?:{phrases})\W*$" if rule.exact else rf"(?<!\w)(?:{phrases})(?!\w)"
+            alternatives.append(f"(?P<r{index}>{body})")
+        self._pattern = re.compile("|".join(alternatives), re.IGNORECASE) if alternatives else None
+
+    def match(self, content: Optional[str]) -> Optional[FastLaneRule]:
+        if not content or self._pattern is None:
+            return None
+        found = self._pattern.search(content)
+        if found is None:
+            return None
+        return self.rules[int(found.lastgroup[1:])]
+
+    @staticmethod
+    def render_reply(rule: FastLaneRule, **values: Any) -> str:
+        return rule.reply.format_map(_TemplateValues({key: value or "" for key, value in values.items()}))
+
+
+def load_rules(path: Optional[str]) -> RuleEngine:
+    """Load rules from a JSON file holding a list of rule objects (no path means no rules)"""
+    if not path:
+        return RuleEngine([])
+    with open(path, encoding="utf-8") as f:
+        data: List[Dict[str, Any]] = json.load(f)
+    engine = RuleEngine([FastLaneRule.model_validate(rule) for rule in data])
+    logger.info(f"Loaded {len(engine.rules)} fast lane rules from {path}")
+    return engine
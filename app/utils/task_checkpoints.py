@@ -0,0 +1,61 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from app import config
+from app.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# Progress of a process_message_with_dify task that must survive its worker, keyed by the Celery
+# task ID (kept by redeliveries and retries). Tasks are acknowledged once done, so a task cut off by
+# a stopping worker runs again: it takes back the buffered context the first run popped, and once
+# Dify has answered, the answer itself, so Dify isn't asked twice. Best-effort, entries expire
+# after TASK_CHECKPOINT_TTL_SECONDS.
+
+
+def _key(task_id: str) -> str:
+    return f"chatdify:task:{task_id}:checkpoint"
+
+
+def load_sync(task_id: Optional[str]) -> Tuple[List[str], Optional[Dict[str, Any]]]:
+    """Context lines and Dify result checkpointed by an earlier run of the task"""
+    if not task_id:
+        return [], None
+    try:
+        context, result = redis_client.hmget(_key(task_id), "context", "result")
+    except Exception as e:
+        logger.warning(f"Failed to read checkpoint of task {task_id}: {e}")
+        return [], None
+    return (json.loads(context) if context else []), (json.loads(result) if result else None)
+
+
+def _save(task_id: Optional[str], field: str, value: Any) -> None:
+    if not task_id:
+        return
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(_key(task_id), field, json.dumps(value))
+            pipe.expire(_key(task_id), config.TASK_CHECKPOINT_TTL_SECONDS)
+            pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to checkpoint {field} of task {task_id}: {e}")
+
+
+def save_context_sync(task_id: Optional[str], lines: List[str]) -> None:
+    if lines:
+        _save(task_id, "context", lines)
+
+
+def save_result_sync(task_id: Optional[str], result: Dict[str, Any]) -> None:
+    _save(task_id, "result", result)
+
+
+def clear_context_sync(task_id: Optional[str]) -> None:
+    """The context went back to the conversation's buffer"""
+    if not task_id:
+        return
+    try:
+        redis_client.hdel(_key(task_id), "context")
+    except Exception as e:
+        logger.warning(f"Failed to clear context checkpoint of task {task_id}: {e}")
@@ -0,0 +1,129 @@
+import argparse
+import heapq
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+# Discrete-event simulation of the worker pools under mixed load: live customer messages (a few
+# of them from urgent conversations), agent messages, a burst of conversation deletions and a
+# storm of Dify retries. Compares one shared FIFO queue consumed by all worker processes with
+# the routed setup of docker-compose.yml: live/agent queues with broker priorities on the `worker`
+# service, retry/maintenance queues on the smaller `worker-background` service.
+#
+#   python scripts/benchmark_queue_routing.py --seed 7
+#
+# It simulates the queueing only (service times are drawn from distributions, nothing calls Dify),
+# so it shows how the routing behaves, not what a given deployment will measure.
+
+DEFAULT_PRIORITY = 5
+URGENT_PRIORITY = 0
+
+
+@dataclass(order=True)
+class Job:
+    priority: int
+    arrival: float
+    kind: str = field(compare=False)
+    service: float = field(compare=False)
+
+
+def generate_load(rng: random.Random, duration: float, live_rate: float, urgent_share: float) -> List[Job]:
+    jobs = []
+    t = 0.0
+    while True:
+        t += rng.expovariate(live_rate)
+        if t >= duration:
+            break
+        urgent = rng.random() < urgent_share
+        priority = URGENT_PRIORITY if urgent else DEFAULT_PRIORITY
+        # A Dify answer takes ~3s, an agent message is just forwarded
+        jobs.append(Job(priority, t, "urgent" if urgent else "live", rng.lognormvariate(1.0, 0.4)))
+        if rng.random() < 0.3:
+            jobs.append(Job(DEFAULT_PRIORITY, t + rng.uniform(0, 5), "agent", rng.lognormvariate(-0.5, 0.3)))
+    # Bulk clean-up in Chatwoot: a burst of conversation deletions
+    jobs += [Job(DEFAULT_PRIORITY, 60 + i * 0.01, "maintenance", rng.lognormvariate(-1.2, 0.3)) for i in range(500)]
+    # Dify had a hiccup: calls that failed come back as retries at once
+    jobs += [Job(DEFAULT_PRIORITY, 200 + i * 0.05, "retry", rng.lognormvariate(1.0, 0.4)) for i in range(200)]
+    return sorted(jobs, key=lambda job: job.arrival)
+
+
+def simulate(jobs: List[Job], pools: List[Tuple[int, Tuple[str, ...], bool]]) -> Dict[str, List[float]]:
+    """pools: (processes, job kinds consumed, priority ordering); returns latencies by job kind"""
+    queues: List[List] = [[] for _ in pools]
+    idle = [processes for processes, _, _ in pools]
+    pool_of = {kind: index for index, (_, kinds, _) in enumerate(pools) for kind in kinds}
+    events: List[Tuple[float, int, int, object]] = []  # (time, order, type, payload)
+    for order, job in enumerate(jobs):
+        heapq.heappush(events, (job.arrival, order, 0, job))
+    order = len(jobs)
+    latencies: Dict[str, List[float]] = {}
+
+    while events:
+        now, _, event_type, payload = heapq.heappop(events)
+        if event_type == 0:
+            index = pool_of[payload.kind]
+            ordered = pools[index][2]
+            heapq.heappush(queues[index], (payload.priority if ordered else 0, payload.arrival, order, payload))
+            order += 1
+        else:
+            job, index = payload
+            idle[index] += 1
+            latencies.setdefault(job.kind, []).append(now - job.arrival)
+        for index, queue in enumerate(queues):
+            while idle[index] and queue:
+                job = heapq.heappop(queue)[-1]
+                idle[index] -= 1
+                heapq.heappush(events, (now + job.service, order, 1, (job, index)))
+                order += 1
+    return latencies
+
+
+def percentile(values: List[float], share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))] if values else 0.0
+
+
+def report(name: str, latencies: Dict[str, List[float]]) -> None:
+    live = latencies.get("live", []) + latencies.get("urgent", [])
+    print(f"{name}")
+    print(f"  live replies      p50 {percentile(live, 0.5):7.1f}s   p99 {percentile(live, 0.99):7.1f}s")
+    print(
+        f"  urgent replies    p50 {percentile(latencies.get('urgent', []), 0.5):7.1f}s   "
+        f"p99 {percentile(latencies.get('urgent', []), 0.99):7.1f}s"
+    )
+    print(f"  agent messages    p99 {percentile(latencies.get('agent', []), 0.99):7.1f}s")
+    print(f"  retries           max {max(latencies.get('retry', [0])):7.1f}s")
+    print(f"  deletions         max {max(latencies.get('maintenance', [0])):7.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate reply latency with shared vs routed task queues")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--duration", type=float, default=600, help="seconds of live traffic")
+    parser.add_argument("--live-rate", type=float, default=0.8, help="customer messages per second")
+    parser.add_argument("--urgent-share", type=float, default=0.05)
+    parser.add_argument("--live-workers", type=int, default=4)
+    parser.add_argument("--background-workers", type=int, default=1)
+    args = parser.parse_args()
+
+    load = generate_load(random.Random(args.seed), args.duration, args.live_rate, args.urgent_share)
+    processes = args.live_workers + args.background_workers
+    print(f"{len(load)} tasks, {processes} worker processes in both setups\n")
+    report(
+        f"Shared queue ({processes} processes, FIFO)",
+        simulate(
+            [Job(**vars(job)) for job in load],
+            [(processes, ("live", "urgent", "agent", "retry", "maintenance"), False)],
+        ),
+    )
+    print()
+    report(
+        f"Routed queues ({args.live_workers} live/agent with priorities, {args.background_workers} retry/maintenance)",
+        simulate(
+            [Job(**vars(job)) for job in load],
+            [
+                (args.live_workers, ("live", "urgent", "agent"), True),
+                (args.background_workers, ("retry", "maintenance"), False),
+            ],
+        ),
+    )
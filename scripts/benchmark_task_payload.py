@@ -0,0 +1,155 @@
+import argparse
+import json
+from typing import Any, Dict, List
+
+from celery import Celery
+from kombu.utils.json import dumps
+
+from app import config
+from app.tasks import celery, compact_dify_result
+
+# Broker bytes per message of the Dify task chain: the task queued by the webhook, the answer
+# callback carrying the Dify response, and the result the backend keeps. "before" is the former
+# setup (plain JSON, full Dify response, argument reprs of up to 1 KB in the headers, stored results),
+# "after" the current configuration (CELERY_TASK_COMPRESSION, CELERY_TASK_SERIALIZER, ...).
+#
+#   python scripts/benchmark_task_payload.py --resources 5
+#
+# Messages are captured as the Redis transport would push them (the JSON envelope with the
+# base64 body), on an in-memory broker, so nothing needs to run.
+
+TASK_ID = "7d3f6a52-2f4c-4b53-9d0e-4c1a9b2e8f10"
+RECEIVED_AT = 1760864400.123456
+MESSAGE = (
+    "Hello, I ordered a blue jacket last week (order 12345) and it still hasn't arrived. "
+    "Can you check where it is and whether I can still change the delivery address?"
+)
+
+
+def dify_response(resources: int) -> Dict[str, Any]:
+    """A blocking chat-messages response of a knowledge-base app, with usage and retriever resources"""
+    chunk = (
+        "Orders are shipped within two business days. Tracking links are sent by email once the parcel "
+        "leaves the warehouse. The delivery address can be changed until the parcel is handed to the carrier; "
+        "after that, contact the carrier directly with the tracking number. "
+    ) * 2
+    return {
+        "event": "message",
+        "task_id": "c3f1b5a0-1d2e-4f3a-8b7c-6d5e4f3a2b1c",
+        "id": "9da23599-e713-473b-982c-4328d4f5c78a",
+        "message_id": "9da23599-e713-473b-982c-4328d4f5c78a",
+        "conversation_id": "45701982-8118-4bc5-8e9b-64562b4555f2",
+        "mode": "chat",
+        "answer": (
+            "Your order 12345 left our warehouse on Monday and is on its way; you should have received a "
+            "tracking link by email. The delivery address can still be changed until the parcel reaches the "
+            "carrier, reply with the new address and we'll update it."
+        ),
+        "metadata": {
+            "usage": {
+                "prompt_tokens": 1033,
+                "prompt_unit_price": "0.001",
+                "prompt_price_unit": "0.001",
+                "prompt_price": "0.0010330",
+                "completion_tokens": 128,
+                "completion_unit_price": "0.002",
+                "completion_price_unit": "0.001",
+                "completion_price": "0.0002560",
+                "total_tokens": 1161,
+                "total_price": "0.0012890",
+                "currency": "USD",
+                "latency": 0.7682376249867957,
+            },
+            "retriever_resources": [
+                {
+                    "position": position,
+                    "dataset_id": "101b4c97-fc2e-463c-90b1-5261a4cdcafb",
+                    "dataset_name": "Shipping FAQ",
+                    "document_id": "8dd1ad74-0b5f-4175-b735-7d98bbbb4e00",
+                    "document_name": f"shipping-{position}.md",
+                    "segment_id": "ed599c7f-2766-4294-9d1d-e5235a61270a",
+                    "score": 0.98457545,
+                    "content": chunk,
+                }
+                for position in range(1, resources + 1)
+            ],
+        },
+        "created_at": 1705279153,
+    }
+
+
+def capture(app: Celery, send) -> List[Dict[str, Any]]:
+    """The transport messages a publish produces"""
+    with app.connection_for_write("memory://") as connection:
+        channel = connection.default_channel
+        sent: List[Dict[str, Any]] = []
+        channel._put = lambda queue, message, **kwargs: sent.append(message)
+        send(connection)
+    return sent
+
+
+def measure(app: Celery, full_result: Dict[str, Any], compact: bool) -> Dict[str, int]:
+    result: Dict[str, Any] = compact_dify_result(full_result) if compact else full_result
+    link_kwargs: Dict[str, Any] = {"conversation_id": 1234, "task_id": TASK_ID, "received_at": RECEIVED_AT}
+    if not compact:
+        link_kwargs["dialogue_id"] = 99
+
+    [queued] = capture(
+        app,
+        lambda connection: app.send_task(
+            "app.tasks.process_message_with_dify",
+            args=[MESSAGE, full_result["conversation_id"], "1234", "pending", "incoming"],
+            kwargs={"received_at": RECEIVED_AT, "ticket": 17},
+            task_id=TASK_ID,
+            queue=config.CELERY_QUEUE_LIVE,
+            ignore_result=app.conf.task_ignore_result,
+            link=app.signature("app.tasks.handle_dify_response", kwargs=link_kwargs),
+            link_error=app.signature(
+                "app.tasks.handle_dify_error", kwargs={"conversation_id": 1234, "task_id": TASK_ID}
+            ),
+            connection=connection,
+        ),
+    )
+    [callback] = capture(
+        app,
+        lambda connection: app.send_task(
+            "app.tasks.handle_dify_response",
+            args=[result],
+            kwargs=link_kwargs,
+            queue=config.CELERY_QUEUE_LIVE,
+            ignore_result=app.conf.task_ignore_result,
+            connection=connection,
+        ),
+    )
+    stored = 0
+    if not app.conf.task_ignore_result:
+        meta = {"status": "SUCCESS", "result": result, "traceback": None, "children": [], "task_id": TASK_ID}
+        stored = len(json.dumps(meta, separators=(",", ":")))
+    return {"task": len(dumps(queued)), "callback": len(dumps(callback)), "result_backend": stored}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Broker bytes per message of the Dify task chain")
+    parser.add_argument("--resources", type=int, default=3, help="retriever resources in the Dify response")
+    args = parser.parse_args()
+
+    full_result = dify_response(args.resources)
+    # Celery's defaults, as before the compact settings
+    before = measure(Celery("before", backend="cache+memory://", set_as_current=False), full_result, False)
+    after = measure(celery, full_result, True)
+    print(
+        f"Dify response with {args.resources} retriever resources; after: serializer={config.CELERY_TASK_SERIALIZER}, "
+        f"compression={config.CELERY_TASK_COMPRESSION}, ignore_result={config.CELERY_TASK_IGNORE_RESULT}"
+    )
+    print(f"{'bytes':<16}{'before':>10}{'after':>10}{'change':>10}")
+    for key in ("task", "callback", "result_backend"):
+        change = f"{(after[key] - before[key]) / before[key]:+.0%}" if before[key] else ""
+        print(f"{key:<16}{before[key]:>10}{after[key]:>10}{change:>10}")
+    total_before, total_after = sum(before.values()), sum(after.values())
+    print(
+        f"{'per message':<16}{total_before:>10}{total_after:>10}{(total_after - total_before) / total_before:>+10.0%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
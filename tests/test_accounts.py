@@ -0,0 +1,66 @@
+import pytest
+
+from app.api import chatwoot as chatwoot_module
+from app.api.chatwoot import ChatwootRegistry
+from app.utils import accounts
+from app.utils.accounts import conversation_key, split_key
+
+
+@pytest.fixture(autouse=True)
+def two_accounts(monkeypatch):
+    """Serve accounts 1 (the first, default one) and 42"""
+    configured = accounts._load(
+        [{"account_id": 1, "api_key": "key-1"}, {"account_id": "42", "api_key": "key-42", "api_url": "https://b.test"}]
+    )
+    for module in (accounts, chatwoot_module):
+        monkeypatch.setattr(module, "ACCOUNTS", configured)
+    monkeypatch.setattr(accounts, "DEFAULT_ACCOUNT_ID", "1")
+
+
+def test_first_account_keeps_bare_ids():
+    assert conversation_key(None, 7) == "7"
+    assert conversation_key("1", 7) == "7"
+    assert conversation_key(1, "7") == "7"
+    assert split_key("7") == ("1", 7)
+    assert split_key(7) == ("1", 7)
+
+
+def test_other_accounts_are_qualified():
+    assert conversation_key("42", 7) == "42/7"
+    assert conversation_key(42, 7) == "42/7"
+    assert split_key("42/7") == ("42", 7)
+
+
+@pytest.mark.parametrize("account_id", [None, "1", "42", "99"])
+def test_keys_round_trip(account_id):
+    account, conversation_id = split_key(conversation_key(account_id, 7))
+    assert conversation_id == 7
+    assert account == (account_id or "1")
+
+
+def test_registry_resolves_keys_to_their_account():
+    registry = ChatwootRegistry()
+
+    handler, conversation_id = registry.for_key("42/7")
+    assert (handler.account_id, handler.api_url, conversation_id) == ("42", "https://b.test", 7)
+    handler, conversation_id = registry.for_key(7)
+    assert (handler.account_id, handler.api_key, conversation_id) == ("1", "key-1", 7)
+    assert registry.get() is registry.get("1")
+    assert handler.conversation_key(7) == "7"
+    assert registry.get("42").conversation_key(7) == "42/7"
+
+
+def test_unknown_account_is_not_served():
+    registry = ChatwootRegistry()
+
+    handler, conversation_id = registry.for_key("99/7")
+    assert handler is None
+    assert conversation_id == 7
+    assert registry.get("99") is None
+
+
+def test_account_ids_must_be_unique_and_without_slash():
+    with pytest.raises(ValueError):
+        accounts._load([{"account_id": "1", "api_key": "a"}, {"account_id": 1, "api_key": "b"}])
+    with pytest.raises(ValueError):
+        accounts._load([{"account_id": "a/b", "api_key": "a"}])
@@ -1,3 +1,4 @@
+import json
 import os
 
 import httpx
@@ -53,6 +54,16 @@ async def test_webhook_endpoint(http_client):
     assert "status" in data
 
 
+async def test_send_chatwoot_message_endpoint(http_client, test_conversation_id):
+    """Test posting a private note to a conversation via the send-message endpoint"""
+    params = {"conversation_id": test_conversation_id, "message": "Test note from automated test", "is_private": True}
+
+    response = await http_client.post("/send-chatwoot-message", params=params)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "success"
+
+
 async def test_update_labels_endpoint(http_client, test_conversation_id):
     """Test updating labels via API endpoint"""
     test_labels = ["test-label-1", "test-label-2"]
@@ -84,3 +95,46 @@ async def test_custom_attributes_endpoint(http_client, test_conversation_id):
     data = response.json()
     assert data["status"] == "success"
     assert "custom_attributes" in data
+
+
+async def test_conversation_actions_endpoint(http_client, test_conversation_id):
+    """Test applying several updates in one request via the actions endpoint"""
+    actions = {
+        "priority": "medium",
+        "labels": ["test-label-1"],
+        "custom_attributes": {"test_key": "test_value"},
+    }
+
+    response = await http_client.post(f"/conversations/{test_conversation_id}/actions", json=actions)
+    assert response.status_code == 200
+    data = response.json()
+    assert data["status"] == "success"
+    assert set(data["actions"]) == {"priority", "labels", "custom_attributes"}
+    assert all(entry["status"] == "success" for entry in data["actions"].values())
+
+
+async def test_bulk_conversation_actions_endpoint(http_client, test_conversation_id):
+    """Test the bulk endpoint streams one NDJSON line per conversation plus start/finish lines"""
+    payload = {"conversation_ids": [test_conversation_id], "actions": {"priority": "medium"}}
+
+    response = await http_client.post("/conversations/bulk", json=payload)
+    assert response.status_code == 200
+    events = [json.loads(line) for line in response.text.splitlines() if line]
+    assert events[0]["event"] == "started"
+    assert events[1]["conversation_id"] == test_conversation_id
+    assert events[-1]["event"] == "finished"
+
+    job = await http_client.get(f"/conversations/bulk/{events[0]['job_id']}")
+    assert job.status_code == 200
+    assert job.json()["total"] == 1
+
+
+async def test_dead_letters_endpoints(http_client):
+    """Test listing dead letters with filters and that a replay of an empty selection queues nothing"""
+    response = await http_client.get("/dead-letters", params={"error_type": "NoSuchError", "limit": 10})
+    assert response.status_code == 200
+    assert response.json() == {"count": 0, "entries": []}
+
+    response = await http_client.post("/dead-letters/replay", json={"error_type": "NoSuchError"})
+    assert response.status_code == 200
+    assert response.json()["queued"] == 0
@@ -0,0 +1,152 @@
+import pytest
+
+from app import config
+from app.utils import backlog
+from app.utils.backlog import Backlog, busy_message
+
+
+@pytest.fixture
+def thresholds(monkeypatch):
+    """Busy from 10 queued or 60s of waiting, shed from 50 queued or 300s"""
+    for name, value in {
+        "ADMISSION_SOFT_QUEUE_DEPTH": 10,
+        "ADMISSION_SOFT_WAIT_SECONDS": 60,
+        "ADMISSION_HARD_QUEUE_DEPTH": 50,
+        "ADMISSION_HARD_WAIT_SECONDS": 300,
+    }.items():
+        monkeypatch.setattr(config, name, value)
+    monkeypatch.setattr(backlog, "_sample", None)
+
+
+@pytest.mark.parametrize(
+    "depth, oldest_wait_seconds, level",
+    [
+        (0, 0, "normal"),
+        (9, 59.9, "normal"),
+        (10, 0, "busy"),
+        (0, 60, "busy"),
+        (49, 299, "busy"),
+        (50, 0, "shed"),
+        (0, 300, "shed"),
+    ],
+)
+def test_levels_follow_the_thresholds(thresholds, depth, oldest_wait_seconds, level):
+    assert backlog._level(Backlog(depth=depth, oldest_wait_seconds=oldest_wait_seconds)) == level
+
+
+def test_zero_thresholds_are_disabled(thresholds, monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_HARD_QUEUE_DEPTH", 0)
+    monkeypatch.setattr(config, "ADMISSION_SOFT_WAIT_SECONDS", 0)
+
+    assert backlog._level(Backlog(depth=10_000, oldest_wait_seconds=120)) == "busy"
+    assert backlog._level(Backlog(depth=5, oldest_wait_seconds=299)) == "normal"
+
+
+def test_busy_message_counts_the_queue_ahead(monkeypatch):
+    monkeypatch.setattr(config, "ADMISSION_BUSY_MESSAGE", "You are number {position}, about {wait_minutes} min.")
+
+    assert busy_message(Backlog(depth=4, waiting=7, oldest_wait_seconds=150)) == "You are number 8, about 2 min."
+    assert busy_message(Backlog(depth=12, waiting=3, oldest_wait_seconds=5)) == "You are number 13, about 1 min."
+
+
+async def test_admission_admits_when_the_backlog_cannot_be_read(thresholds, monkeypatch):
+    async def unreachable(*args):
+        raise ConnectionError("Redis is down")
+
+    monkeypatch.setattr(backlog, "queue_depths", unreachable)
+
+    assert (await backlog.admission()).level == "normal"
+
+
+async def test_admission_reads_are_sampled(thresholds, monkeypatch):
+    reads = []
+
+    async def queue_depths(queues):
+        reads.append(queues)
+        return {queue: 20 for queue in queues}
+
+    async def waiting():
+        return 25, 30.0
+
+    monkeypatch.setattr(config, "ADMISSION_SAMPLE_SECONDS", 60)
+    monkeypatch.setattr(backlog, "queue_depths", queue_depths)
+    monkeypatch.setattr(backlog, "waiting", waiting)
+
+    first = await backlog.admission()
+    assert (first.depth, first.waiting, first.level) == (20, 25, "busy")
+    assert await backlog.admission() is first
+    assert len(reads) == 1
+
+
+@pytest.fixture
+def load(monkeypatch):
+    """Autoscaling inputs without Redis: set load.totals (a 300s window) and load.waiting"""
+
+    class Load:
+        totals = {}
+        waiting = (0, 0.0)
+
+    async def queue_depths(queues):
+        return {queue: 0 for queue in queues}
+
+    async def waiting():
+        return Load.waiting
+
+    async def in_flight_counts():
+        return {"a": 2, "b": 1}
+
+    async def window():
+        return Load.totals, 300.0
+
+    for name, value in {
+        "worker_concurrency": 4,
+        "AUTOSCALE_TARGET_LATENCY_SECONDS": 30,
+        "AUTOSCALE_DEFAULT_SERVICE_SECONDS": 10,
+        "AUTOSCALE_MIN_WORKERS": 1,
+        "AUTOSCALE_MAX_WORKERS": 20,
+        "AUTOSCALE_API_REPLICA_RPS": 50,
+        "AUTOSCALE_MIN_API_REPLICAS": 1,
+        "AUTOSCALE_MAX_API_REPLICAS": 10,
+    }.items():
+        monkeypatch.setattr(config, name, value)
+    monkeypatch.setattr(backlog, "queue_depths", queue_depths)
+    monkeypatch.setattr(backlog, "waiting", waiting)
+    monkeypatch.setattr(backlog, "in_flight_counts", in_flight_counts)
+    monkeypatch.setattr(backlog, "_window", window)
+    return Load
+
+
+async def test_worker_slots_cover_arrivals_and_the_queue(load):
+    """Test 2 arrivals/s of 5s each need 10 slots, and 30 waiting messages 5 more to clear them in 30s"""
+    load.totals = {"arrivals": 600, "services": 100, "service_seconds": 500, "webhooks": 3000}
+    load.waiting = (30, 45.0)
+
+    signals = await backlog.autoscaling_signals()
+
+    assert (signals.arrival_rate, signals.mean_service_seconds, signals.dify_call_rate) == (2, 5, 0.3333)
+    assert signals.desired_worker_slots == 15
+    assert signals.desired_workers == 4
+    assert (signals.webhook_rate, signals.desired_api_replicas) == (10, 1)
+    assert signals.in_flight_total == 3
+
+
+async def test_replica_counts_are_clamped(load, monkeypatch):
+    monkeypatch.setattr(config, "AUTOSCALE_MAX_WORKERS", 3)
+    load.totals = {"arrivals": 600, "services": 100, "service_seconds": 500, "webhooks": 300_000}
+
+    signals = await backlog.autoscaling_signals()
+    assert (signals.desired_worker_slots, signals.desired_workers) == (10, 3)
+    assert signals.desired_api_replicas == 10
+
+    load.totals = {}
+    signals = await backlog.autoscaling_signals()
+    assert (signals.desired_worker_slots, signals.desired_workers, signals.desired_api_replicas) == (0, 1, 1)
+
+
+async def test_default_service_time_until_calls_are_measured(load):
+    load.totals = {"arrivals": 60}
+
+    signals = await backlog.autoscaling_signals()
+
+    assert signals.mean_service_seconds == 10
+    assert signals.desired_worker_slots == 2  # 0.2/s x 10s
@@ -0,0 +1,111 @@
+import httpx
+import pytest
+
+from app.api import chatwoot as chatwoot_module
+from app.api.chatwoot import ChatwootHandler, ConversationStateCache
+from app.utils import metrics
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(chatwoot_module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    """A handler with suppression on, posting to a recording transport instead of Chatwoot"""
+
+    async def record(*args):
+        pass
+
+    monkeypatch.setattr(metrics, "incr", lambda *args: None)
+    monkeypatch.setattr(metrics, "aincr", record)
+    handler = ChatwootHandler(api_url="https://chatwoot.test/api/v1", api_key="key", account_id="1")
+    handler.state = ConversationStateCache(ttl_seconds=300, max_entries=100)
+    handler.requests = []
+
+    def respond(request):
+        handler.requests.append(request)
+        return httpx.Response(200, json={"payload": ["vip"]})
+
+    handler.transport = httpx.MockTransport(respond)
+    return handler
+
+
+def test_holds_only_fields_seen(clock):
+    state = ConversationStateCache(ttl_seconds=60, max_entries=10)
+    state.observe({"id": 7, "status": "pending", "labels": ["b", "a"], "meta": {"assignee": None}})
+
+    assert state.holds(7, "status", "pending")
+    assert not state.holds(7, "status", "open")
+    assert state.holds(7, "labels", ["a", "b"]), "labels compare as sets"
+    assert state.holds(7, "assignee_id", None)
+    assert not state.holds(7, "priority", None), "a field never seen is no match"
+    assert not state.holds(8, "status", "pending")
+
+
+def test_entries_expire_after_the_ttl(clock):
+    state = ConversationStateCache(ttl_seconds=60, max_entries=10)
+    state.update(7, status="open")
+
+    clock.now += 60
+    assert state.holds(7, "status", "open")
+    clock.now += 1
+    assert state.get(7) == {}
+
+
+def test_update_merges_and_refreshes(clock):
+    state = ConversationStateCache(ttl_seconds=60, max_entries=10)
+    state.update(7, status="open")
+    clock.now += 50
+    state.update(7, priority="high")
+    clock.now += 50
+
+    assert state.get(7) == {"status": "open", "priority": "high"}
+
+
+def test_oldest_entries_are_evicted_past_max_entries(clock):
+    state = ConversationStateCache(ttl_seconds=60, max_entries=2)
+    state.update(1, status="open")
+    state.update(2, status="open")
+    state.update(1, priority="low")  # 1 is now the most recent
+    state.update(3, status="open")
+
+    assert state.get(2) == {}
+    assert state.get(1) and state.get(3)
+
+
+def test_zero_ttl_keeps_nothing(clock):
+    state = ConversationStateCache(ttl_seconds=0, max_entries=10)
+    state.observe({"id": 7, "status": "open"})
+
+    assert not state.holds(7, "status", "open")
+
+
+async def test_suppressed_writes_keep_the_response_shape(handler):
+    handler.state.observe({"id": 7, "status": "resolved", "labels": ["vip"]})
+    async with httpx.AsyncClient(transport=handler.transport) as client:
+        await handler.open(client)
+
+        assert await handler.add_labels(7, ["vip"]) == {"payload": ["vip"], "suppressed": True}
+        assert await handler.toggle_status(7, "resolved") == {
+            "payload": {"success": True, "conversation_id": 7, "current_status": "resolved"},
+            "suppressed": True,
+        }
+        assert handler.toggle_status_sync(7, "resolved")["suppressed"] is True
+        assert handler.requests == []
+
+        # A change, or force, goes to Chatwoot
+        await handler.add_labels(7, ["vip", "billing"])
+        await handler.add_labels(7, ["vip"], force=True)
+        assert len(handler.requests) == 2
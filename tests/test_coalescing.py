@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+
+from app.api.coalescing import WriteCoalescer, merge_custom_attributes, merge_labels
+
+
+class RecordingWrite:
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    async def __call__(self, conversation_id, value):
+        self.calls.append((conversation_id, value))
+        if self.error:
+            raise self.error
+        return {"conversation_id": conversation_id, "value": value, "write": len(self.calls)}
+
+
+def test_merge_labels_keeps_first_seen_order():
+    assert merge_labels(["vip", "billing"], ["billing", "urgent"]) == ["vip", "billing", "urgent"]
+
+
+def test_merge_custom_attributes_later_values_win():
+    assert merge_custom_attributes({"region": "EU", "tier": 1}, {"tier": 2}) == {"region": "EU", "tier": 2}
+
+
+async def test_writes_within_the_window_are_merged_into_one():
+    """Test labels are unioned and attribute dicts merged, with one write per conversation"""
+    labels = RecordingWrite()
+    attributes = RecordingWrite()
+    label_writes = WriteCoalescer("labels", 0.05, merge_labels, labels)
+    attribute_writes = WriteCoalescer("custom attributes", 0.05, merge_custom_attributes, attributes)
+
+    await asyncio.gather(
+        label_writes.submit(1, ["vip"]),
+        label_writes.submit(1, ["billing", "vip"]),
+        label_writes.submit(2, ["other"]),
+        attribute_writes.submit(1, {"region": "EU", "tier": 1}),
+        attribute_writes.submit(1, {"tier": 2}),
+    )
+
+    assert sorted(labels.calls) == [(1, ["vip", "billing"]), (2, ["other"])]
+    assert attributes.calls == [(1, {"region": "EU", "tier": 2})]
+
+
+async def test_one_write_resolves_every_waiter():
+    write = RecordingWrite()
+    coalescer = WriteCoalescer("labels", 0.05, merge_labels, write)
+
+    results = await asyncio.gather(*(coalescer.submit(1, [f"label-{index}"]) for index in range(3)))
+
+    assert len(write.calls) == 1
+    assert results == [results[0]] * 3
+    assert results[0]["value"] == ["label-0", "label-1", "label-2"]
+
+
+async def test_write_error_reaches_every_waiter():
+    write = RecordingWrite(error=RuntimeError("Chatwoot is down"))
+    coalescer = WriteCoalescer("labels", 0.05, merge_labels, write)
+
+    results = await asyncio.gather(
+        coalescer.submit(1, ["vip"]), coalescer.submit(1, ["billing"]), return_exceptions=True
+    )
+
+    assert len(write.calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+async def test_a_cancelled_waiter_does_not_cancel_the_write():
+    write = RecordingWrite()
+    coalescer = WriteCoalescer("labels", 0.05, merge_labels, write)
+
+    cancelled = asyncio.create_task(coalescer.submit(1, ["vip"]))
+    waiting = asyncio.create_task(coalescer.submit(1, ["billing"]))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+
+    assert (await waiting)["value"] == ["vip", "billing"]
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+
+
+async def test_flush_all_writes_pending_batches_right_away():
+    """Test shutdown doesn't wait for the window, and the window closing later doesn't write again"""
+    write = RecordingWrite()
+    coalescer = WriteCoalescer("labels", 60, merge_labels, write)
+
+    waiters = [asyncio.create_task(coalescer.submit(1, ["vip"])), asyncio.create_task(coalescer.submit(2, ["other"]))]
+    await asyncio.sleep(0)
+    await asyncio.wait_for(coalescer.flush_all(), timeout=1)
+
+    assert sorted(write.calls) == [(1, ["vip"]), (2, ["other"])]
+    assert [(await waiter)["conversation_id"] for waiter in waiters] == [1, 2]
+    await coalescer._flush(1)
+    assert len(write.calls) == 2
+
+
+async def test_zero_window_writes_through():
+    write = RecordingWrite()
+    coalescer = WriteCoalescer("labels", 0, merge_labels, write)
+
+    await coalescer.submit(1, ["vip"])
+    await coalescer.submit(1, ["billing"])
+
+    assert write.calls == [(1, ["vip"]), (1, ["billing"])]
+    assert not coalescer._pending
@@ -0,0 +1,140 @@
+import asyncio
+import json
+
+import httpx
+
+from app import config
+from app.api.conversation_actions import execute_conversation_actions, extract_embedded_actions, summarize_report
+from app.models.non_database import ConversationActions
+
+TAG = config.DIFY_ACTIONS_TAG
+
+
+def block(content):
+    return f"<{TAG}>{content}</{TAG}>"
+
+
+class RecordingChatwoot:
+    """Chatwoot handler double recording the order in which calls finish"""
+
+    def __init__(self, fail=()):
+        self.finished = []
+        self.fail = fail
+
+    async def _call(self, name, result, delay=0.0):
+        await asyncio.sleep(delay)
+        if name in self.fail:
+            request = httpx.Request("POST", "https://chatwoot.test")
+            response = httpx.Response(429, headers={"Retry-After": "5"}, request=request)
+            raise httpx.HTTPStatusError("Too many requests", request=request, response=response)
+        self.finished.append(name)
+        return result
+
+    async def toggle_priority(self, conversation_id, priority, force=False):
+        return await self._call("priority", {"priority": priority})
+
+    async def add_labels(self, conversation_id, labels, force=False):
+        return await self._call("labels", {"payload": labels}, delay=0.02)
+
+    async def update_custom_attributes(self, conversation_id, custom_attributes, force=False):
+        return await self._call("custom_attributes", {"custom_attributes": custom_attributes})
+
+    async def get_teams(self):
+        return [{"id": 3, "name": "Support"}]
+
+    async def assign_team(self, conversation_id, team_id, force=False):
+        return await self._call("team", {"team_id": team_id}, delay=0.05)
+
+    async def toggle_status(self, conversation_id, status, force=False):
+        return await self._call("status", {"status": status})
+
+
+def test_embedded_block_is_stripped_and_parsed():
+    answer = f"Your ticket is escalated.\n{block(json.dumps({'status': 'open', 'labels': ['vip']}))}"
+
+    clean, actions = extract_embedded_actions(answer)
+
+    assert clean == "Your ticket is escalated."
+    assert actions.status.value == "open"
+    assert actions.labels == ["vip"]
+
+
+def test_malformed_block_is_stripped_without_raising():
+    clean, actions = extract_embedded_actions(f"Hello {block('{not json')} there")
+
+    assert clean == "Hello  there"
+    assert actions is None
+
+
+def test_every_block_is_stripped_and_the_first_applied():
+    answer = f"{block(json.dumps({'team': 'Support'}))}Hi{block(json.dumps({'team': 'Sales'}))}"
+
+    clean, actions = extract_embedded_actions(answer)
+
+    assert clean == "Hi"
+    assert actions.team == "Support"
+
+
+def test_actions_from_metadata():
+    """Test the metadata key is used when the answer has no block, and the answer is left as is"""
+    clean, actions = extract_embedded_actions("Hi", {TAG: {"priority": "high"}})
+    assert clean == "Hi"
+    assert actions.priority.value == "high"
+
+    clean, actions = extract_embedded_actions("Hi", {TAG: json.dumps({"labels": ["a"]})})
+    assert actions.labels == ["a"]
+
+    assert extract_embedded_actions("Hi", {"other": 1}) == ("Hi", None)
+    assert extract_embedded_actions("Hi") == ("Hi", None)
+
+
+async def test_status_runs_after_team_and_labels():
+    chatwoot = RecordingChatwoot()
+    actions = ConversationActions(
+        status="resolved", priority="high", labels=["vip"], custom_attributes={"tier": 2}, team="support"
+    )
+
+    report = await execute_conversation_actions(chatwoot, 1, actions)
+
+    assert chatwoot.finished[-1] == "status"
+    assert set(chatwoot.finished) == {"priority", "labels", "custom_attributes", "team", "status"}
+    assert report["team"]["result"]["team_id"] == 3
+    assert summarize_report(report) == "success"
+
+
+async def test_empty_values_are_skipped():
+    chatwoot = RecordingChatwoot()
+    actions = ConversationActions(custom_attributes={}, team="none")
+
+    report = await execute_conversation_actions(chatwoot, 1, actions)
+
+    assert chatwoot.finished == []
+    assert {name: entry["status"] for name, entry in report.items()} == {
+        "custom_attributes": "skipped",
+        "team": "skipped",
+    }
+
+
+async def test_failures_are_reported_per_action():
+    chatwoot = RecordingChatwoot(fail={"labels"})
+    actions = ConversationActions(status="open", labels=["vip"], team="Unknown")
+
+    report = await execute_conversation_actions(chatwoot, 1, actions)
+
+    assert report["labels"] == {
+        "status": "error",
+        "error": "Too many requests",
+        "status_code": 429,
+        "retry_after": "5",
+    }
+    assert report["team"]["status"] == "error"
+    assert "not found" in report["team"]["error"]
+    assert report["status"]["status"] == "success"
+    assert summarize_report(report) == "partial"
+
+
+def test_summarize_report():
+    assert summarize_report({"status": {"status": "success"}, "team": {"status": "skipped"}}) == "success"
+    assert summarize_report({"status": {"status": "success"}, "team": {"status": "error"}}) == "partial"
+    assert summarize_report({"status": {"status": "error"}, "team": {"status": "error"}}) == "error"
+    assert summarize_report({}) == "success"
@@ -0,0 +1,75 @@
+import uuid
+
+import pytest
+import redis
+
+from app import config
+from app.redis_client import redis_client
+from app.utils.conversation_tasks import acquire_turn, cancel_conversation_tasks, next_ticket, release_turn
+
+# Per-conversation lanes against the Redis of REDIS_STATE_URL, on throwaway conversation IDs
+
+
+@pytest.fixture(scope="module", autouse=True)
+def require_redis():
+    try:
+        redis_client.ping()
+    except redis.exceptions.ConnectionError:
+        pytest.skip("Redis is not available")
+
+
+@pytest.fixture
+def conversation_id():
+    conversation_id = f"test-lane-{uuid.uuid4().hex}"
+    yield conversation_id
+    redis_client.delete(
+        *(
+            f"chatdify:conversation:{conversation_id}:{suffix}"
+            for suffix in ("ticket", "lease", "served", "served_at", "cancelled_at")
+        )
+    )
+
+
+def test_turns_are_taken_in_ticket_order(conversation_id):
+    """Test a ticket waits for the one before it and gets the lease once that one is released"""
+    assert not acquire_turn(conversation_id, 2, "task-2")
+    assert acquire_turn(conversation_id, 1, "task-1")
+    assert acquire_turn(conversation_id, 1, "task-1"), "the holder may take its turn again (retries)"
+    assert not acquire_turn(conversation_id, 2, "task-2"), "the lease is still held"
+
+    release_turn(conversation_id, "task-1")
+    assert acquire_turn(conversation_id, 2, "task-2")
+
+
+def test_release_only_by_the_holder(conversation_id):
+    """Test another task can't release the lease"""
+    assert acquire_turn(conversation_id, 1, "task-1")
+    release_turn(conversation_id, "task-2")
+    assert not acquire_turn(conversation_id, 2, "task-2")
+
+    release_turn(conversation_id, "task-1")
+    assert acquire_turn(conversation_id, 2, "task-2")
+
+
+def test_stalled_lane_is_skipped(conversation_id, monkeypatch):
+    """Test a ticket whose predecessor never shows up gets its turn after the stall timeout"""
+    assert acquire_turn(conversation_id, 1, "task-1")
+    release_turn(conversation_id, "task-1")
+    assert not acquire_turn(conversation_id, 3, "task-3"), "ticket 2 is still expected"
+
+    monkeypatch.setattr(config, "CONVERSATION_LANE_STALL_SECONDS", 0)
+    assert acquire_turn(conversation_id, 3, "task-3")
+
+
+async def test_cancellation_skips_issued_tickets(conversation_id):
+    """Test tickets of work cancelled by a takeover don't hold back the next message"""
+    tickets = [await next_ticket(conversation_id) for _ in range(3)]
+    assert tickets == [1, 2, 3]
+    assert acquire_turn(conversation_id, 1, "task-1")
+
+    await cancel_conversation_tasks(conversation_id)
+    ticket = await next_ticket(conversation_id)
+    assert not acquire_turn(conversation_id, ticket, "task-4"), "the running task keeps the lease"
+
+    release_turn(conversation_id, "task-1")
+    assert acquire_turn(conversation_id, ticket, "task-4"), "tickets 2 and 3 were revoked, no stall wait"
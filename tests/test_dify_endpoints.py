@@ -0,0 +1,121 @@
+import random
+
+import pytest
+
+from app.utils import dify_endpoints
+from app.utils.dify_endpoints import get_endpoint, pick_endpoint, tag, untag
+
+
+class FakePipeline:
+    """Answers EXISTS (down) and ZCOUNT (in flight) from dicts keyed by endpoint name"""
+
+    def __init__(self, down, load, error=None):
+        self.down, self.load, self.error = down, load, error
+        self.replies = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def _name(self, key):
+        return key.split(":")[-2]
+
+    def exists(self, key):
+        self.replies.append(int(self._name(key) in self.down))
+
+    def zcount(self, key, low, high):
+        self.replies.append(self.load.get(self._name(key), 0))
+
+    def execute(self):
+        if self.error:
+            raise self.error
+        return self.replies
+
+
+class FakeRedis:
+    def __init__(self, down=(), load=None, error=None):
+        self.down, self.load, self.error = set(down), load or {}, error
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self.down, self.load, self.error)
+
+
+@pytest.fixture(autouse=True)
+def pool(monkeypatch):
+    """A pool of a (the first, default one), b with twice the weight, and c"""
+    endpoints = dify_endpoints._load(
+        [
+            {"name": "a", "url": "https://a.test/v1", "key": "key-a"},
+            {"name": "b", "url": "https://b.test/v1", "key": "key-b", "weight": 2},
+            {"name": "c", "url": "https://c.test/v1", "key": "key-c"},
+        ]
+    )
+    monkeypatch.setattr(dify_endpoints, "ENDPOINTS", endpoints)
+    monkeypatch.setattr(dify_endpoints, "DEFAULT_ENDPOINT", endpoints["a"])
+    return endpoints
+
+
+@pytest.mark.parametrize(
+    "entries",
+    [
+        [{"name": "a", "url": "u", "key": "k"}, {"name": "a", "url": "v", "key": "l"}],
+        [{"name": "a/b", "url": "u", "key": "k"}],
+        [{"name": "a", "url": "u", "key": "k", "weight": 0}],
+    ],
+)
+def test_invalid_pools_are_rejected(entries):
+    with pytest.raises(ValueError):
+        dify_endpoints._load(entries)
+
+
+def test_stored_endpoint_names_resolve(pool):
+    assert get_endpoint(None) is pool["a"]
+    assert get_endpoint("") is pool["a"]
+    assert get_endpoint("b") is pool["b"]
+    assert get_endpoint("removed") is None
+    assert pool["b"].headers["Authorization"] == "Bearer key-b"
+
+
+def test_tag_round_trips_and_legacy_ids_are_on_the_default_endpoint(pool):
+    assert tag("b", "dify-id") == "b/dify-id"
+    assert tag(None, "dify-id") == "a/dify-id"
+    assert untag("b/dify-id") == (pool["b"], "dify-id")
+    assert untag("dify-id") == (pool["a"], "dify-id")
+    assert untag("removed/dify-id") == (None, "dify-id")
+
+
+def test_pick_prefers_the_least_loaded_per_weight(pool, monkeypatch):
+    # (load + 1) / weight: a 3, b 2.5, c 2
+    monkeypatch.setattr(dify_endpoints, "redis_client", FakeRedis(load={"a": 2, "b": 4, "c": 1}))
+    assert pick_endpoint() is pool["c"]
+
+    monkeypatch.setattr(dify_endpoints, "redis_client", FakeRedis(load={"a": 2, "b": 2, "c": 2}))
+    assert pick_endpoint() is pool["b"]
+
+
+def test_pick_skips_endpoints_marked_down(pool, monkeypatch):
+    monkeypatch.setattr(dify_endpoints, "redis_client", FakeRedis(down={"c"}, load={"a": 5, "b": 9}))
+    assert pick_endpoint() is pool["b"]
+
+    # With every endpoint down, one is still tried
+    monkeypatch.setattr(dify_endpoints, "redis_client", FakeRedis(down={"a", "b", "c"}, load={"a": 1, "b": 2}))
+    assert pick_endpoint() is pool["c"]
+
+
+def test_pick_falls_back_to_weights_without_redis(pool, monkeypatch):
+    monkeypatch.setattr(dify_endpoints, "redis_client", FakeRedis(error=ConnectionError("Redis is down")))
+    random.seed(7)
+
+    picks = [pick_endpoint().name for _ in range(4000)]
+
+    assert set(picks) == {"a", "b", "c"}
+    assert 1.7 < picks.count("b") / picks.count("a") < 2.3
+
+
+def test_single_endpoint_is_picked_without_redis(pool, monkeypatch):
+    monkeypatch.setattr(dify_endpoints, "ENDPOINTS", {"a": pool["a"]})
+    monkeypatch.setattr(dify_endpoints, "redis_client", None)
+
+    assert pick_endpoint() is pool["a"]
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from app import config, tasks
+from app.models.database import DifyResponse
+
+DIFY_RESULT = {
+    "event": "message",
+    "task_id": "dify-task",
+    "id": "dify-message",
+    "message_id": "dify-message",
+    "conversation_id": "dify-conversation",
+    "mode": "advanced-chat",
+    "answer": "Your ticket is escalated.",
+    "metadata": {
+        "usage": {"total_tokens": 1200, "latency": 2.5},
+        "retriever_resources": [{"content": "a long document chunk" * 100}],
+        config.DIFY_ACTIONS_TAG: json.dumps({"status": "open"}),
+        "cached": True,
+    },
+    "created_at": 1700000000,
+}
+
+
+class RecordingChatwoot:
+    def __init__(self):
+        self.queued = []
+
+    def queue_message_sync(self, conversation_id, message, private=False, idempotency_key=None):
+        self.queued.append((conversation_id, message, idempotency_key))
+
+
+@pytest.fixture
+def delivered(monkeypatch):
+    """Run handle_dify_response without Redis, recording what it hands to Chatwoot"""
+    chatwoot = RecordingChatwoot()
+    chatwoot.actions = []
+
+    async def apply_embedded_actions(conversation_id, actions):
+        chatwoot.actions.append((conversation_id, actions))
+        return {"status": {"status": "success"}}
+
+    chatwoot.stopped_typing = []
+    for name in ("untrack_task", "release_turn"):
+        monkeypatch.setattr(tasks, name, lambda *args, **kwargs: None)
+    monkeypatch.setattr(tasks, "stop_typing", chatwoot.stopped_typing.append)
+    monkeypatch.setattr(config, "OUTBOX_ENABLED", False)
+    monkeypatch.setattr(tasks, "is_cancelled", lambda *args: False)
+    monkeypatch.setattr(tasks, "chatwoot_for", lambda conversation_id: (chatwoot, conversation_id))
+    monkeypatch.setattr(tasks, "apply_embedded_actions", apply_embedded_actions)
+    return chatwoot
+
+
+def test_compact_result_keeps_what_the_callback_reads():
+    compact = tasks.compact_dify_result(DIFY_RESULT)
+
+    assert compact["metadata"] == {config.DIFY_ACTIONS_TAG: json.dumps({"status": "open"}), "cached": True}
+    assert "retriever_resources" not in json.dumps(compact)
+    full, reduced = DifyResponse(**DIFY_RESULT), DifyResponse(**compact)
+    assert reduced.model_dump(exclude={"id", "mode"}) == full.model_dump(exclude={"id", "mode"})
+
+
+def test_compact_result_is_delivered_like_the_full_one(delivered):
+    tasks.handle_dify_response(tasks.compact_dify_result(DIFY_RESULT), 7, task_id="celery-task")
+    from_compact = (list(delivered.queued), [(key, actions.status) for key, actions in delivered.actions])
+    delivered.queued.clear()
+    delivered.actions.clear()
+    tasks.handle_dify_response(DIFY_RESULT, 7, task_id="celery-task")
+
+    assert from_compact == (delivered.queued, [(key, actions.status) for key, actions in delivered.actions])
+    assert delivered.queued == [(7, "Your ticket is escalated.", "celery-task:answer")]
+    assert delivered.actions[0][1].status.value == "open"
+
+
+def test_callbacks_queued_with_a_dialogue_id_are_still_accepted(delivered):
+    """Test the signature of callbacks linked before dialogue_id was dropped still binds"""
+    tasks.handle_dify_response.s(conversation_id=7, dialogue_id=3, task_id="celery-task", received_at=None).apply(
+        args=(tasks.compact_dify_result(DIFY_RESULT),)
+    ).get()
+
+    assert delivered.queued == [(7, "Your ticket is escalated.", "celery-task:answer")]
+
+
+def test_skipped_results_are_not_delivered(delivered):
+    tasks.handle_dify_response({"status": "skipped", "reason": "superseded"}, 7, dialogue_id=3)
+
+    assert delivered.queued == []
+
+
+def test_typing_is_left_to_the_outbox_when_it_posts_the_answer(delivered, monkeypatch):
+    tasks.handle_dify_response(tasks.compact_dify_result(DIFY_RESULT), 7, task_id="celery-task")
+    assert delivered.stopped_typing == [7]
+
+    monkeypatch.setattr(config, "OUTBOX_ENABLED", True)
+    tasks.handle_dify_response(tasks.compact_dify_result(DIFY_RESULT), 8, task_id="celery-task")
+    tasks.handle_dify_response({"answer": " "}, 9, task_id="celery-task")
+    assert delivered.stopped_typing == [7, 9]
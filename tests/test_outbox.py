@@ -0,0 +1,119 @@
+from contextlib import asynccontextmanager
+from datetime import UTC, datetime, timedelta
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.future import select
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel
+
+from app import config, outbox
+from app.models.database import OutboxMessage
+from app.utils import metrics
+
+# The outbox dispatcher against an in-memory SQLite database, posting to a recording Chatwoot handler
+
+pytest.importorskip("aiosqlite")
+
+
+class RecordingChatwoot:
+    def __init__(self):
+        self.posted = []
+        self.typing = []
+
+    def get(self, account_id=None):
+        return self
+
+    async def send_message(self, conversation_id, message, private=False):
+        self.posted.append((conversation_id, message))
+        return {"id": len(self.posted)}
+
+    async def toggle_typing(self, conversation_id, typing):
+        self.typing.append((conversation_id, typing))
+
+
+@pytest.fixture
+async def engine(monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all, tables=[OutboxMessage.__table__])
+
+    @asynccontextmanager
+    async def get_async_db():
+        async with AsyncSession(engine) as session:
+            yield session
+            await session.commit()
+
+    async def record(*args):
+        pass
+
+    monkeypatch.setattr(outbox, "get_async_db", get_async_db)
+    monkeypatch.setattr(metrics, "aincr", record)
+    monkeypatch.setattr(metrics, "aobserve", record)
+    yield engine
+    await engine.dispose()
+
+
+async def queue(engine, conversation_id, content, next_attempt_at=None):
+    async with AsyncSession(engine) as session:
+        session.add(
+            OutboxMessage(
+                idempotency_key=content,
+                conversation_id=conversation_id,
+                content=content,
+                attempts=1 if next_attempt_at else 0,
+                next_attempt_at=next_attempt_at,
+            )
+        )
+        await session.commit()
+
+
+async def statuses(engine):
+    async with AsyncSession(engine) as session:
+        result = await session.execute(select(OutboxMessage.content, OutboxMessage.status))
+        return dict(result.all())
+
+
+async def test_messages_backing_off_dont_starve_other_conversations(engine, monkeypatch):
+    """Test a batch full of messages waiting for a retry still lets due conversations through"""
+    monkeypatch.setattr(config, "OUTBOX_BATCH_SIZE", 2)
+    later = datetime.now(UTC) + timedelta(hours=1)
+    await queue(engine, 1, "first-1", next_attempt_at=later)
+    await queue(engine, 2, "first-2", next_attempt_at=later)
+    await queue(engine, 1, "second-1")
+    await queue(engine, 3, "first-3")
+    await queue(engine, 3, "second-3")
+
+    chatwoot = RecordingChatwoot()
+    assert await outbox.OutboxDispatcher(chatwoot).dispatch_once() == 2
+
+    assert chatwoot.posted == [(3, "first-3"), (3, "second-3")]
+    assert await statuses(engine) == {
+        "first-1": "pending",
+        "first-2": "pending",
+        "second-1": "pending",  # held back by the retry of its conversation's first message
+        "first-3": "sent",
+        "second-3": "sent",
+    }
+
+
+async def test_conversation_is_posted_once_its_retry_is_due(engine):
+    """Test a message whose retry is due is posted first, followed by the ones queued behind it"""
+    await queue(engine, 1, "first-1", next_attempt_at=datetime.now(UTC) - timedelta(seconds=1))
+    await queue(engine, 1, "second-1")
+
+    chatwoot = RecordingChatwoot()
+    assert await outbox.OutboxDispatcher(chatwoot).dispatch_once() == 2
+    assert chatwoot.posted == [(1, "first-1"), (1, "second-1")]
+    assert await outbox.OutboxDispatcher(chatwoot).dispatch_once() == 0
+
+
+async def test_typing_is_cleared_once_an_answer_is_posted(engine, monkeypatch):
+    """Test the indicator the worker left on goes off with the posted answer, not with other messages"""
+    monkeypatch.setattr(config, "TYPING_INDICATOR_ENABLED", True)
+    await queue(engine, 1, "task-1:error")
+    await queue(engine, 2, "task-2:answer")
+
+    chatwoot = RecordingChatwoot()
+    assert await outbox.OutboxDispatcher(chatwoot).dispatch_once() == 2
+    assert chatwoot.typing == [(2, False)]
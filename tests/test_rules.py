@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from app.utils.rules import FastLaneRule, RuleEngine, load_rules
+
+
+def rule(name, patterns, **fields):
+    return FastLaneRule(name=name, patterns=patterns, **{"reply": "ok", **fields})
+
+
+def test_phrase_matches_on_word_boundaries_case_insensitively():
+    """Test a phrase matches anywhere in the message, but not inside another word"""
+    engine = RuleEngine([rule("operator", ["operator", "real person"])])
+
+    assert engine.match("Can I talk to a REAL PERSON please?").name == "operator"
+    assert engine.match("operator") is not None
+    assert engine.match("the cooperators meeting") is None
+    assert engine.match("") is None
+    assert engine.match(None) is None
+
+
+def test_exact_rule_needs_the_whole_message():
+    """Test an exact rule ignores surrounding spaces and trailing punctuation, nothing else"""
+    engine = RuleEngine([rule("stop", ["stop"], exact=True)])
+
+    assert engine.match("  Stop!! ").name == "stop"
+    assert engine.match("don't stop") is None
+    assert engine.match("stop it") is None
+
+
+def test_regex_rule():
+    """Test regex patterns are used as is, named groups inside them included"""
+    engine = RuleEngine([rule("order", [r"order\s+(?P<number>\d{5})"], regex=True)])
+
+    assert engine.match("where is order 12345").name == "order"
+    assert engine.match("where is order 12a45") is None
+
+
+def test_plain_patterns_are_escaped():
+    """Test regex characters in plain phrases are matched literally"""
+    engine = RuleEngine([rule("price", ["price (eur)"])])
+
+    assert engine.match("what is the price (eur)") is not None
+    assert engine.match("what is the price eur") is None
+
+
+def test_first_matching_rule_wins_whatever_the_index():
+    """Test the matched group maps back to its rule, with more than ten rules"""
+    rules = [rule(f"rule-{index}", [f"word{index}"]) for index in range(12)]
+    engine = RuleEngine(rules)
+
+    assert engine.match("about word11").name == "rule-11"
+    assert engine.match("word1").name == "rule-1"
+    assert engine.match("word11 and word3").name == "rule-11"
+    assert RuleEngine([rule("a", ["hours"]), rule("b", ["opening hours"])]).match("opening hours").name == "b"
+    assert RuleEngine([rule("a", ["opening hours"]), rule("b", ["hours"])]).match("opening hours").name == "a"
+
+
+def test_no_rules_match_nothing():
+    assert RuleEngine([]).match("anything") is None
+    assert load_rules(None).match("anything") is None
+
+
+def test_render_reply_keeps_unknown_placeholders():
+    """Test missing values render empty and unknown placeholders are left as written"""
+    reply_rule = rule("hello", ["hi"], reply="Hello {sender_name}, conversation {conversation_id} {unknown}")
+
+    assert (
+        RuleEngine.render_reply(reply_rule, sender_name=None, conversation_id=7) == "Hello , conversation 7 {unknown}"
+    )
+
+
+def test_rule_without_patterns_is_rejected():
+    with pytest.raises(ValueError, match="no patterns"):
+        RuleEngine([rule("empty", [])])
+
+
+def test_rule_without_reply_or_actions_is_rejected():
+    with pytest.raises(ValueError, match="neither a reply nor actions"):
+        RuleEngine([rule("silent", ["hello"], reply=None)])
+
+
+def test_rule_with_actions_only_is_accepted():
+    engine = RuleEngine([rule("close", ["bye"], reply=None, actions={"status": "resolved"})])
+
+    assert engine.match("ok bye").actions.status == "resolved"
+
+
+def test_load_rules_from_file(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps([{"name": "stop", "patterns": ["stop"], "exact": True, "reply": "Stopped"}]))
+
+    engine = load_rules(str(path))
+    assert [loaded.name for loaded in engine.rules] == ["stop"]
+    assert engine.match("stop").reply == "Stopped"
@@ -0,0 +1,163 @@
+import json
+from contextlib import nullcontext
+
+import httpx
+import pytest
+
+from app import config, tasks
+from app.utils import backlog, metrics, task_checkpoints
+from app.utils.dify_endpoints import DifyEndpoint
+
+# process_message_with_dify run eagerly, with Dify behind a mock transport and Redis replaced by dicts
+
+
+class FakeHashes:
+    """The Redis hash commands task_checkpoints uses"""
+
+    def __init__(self):
+        self.hashes = {}
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self):
+        return []
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    def hmget(self, key, *fields):
+        return [self.hashes.get(key, {}).get(field) for field in fields]
+
+    def hdel(self, key, field):
+        self.hashes.get(key, {}).pop(field, None)
+
+    def expire(self, key, seconds):
+        pass
+
+
+class RecordingChatwoot:
+    def __init__(self):
+        self.statuses = []
+        self.queued = []
+
+    def toggle_status_sync(self, conversation_id, status, **kwargs):
+        self.statuses.append((conversation_id, status))
+
+    def queue_message_sync(self, conversation_id, message, private=False, idempotency_key=None):
+        self.queued.append((conversation_id, idempotency_key))
+
+
+class Worker:
+    def __init__(self):
+        self.checkpoints = FakeHashes()
+        self.buffer = []
+        self.chatwoot = RecordingChatwoot()
+        self.queries = []
+        self.dify = lambda request: httpx.Response(200, json={"answer": "Hi", "conversation_id": "dify-1"})
+
+    def checkpoint(self, task_id, **fields):
+        for field, value in fields.items():
+            self.checkpoints.hset(task_checkpoints._key(task_id), field, json.dumps(value))
+
+    def checkpointed(self, task_id):
+        return self.checkpoints.hashes.get(task_checkpoints._key(task_id), {})
+
+    def run(self, task_id, **kwargs):
+        kwargs = {
+            "message": "Where is my order?",
+            "chatwoot_conversation_id": "7",
+            "message_type": "incoming",
+            **kwargs,
+        }
+        return tasks.process_message_with_dify.apply(kwargs=kwargs, task_id=task_id)
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    worker = Worker()
+    client = httpx.Client
+
+    def dify(request):
+        worker.queries.append(json.loads(request.content)["query"])
+        return worker.dify(request)
+
+    def pop_buffered_messages_sync(conversation_id):
+        lines, worker.buffer[:] = list(worker.buffer), []
+        return lines
+
+    for name, value in {
+        "TYPING_INDICATOR_ENABLED": False,
+        "ANSWER_CACHE_ENABLED": False,
+        "SKIP_SUPERSEDED_MESSAGES": False,
+        "MESSAGE_DEADLINE_SECONDS": 0,
+        "DIFY_RESPONSE_MODE": "blocking",
+    }.items():
+        monkeypatch.setattr(config, name, value)
+    monkeypatch.setattr(task_checkpoints, "redis_client", worker.checkpoints)
+    monkeypatch.setattr(metrics, "incr", lambda *args: None)
+    monkeypatch.setattr(backlog, "mark_started_sync", lambda task_id: None)
+    monkeypatch.setattr(backlog, "timed_service", nullcontext)
+    monkeypatch.setattr(tasks, "in_flight", lambda endpoint, request_id: nullcontext())
+    monkeypatch.setattr(tasks, "is_cancelled", lambda *args: False)
+    monkeypatch.setattr(tasks, "get_dialogue_sync", lambda conversation_id: None)
+    monkeypatch.setattr(tasks, "update_dialogue_dify_id_sync", lambda *args: None)
+    monkeypatch.setattr(tasks, "record_dify_turn_sync", lambda conversation_id: None)
+    monkeypatch.setattr(tasks, "pop_buffered_messages_sync", pop_buffered_messages_sync)
+    monkeypatch.setattr(tasks, "buffer_lines_sync", lambda conversation_id, lines: worker.buffer.extend(lines))
+    monkeypatch.setattr(tasks, "chatwoot_for", lambda key: (worker.chatwoot, int(key)))
+    monkeypatch.setattr(tasks, "pick_endpoint", lambda: DifyEndpoint(name="a", url="https://dify.test/v1", key="k"))
+    monkeypatch.setattr(
+        tasks.httpx, "Client", lambda timeout: client(transport=httpx.MockTransport(dify), timeout=timeout)
+    )
+    return worker
+
+
+def test_redelivered_task_returns_the_checkpointed_answer(worker):
+    worker.checkpoint("task-1", context=["[customer] Hello"], result={"answer": "Checkpointed"})
+
+    assert worker.run("task-1").get() == {"answer": "Checkpointed"}
+    assert worker.queries == []
+
+
+def test_redelivered_task_takes_back_the_checkpointed_context(worker):
+    """Test lines popped by a run cut off before Dify answered go along with the redelivered run"""
+    worker.checkpoint("task-1", context=["[customer] Hello"])
+    worker.buffer.append("[customer] Anyone there?")
+
+    result = worker.run("task-1").get()
+
+    assert result["answer"] == "Hi"
+    assert "[customer] Hello" in worker.queries[0] and "[customer] Anyone there?" in worker.queries[0]
+    assert json.loads(worker.checkpointed("task-1")["result"]) == result
+
+
+@pytest.mark.parametrize(
+    "response, dify_conversation_id, handed_over",
+    [
+        (httpx.Response(400, json={"message": "Invalid query"}), None, True),
+        (httpx.Response(500, text="Internal error"), None, True),
+        # Retried until max_retries, Celery then raises the error itself
+        (httpx.Response(404, json={"message": "Not found"}), "dify-1", False),
+    ],
+)
+def test_failed_task_puts_the_context_back(worker, response, dify_conversation_id, handed_over):
+    """Test the lines a failed run took out of the buffer are kept, once, for the conversation's next message"""
+    worker.checkpoint("task-1", context=["[customer] Hello"])
+    worker.buffer.append("[customer] Anyone there?")
+    worker.dify = lambda request: response
+
+    result = worker.run("task-1", dify_conversation_id=dify_conversation_id)
+
+    assert result.failed()
+    assert worker.buffer == ["[customer] Hello", "[customer] Anyone there?"]
+    assert "context" not in worker.checkpointed("task-1")
+    if handed_over:
+        assert worker.chatwoot.statuses == [(7, "open")]
+        assert worker.chatwoot.queued == [(7, "task-1:error")]